@@ -1,3 +1,4 @@
+from . import db  # noqa: F401  connects the sqlite pragma hook
 from .celery import app as celery_app
 
 __all__ = ("celery_app",)
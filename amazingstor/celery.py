@@ -2,6 +2,7 @@ import os
 
 from celery import Celery
 from celery.schedules import crontab
+from django.conf import settings
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "amazingstor.settings")
 
@@ -9,12 +10,32 @@ app = Celery("amazingstor")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
 
+from amazingstor import metrics  # noqa: E402,F401  connects task duration receivers
 
+
+# expired carts are killed by kill_due_carts off the expiry index, kill_old_carts sweeps only as a safety net
+# for carts the index missed
 app.conf.beat_schedule = {
-    'kill_old_carts': {
+    'kill_old_carts' if worker == 0 else f'kill_old_carts_{worker}': {
         'task': 'carts.tasks.kill_old_carts',
-        'schedule': crontab(minute='*/1'),
-
-    },
-
+        'schedule': crontab(minute='*/15'),
+        'kwargs': {'worker': worker},
+    }
+    for worker in range(settings.CART_SWEEP_WORKERS)
+}
+app.conf.beat_schedule['refresh_cart_daily_totals'] = {
+    'task': 'carts.tasks.refresh_cart_daily_totals',
+    'schedule': crontab(minute='*/1'),
+}
+app.conf.beat_schedule['kill_due_carts'] = {
+    'task': 'carts.tasks.kill_due_carts',
+    'schedule': settings.CART_EXPIRY_POLL_INTERVAL,
+}
+app.conf.beat_schedule['reconcile_hot_stock'] = {
+    'task': 'carts.tasks.reconcile_hot_stock',
+    'schedule': settings.HOT_STOCK_RECONCILE_INTERVAL,
+}
+app.conf.beat_schedule['release_stale_reservations'] = {
+    'task': 'carts.tasks.release_stale_reservations',
+    'schedule': settings.STOCK_COALESCE_GRACE,
 }
@@ -0,0 +1,233 @@
+"""
+process local request and task metrics, rendered in prometheus text format by amazingstor.views.metrics.
+requests are recorded by amazingstor.middleware.RequestMetricsMiddleware, celery tasks by the signal
+receivers below. every worker process keeps its own series, so scrape each process or run one per target.
+turn recording off at runtime with the request_metrics server setting, or for good with METRICS_ENABLED.
+"""
+import bisect
+import contextvars
+import threading
+import time
+
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERIES_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+COUNT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def format_labels(names, values, extra: str = '') -> str:
+    labels = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+class Metric:
+    """ base of a labelled metric, its samples are kept by label values """
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            samples = sorted(self.samples.items())
+            lines.extend(self.render_sample(values, sample) for values, sample in samples)
+        return lines
+
+    def render_sample(self, values, sample) -> str:
+        raise NotImplementedError
+
+    def clear(self):
+        with self.lock:
+            self.samples.clear()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *values, amount: float = 1):
+        with self.lock:
+            self.samples[values] = self.samples.get(values, 0) + amount
+
+    def render_sample(self, values, sample) -> str:
+        return f'{self.name}{format_labels(self.labels, values)} {sample}'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            sample = self.samples.get(values)
+            if sample is None:
+                # per bucket counts, the last one is +Inf, then sum
+                sample = self.samples[values] = [0] * (len(self.buckets) + 1) + [0.0]
+            sample[index] += 1
+            sample[-1] += value
+
+    def render_sample(self, values, sample) -> str:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), sample):
+            cumulative += count
+            bucket_labels = format_labels(self.labels, values, 'le="%s"' % bound)
+            lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+        labels = format_labels(self.labels, values)
+        lines.append(f'{self.name}_sum{labels} {sample[-1]}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return '\n'.join(lines)
+
+
+current_timer = contextvars.ContextVar('query_timer', default=None)
+
+
+class QueryTimer:
+    """
+    counts and times queries run while it is entered, and keeps the slow ones. it is found through a context
+    variable, so queries an async view runs on sync_to_async threads are seen too. timers nest, an inner
+    timer also reports to the outer one
+    """
+    def __init__(self, slow_query_seconds: float = float('inf')):
+        self.slow_query_seconds = slow_query_seconds
+        self.count = 0
+        self.seconds = 0.0
+        self.slow = []
+        self.parent = None
+        self.token = None
+
+    def __enter__(self):
+        self.parent = current_timer.get()
+        self.token = current_timer.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        current_timer.reset(self.token)
+
+    def record(self, duration: float, sql: str):
+        self.count += 1
+        self.seconds += duration
+        if duration >= self.slow_query_seconds:
+            self.slow.append((duration, sql))
+        if self.parent is not None:
+            self.parent.record(duration, sql)
+
+
+def time_query(execute, sql, params, many, context):
+    """ execute wrapper of every connection, a no op unless a QueryTimer is entered """
+    timer = current_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timer.record(time.perf_counter() - started, sql)
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+REQUEST_LABELS = ('route', 'method')
+
+request_duration = Histogram(
+    'http_request_duration_seconds', 'wall time of a request, from middleware to response', REQUEST_LABELS,
+)
+request_queries = Histogram(
+    'http_request_queries', 'database queries run by a request', REQUEST_LABELS, buckets=QUERIES_BUCKETS,
+)
+request_query_duration = Histogram(
+    'http_request_query_duration_seconds', 'time a request spent waiting on the database', REQUEST_LABELS,
+)
+requests_total = Counter('http_requests_total', 'finished requests by status code', REQUEST_LABELS + ('status',))
+slow_queries_total = Counter('db_slow_queries_total', 'queries slower than METRICS_SLOW_QUERY_SECONDS', ('route',))
+task_duration = Histogram('celery_task_duration_seconds', 'run time of a celery task', ('task',))
+killed_carts = Histogram(
+    'kill_old_carts_killed_carts', 'carts killed by one kill_old_carts run', buckets=COUNT_BUCKETS,
+)
+kill_old_carts_skipped_total = Counter(
+    'kill_old_carts_skipped_total', 'kill_old_carts runs skipped because another run held the lease',
+)
+
+METRICS = [
+    request_duration, request_queries, request_query_duration, requests_total, slow_queries_total,
+    task_duration, killed_carts, kill_old_carts_skipped_total,
+]
+
+
+def enabled() -> bool:
+    """ will tell if metrics should be recorded right now """
+    if not settings.METRICS_ENABLED:
+        return False
+    from carts import server_settings
+
+    return server_settings.get_bool('request_metrics')
+
+
+async def aenabled() -> bool:
+    """ async twin of enabled """
+    if not settings.METRICS_ENABLED:
+        return False
+    from carts import server_settings
+
+    return await server_settings.aget_bool('request_metrics')
+
+
+def render() -> str:
+    return '\n'.join(line for metric in METRICS for line in metric.render()) + '\n'
+
+
+def clear():
+    """ will drop all recorded samples """
+    for metric in METRICS:
+        metric.clear()
+
+
+def observe_request(route: str, method: str, status: int, seconds: float, queries: int, query_seconds: float):
+    request_duration.observe(seconds, route, method)
+    request_queries.observe(queries, route, method)
+    request_query_duration.observe(query_seconds, route, method)
+    requests_total.inc(route, method, str(status))
+
+
+task_started = {}
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, **kwargs):
+    if enabled():
+        task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def record_task(task_id=None, task=None, retval=None, **kwargs):
+    started = task_started.pop(task_id, None)
+    if started is None:
+        return
+    task_duration.observe(time.perf_counter() - started, task.name)
+    if task.name == 'carts.tasks.kill_old_carts':
+        if retval is None:
+            kill_old_carts_skipped_total.inc()
+        elif isinstance(retval, int):
+            killed_carts.observe(retval)
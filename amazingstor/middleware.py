@@ -0,0 +1,60 @@
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from amazingstor import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class RequestMetricsMiddleware:
+    """
+    will record wall time, query count and query time of every request into amazingstor.metrics,
+    labelled by route name, and log queries slower than METRICS_SLOW_QUERY_SECONDS.
+    for streamed responses only the time until the response starts is recorded.
+    it works both ways, so async views under ASGI are not pushed into a thread by it
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not metrics.enabled():
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        with metrics.QueryTimer(settings.METRICS_SLOW_QUERY_SECONDS) as timer:
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, timer)
+        return response
+
+    async def __acall__(self, request):
+        if not await metrics.aenabled():
+            return await self.get_response(request)
+
+        started = time.perf_counter()
+        with metrics.QueryTimer(settings.METRICS_SLOW_QUERY_SECONDS) as timer:
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, timer)
+        return response
+
+    def record(self, request, response, duration: float, timer: metrics.QueryTimer):
+        # view names, not paths, so label count stays bounded
+        resolver_match = getattr(request, 'resolver_match', None)
+        route = resolver_match.view_name if resolver_match else 'unmatched'
+        metrics.observe_request(route, request.method, response.status_code, duration, timer.count, timer.seconds)
+        for query_duration, sql in timer.slow[:settings.METRICS_SLOW_QUERY_SAMPLES]:
+            logger.warning('slow query on %s: %.3fs %s', route, query_duration, sql)
+        if timer.slow:
+            metrics.slow_queries_total.inc(route, amount=len(timer.slow))
@@ -0,0 +1,9 @@
+import os
+
+from amazingstor.settings.base import *  # noqa: F401,F403
+from amazingstor.settings.base import BASE_DIR
+from amazingstor.settings.databases import build_databases
+
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'sqlite')
+
+DATABASES = build_databases(DATABASE_PROFILE, BASE_DIR)
@@ -0,0 +1,277 @@
+"""
+Django settings for amazingstor project.
+
+Generated by 'django-admin startproject' using Django 5.1.2.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.1/topics/settings/
+
+For the full list of settings and their values, see
+https://docs.djangoproject.com/en/5.1/ref/settings/
+"""
+
+import os
+from pathlib import Path
+
+# Build paths inside the project like this: BASE_DIR / 'subdir'.
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+
+
+# Quick-start development settings - unsuitable for production
+# See https://docs.djangoproject.com/en/5.1/howto/deployment/checklist/
+
+# SECURITY WARNING: keep the secret key used in production secret!
+SECRET_KEY = 'django-insecure-rfbl&*t-a&7%j%-dq=+uh$-)ny5%qqn@#@kt1w-kxadcjycg1p'
+
+# SECURITY WARNING: don't run with debug turned on in production!
+DEBUG = True
+
+ALLOWED_HOSTS = []
+
+
+# Application definition
+
+INSTALLED_APPS = [
+    'django.contrib.admin',
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django.contrib.messages',
+    'django.contrib.staticfiles',
+
+    'rest_framework',
+    'drf_spectacular',
+    'django_celery_beat',
+
+    'carts',
+    'products',
+    'auths',
+]
+
+MIDDLEWARE = [
+    'amazingstor.middleware.RequestMetricsMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'django.middleware.csrf.CsrfViewMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'django.contrib.messages.middleware.MessageMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+ROOT_URLCONF = 'amazingstor.urls'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'DIRS': [],
+        'APP_DIRS': True,
+        'OPTIONS': {
+            'context_processors': [
+                'django.template.context_processors.debug',
+                'django.template.context_processors.request',
+                'django.contrib.auth.context_processors.auth',
+                'django.contrib.messages.context_processors.messages',
+            ],
+        },
+    },
+]
+
+WSGI_APPLICATION = 'amazingstor.wsgi.application'
+
+
+# Database
+# https://docs.djangoproject.com/en/5.1/ref/settings/#databases
+
+# DATABASES is built from the DATABASE_PROFILE env var, see amazingstor/settings/databases.py
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+
+if os.environ.get('CACHE_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['CACHE_REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+
+# Password validation
+# https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
+    },
+    {
+        'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
+    },
+]
+
+
+# Internationalization
+# https://docs.djangoproject.com/en/5.1/topics/i18n/
+
+LANGUAGE_CODE = 'en-us'
+
+TIME_ZONE = 'UTC'
+
+USE_I18N = True
+
+USE_TZ = True
+
+
+# Static files (CSS, JavaScript, Images)
+# https://docs.djangoproject.com/en/5.1/howto/static-files/
+
+STATIC_URL = 'static/'
+
+# Default primary key field type
+# https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
+
+DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+REST_FRAMEWORK = {
+    'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    'DEFAULT_AUTHENTICATION_CLASSES': (
+        'auths.authentication.CachedJWTAuthentication',
+    ),
+    # orjson when installed, plain JSONRenderer output otherwise
+    'DEFAULT_RENDERER_CLASSES': (
+        'amazingstor.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+}
+
+SPECTACULAR_SETTINGS = {
+    'TITLE': 'Amazing Stor! (with no e)',
+    'DESCRIPTION': 'prototype for a cart structure on Amazing Stor! (with no e)',
+    'VERSION': '1.0.0',
+    'SERVE_INCLUDE_SCHEMA': False,
+}
+
+
+CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers.DatabaseScheduler'
+
+CELERY_BROKER_URL = "redis://localhost:6379"
+CELERY_RESULT_BACKEND = "redis://localhost:6379"
+
+
+# Carts
+
+# how many expired carts kill_old_carts kills in one transaction
+CART_SWEEP_CHUNK_SIZE = 500
+# seconds kill_old_carts may keep sweeping in one run, keep it below the beat interval
+CART_SWEEP_TIME_BUDGET = 50
+# extra seconds a kill_old_carts lease outlives its time budget, in case the last chunk runs late
+CART_SWEEP_LEASE_MARGIN = 10
+# number of kill_old_carts worker slots beat starts every minute, each slot drains expired carts in parallel
+CART_SWEEP_WORKERS = 1
+
+# redis used by task leases and the cart expiry index, without it they fall back to database tables
+CART_REDIS_URL = os.environ.get('CART_REDIS_URL')
+
+# where task leases are kept, 'redis' or 'database'
+CART_LEASE_BACKEND = 'redis' if CART_REDIS_URL else 'database'
+
+# seconds a process trusts its copy of ServerSetting values before checking the shared version key
+SERVER_SETTINGS_CACHE_TTL = 5
+
+# seconds refresh_cart_daily_totals looks back behind the start of its last run, to catch carts committed late
+CART_TOTALS_REFRESH_MARGIN = 300
+# how many carts refresh_cart_daily_totals recomputes at once
+CART_TOTALS_REFRESH_CHUNK_SIZE = 1000
+
+# how many rollup rows a streamed cart report reads from database at once
+CART_REPORT_STREAM_CHUNK_SIZE = 2000
+
+# cache alias of the cart report cache, and seconds its entries are fresh / may still be served stale
+CART_REPORT_CACHE_ALIAS = 'default'
+CART_REPORT_CACHE_FRESH_TTL = 10
+CART_REPORT_CACHE_STALE_TTL = 300
+# seconds one worker may take to refresh a stale report before another one is allowed to try
+CART_REPORT_CACHE_LOCK_TTL = 30
+# seconds a request waits for the report another worker is computing on a cold miss, before computing it too
+CART_REPORT_CACHE_MISS_WAIT = 10
+
+# cache alias and seconds of per user cart list snapshots
+CART_SNAPSHOT_CACHE_ALIAS = 'default'
+CART_SNAPSHOT_CACHE_TTL = 300
+
+# cache alias of Idempotency-Key responses of cart writes, seconds they are replayed, seconds a running request
+# holds its key and seconds a duplicate waits for it before giving up with 409
+CART_IDEMPOTENCY_CACHE_ALIAS = 'default'
+CART_IDEMPOTENCY_TTL = 24 * 60 * 60
+CART_IDEMPOTENCY_LOCK_TTL = 30
+CART_IDEMPOTENCY_WAIT = 10
+
+# where cart expiry index is kept, 'redis' or 'database'
+CART_EXPIRY_BACKEND = 'redis' if CART_REDIS_URL else 'database'
+# seconds between two kill_due_carts runs, and how many due carts it kills at once
+CART_EXPIRY_POLL_INTERVAL = 5
+CART_EXPIRY_BATCH_SIZE = 500
+
+# seconds concurrent reservations of one product are gathered to be taken with a single UPDATE, 0 turns it off.
+# postgresql only, see carts/coalescer.py
+STOCK_COALESCE_WINDOW = float(os.environ.get('STOCK_COALESCE_WINDOW', 0))
+# threads of a process flushing coalesced reservations of different products at the same time
+STOCK_COALESCE_WORKERS = 4
+# seconds a coalesced reservation may wait for its request to save it before release_stale_reservations gives
+# it back to stock
+STOCK_COALESCE_GRACE = 60
+
+# where stock counters of hot products are kept, see carts/hot_stock.py. every process must see the same counters,
+# so products can only be made hot with redis. 'local' keeps them in process memory, for tests only
+HOT_STOCK_BACKEND = 'redis' if CART_REDIS_URL else None
+# counters per hot product, keep it fixed while any product is hot
+HOT_STOCK_SHARDS = 8
+# seconds between two reconcile_hot_stock runs, which fold journaled changes into products stock quantity
+HOT_STOCK_RECONCILE_INTERVAL = 5
+# seconds a change of hot stock may stay pending before reconcile_hot_stock settles it against the database
+HOT_STOCK_SETTLE_GRACE = 60
+# seconds a process trusts its set of hot products before checking the shared version key
+HOT_STOCK_CACHE_TTL = 2
+
+
+# Products
+
+# cache alias of product catalog, seconds its pages are cached and seconds a product stock quantity is cached
+PRODUCT_CATALOG_CACHE_ALIAS = 'default'
+PRODUCT_CATALOG_PAGE_TTL = 60
+PRODUCT_STOCK_CACHE_TTL = 2
+PRODUCT_CATALOG_PAGE_SIZE = 50
+PRODUCT_CATALOG_MAX_PAGE_SIZE = 500
+
+
+# Auths
+
+# cache alias and seconds of authenticated users cache
+AUTHS_USER_CACHE_ALIAS = 'default'
+AUTHS_USER_CACHE_TTL = 60
+# build request.user from token claims only, without looking the user up at all
+AUTHS_STATELESS_JWT = False
+
+
+# Metrics
+# request and task metrics served at /metrics/, see amazingstor/metrics.py
+# the request_metrics server setting turns recording off at runtime, this turns it off for good
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+METRICS_SLOW_QUERY_SECONDS = 0.1
+# at most this many slow queries of one request are logged
+METRICS_SLOW_QUERY_SAMPLES = 3
@@ -0,0 +1,93 @@
+"""
+database profiles, picked with the DATABASE_PROFILE env var.
+
+sqlite             - WAL journal, busy timeout and relaxed fsync, the default
+sqlite_default     - exactly the settings the project shipped with before (rollback journal, deferred transactions,
+                     5s lock timeout, no persistent connections), kept as the benchmarks baseline
+postgresql         - psycopg 3 with django's native connection pool (needs psycopg[pool])
+postgresql_persistent - psycopg with CONN_MAX_AGE persistent connections and health checks
+
+the sqlite pragmas are not connection options, they are run by amazingstor.db on connection_created.
+"""
+
+import os
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def sqlite_baseline_database(base_dir):
+    """ will return the sqlite database the project shipped with before the profiles, untouched """
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': base_dir / 'db.sqlite3',
+    }
+
+
+def sqlite_database(base_dir):
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('DATABASE_NAME', base_dir / 'db.sqlite3'),
+        'OPTIONS': {
+            # take the write lock at BEGIN, so concurrent cart transactions queue up instead of failing
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # keep the connection (and its page cache) between requests of the same thread
+        'CONN_MAX_AGE': env_int('DATABASE_CONN_MAX_AGE', 60),
+        'PRAGMAS': SQLITE_PRAGMAS,
+        'TEST': {
+            # file backed, so threaded stock reservation tests get real separate connections
+            'NAME': base_dir / 'test_db.sqlite3',
+        },
+    }
+
+
+def postgresql_database(pool):
+    database = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('DATABASE_NAME', 'amazingstor'),
+        'USER': os.environ.get('DATABASE_USER', 'amazingstor'),
+        'PASSWORD': os.environ.get('DATABASE_PASSWORD', ''),
+        'HOST': os.environ.get('DATABASE_HOST', 'localhost'),
+        'PORT': os.environ.get('DATABASE_PORT', '5432'),
+        'OPTIONS': {},
+    }
+    if pool:
+        # django refuses a pool together with persistent connections, the pool does the reuse
+        database['CONN_MAX_AGE'] = 0
+        database['OPTIONS']['pool'] = {
+            'min_size': env_int('DATABASE_POOL_MIN_SIZE', 2),
+            'max_size': env_int('DATABASE_POOL_MAX_SIZE', 10),
+            'timeout': env_int('DATABASE_POOL_TIMEOUT', 10),
+        }
+    else:
+        database['CONN_MAX_AGE'] = env_int('DATABASE_CONN_MAX_AGE', 600)
+        database['CONN_HEALTH_CHECKS'] = True
+    return database
+
+
+SQLITE_PRAGMAS = {
+    # readers no longer block the writer and the other way around
+    'journal_mode': 'WAL',
+    # wait for the write lock inside sqlite instead of failing with "database is locked"
+    'busy_timeout': 20000,
+    # with WAL, NORMAL only fsyncs at checkpoints and stays corruption safe
+    'synchronous': 'NORMAL',
+}
+
+
+def build_databases(profile, base_dir):
+    """ will return the DATABASES setting of the given profile """
+    if profile == 'sqlite':
+        database = sqlite_database(base_dir)
+    elif profile == 'sqlite_default':
+        database = sqlite_baseline_database(base_dir)
+    elif profile == 'postgresql':
+        database = postgresql_database(pool=True)
+    elif profile == 'postgresql_persistent':
+        database = postgresql_database(pool=False)
+    else:
+        raise ValueError(f'unknown DATABASE_PROFILE {profile!r}')
+    return {'default': database}
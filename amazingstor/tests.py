@@ -0,0 +1,113 @@
+import datetime
+import decimal
+import uuid
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from amazingstor import metrics
+from amazingstor.renderers import FastJSONRenderer
+from amazingstor.settings.base import BASE_DIR
+from amazingstor.settings.databases import build_databases
+from carts import server_settings
+from carts.models import ServerSetting
+from carts.tasks import kill_old_carts
+
+
+class DatabaseProfileTest(TestCase):
+    def test_sqlite_pragmas_are_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+
+    def test_profiles(self):
+        # the benchmarks baseline, exactly what the project shipped with
+        self.assertEqual(build_databases('sqlite_default', BASE_DIR)['default'], {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        })
+        pooled = build_databases('postgresql', BASE_DIR)['default']
+        self.assertEqual(pooled['CONN_MAX_AGE'], 0)
+        self.assertIn('pool', pooled['OPTIONS'])
+        persistent = build_databases('postgresql_persistent', BASE_DIR)['default']
+        self.assertGreater(persistent['CONN_MAX_AGE'], 0)
+        self.assertNotIn('pool', persistent['OPTIONS'])
+        with self.assertRaises(ValueError):
+            build_databases('mysql', BASE_DIR)
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        server_settings.snapshot.invalidate()
+        metrics.clear()
+        self.user = get_user_model().objects.create_user(username='metrics_user', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_request_metrics_by_route(self):
+        self.assertEqual(self.client.get('/cart/cart/').status_code, 200)
+        body = self.client.get('/metrics/').content.decode()
+        self.assertIn('http_request_duration_seconds_count{route="cart-list",method="GET"} 1', body)
+        self.assertIn('http_request_queries_count{route="cart-list",method="GET"} 1', body)
+        self.assertIn('http_requests_total{route="cart-list",method="GET",status="200"} 1', body)
+        self.assertIn('http_request_duration_seconds_bucket{route="cart-list",method="GET",le="+Inf"} 1', body)
+
+    def test_async_view_queries_are_counted(self):
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+        response = async_to_sync(self.async_client.get)('/cart/async/cart/', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        line = next(line for line in metrics.render().splitlines()
+                    if line.startswith('http_request_queries_sum{route="async_cart_view",method="GET"}'))
+        # user and carts lookups, run on sync_to_async threads
+        self.assertGreaterEqual(float(line.split()[-1]), 2)
+
+    def test_switched_off_at_runtime(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ServerSetting.objects.create(name='request_metrics', int_value=0)
+        self.client.get('/cart/cart/')
+        self.assertNotIn('route="cart-list"', metrics.render())
+
+    @override_settings(METRICS_SLOW_QUERY_SECONDS=0)
+    def test_slow_queries_are_logged(self):
+        cache.clear()
+        with self.assertLogs('amazingstor.middleware', level='WARNING') as logs:
+            self.client.get('/cart/cart/')
+        self.assertIn('slow query on cart-list', logs.output[0])
+        self.assertIn('db_slow_queries_total{route="cart-list"}', metrics.render())
+
+    def test_kill_old_carts_task_metrics(self):
+        kill_old_carts.apply()
+        body = metrics.render()
+        self.assertIn('celery_task_duration_seconds_count{task="carts.tasks.kill_old_carts"} 1', body)
+        self.assertIn('kill_old_carts_killed_carts_count 1', body)
+
+
+class FastJSONRendererTest(TestCase):
+    def test_same_output_as_json_renderer(self):
+        data = {
+            'text': 'kalbas \u2028 \u0633\u0648\u0633\u06cc\u0633 "quoted"',
+            'updated': datetime.datetime(2024, 10, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc),
+            'date': datetime.date(2024, 10, 1),
+            'amount': decimal.Decimal('12.50'),
+            'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            'items': [{'products': 1, 'quantity': 2, 'dead': False, 'none': None, 'price': 1.5}],
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(None), JSONRenderer().render(None))
+
+    def test_indented_output_falls_back(self):
+        data = {'a': [1, 2]}
+        context = {'indent': 4}
+        self.assertEqual(FastJSONRenderer().render(data, renderer_context=context),
+                         JSONRenderer().render(data, renderer_context=context))
@@ -3,13 +3,17 @@ from django.urls import path, include
 
 from drf_spectacular.views import SpectacularAPIView, SpectacularRedocView, SpectacularSwaggerView
 
+from amazingstor.views import metrics
 import auths.urls
 import carts.urls
+import products.urls
 
 
 urlpatterns = [
     path('auth/', include(auths.urls)),
     path('cart/', include(carts.urls)),
+    path('products/', include(products.urls)),
+    path('metrics/', metrics, name='metrics'),
 
     # Swagger Docs
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
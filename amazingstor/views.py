@@ -0,0 +1,11 @@
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+from amazingstor import metrics as metrics_registry
+
+
+def metrics(request):
+    """ will return recorded metrics in prometheus text format """
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class AuthsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'auths'
+
+    def ready(self):
+        # connects signal receivers and registers the openapi extension of CachedJWTAuthentication
+        import auths.schema  # noqa: F401
+        import auths.user_cache  # noqa: F401
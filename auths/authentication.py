@@ -0,0 +1,77 @@
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from auths import user_cache
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that keeps authenticated users in cache for AUTHS_USER_CACHE_TTL seconds, so a request
+    does not need a query to rebuild request.user, which is then a lightweight user_cache.CachedUser.
+    with AUTHS_STATELESS_JWT on, a lightweight token user is built from the token claims instead, with no
+    lookup at all
+    """
+    def get_user(self, validated_token):
+        if settings.AUTHS_STATELESS_JWT:
+            return JWTStatelessUserAuthentication.get_user(self, validated_token)
+
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            return super().get_user(validated_token)
+
+        version, user = user_cache.get_user(user_id)
+        if user is None:
+            # a cold request gets the same lightweight user a warm one does
+            return user_cache.store_user(user_id, version, super().get_user(validated_token))
+
+        self.check_revoked(validated_token, user)
+        return user
+
+    def check_revoked(self, validated_token, user):
+        if not api_settings.CHECK_REVOKE_TOKEN:
+            return
+        if isinstance(user, user_cache.CachedUser):
+            password_marker = user.password_marker
+        else:
+            password_marker = get_md5_hash_password(user.password)
+        if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != password_marker:
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+    async def aauthenticate(self, request):
+        """ async twin of authenticate, for plain django async views """
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        """ async twin of get_user, a cache miss reads the user with aget """
+        if settings.AUTHS_STATELESS_JWT:
+            return JWTStatelessUserAuthentication.get_user(self, validated_token)
+
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        if user_id is None:
+            # raises InvalidToken before any lookup
+            return super().get_user(validated_token)
+
+        version, user = await user_cache.aget_user(user_id)
+        if user is None:
+            try:
+                user = await self.user_model.objects.aget(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            if not user.is_active:
+                raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+            self.check_revoked(validated_token, user)
+            return await user_cache.astore_user(user_id, version, user)
+
+        self.check_revoked(validated_token, user)
+        return user
@@ -0,0 +1,6 @@
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+
+
+class CachedJWTScheme(SimpleJWTScheme):
+    """ documents CachedJWTAuthentication as the jwtAuth bearer scheme of simplejwt it extends """
+    target_class = 'auths.authentication.CachedJWTAuthentication'
@@ -1,3 +1,70 @@
-from django.test import TestCase
+from asgiref.sync import async_to_sync
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from drf_spectacular.drainage import GENERATOR_STATS
+from drf_spectacular.generators import SchemaGenerator
 
-# Create your tests here.
+from auths import user_cache
+from auths.authentication import CachedJWTAuthentication
+
+UserModel = get_user_model()
+
+
+class CachedJWTAuthenticationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = UserModel.objects.create_user(username='user_1', password='pass')
+        self.access = self.client.post('/auth/api/token/',
+                                       data={'username': 'user_1', 'password': 'pass'}).json()['access']
+        self.headers = {"Authorization": f"Bearer {self.access}"}
+        self.cart_url = '/cart/cart/'
+
+    def test_warm_cart_get_needs_no_user_query(self):
+        assert self.client.get(self.cart_url, headers=self.headers).status_code == 200
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.cart_url, headers=self.headers)
+        assert response.status_code == 200
+
+    def test_user_changes_are_seen(self):
+        assert self.client.get(self.cart_url, headers=self.headers).status_code == 200
+
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+            # not committed yet, another request must not cache the old row under a new version
+            assert user_cache.get_user(self.user.pk)[0] == 0
+        assert self.client.get(self.cart_url, headers=self.headers).status_code == 401
+
+    def test_cached_user_has_no_password_hash(self):
+        assert self.client.get(self.cart_url, headers=self.headers).status_code == 200
+
+        version, user = user_cache.get_user(self.user.pk)
+        assert isinstance(user, user_cache.CachedUser) and user.pk == self.user.pk
+        assert self.user.password not in str(cache.get(user_cache.user_key(self.user.pk, version)))
+
+    @override_settings(AUTHS_STATELESS_JWT=True)
+    def test_stateless_mode(self):
+        # only the (empty) cart lookup, no user
+        with self.assertNumQueries(1):
+            response = self.client.get(self.cart_url, headers=self.headers)
+        assert response.status_code == 200
+        assert response.json() == []
+
+    def test_cold_and_warm_requests_get_the_same_user_type(self):
+        authentication = CachedJWTAuthentication()
+        token = authentication.get_validated_token(self.access)
+        cold, warm = authentication.get_user(token), authentication.get_user(token)
+        assert type(cold) is type(warm) is user_cache.CachedUser
+        assert cold == warm
+
+        cache.clear()
+        cold, warm = async_to_sync(authentication.aget_user)(token), async_to_sync(authentication.aget_user)(token)
+        assert type(cold) is type(warm) is user_cache.CachedUser
+
+    def test_schema_documents_bearer_auth(self):
+        with GENERATOR_STATS.silence():
+            schema = SchemaGenerator().get_schema(request=None, public=True)
+        assert schema['components']['securitySchemes']['jwtAuth']['scheme'] == 'bearer'
+        assert {'jwtAuth': []} in schema['paths']['/cart/cart/']['get']['security']
@@ -0,0 +1,110 @@
+"""
+cache of authenticated users, keyed by user id and a per user version.
+only the fields authentication and permission checks need are cached (never the password hash, just a marker
+of it for revoked tokens), requests get a lightweight CachedUser built from them.
+saving or deleting a user bumps its version once committed, so deactivation or a password change is seen on the
+next request.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+KEY_PREFIX = 'auths_user'
+
+
+class CachedUser:
+    """ lightweight authenticated user built from cached fields, it can not be saved """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, id, is_active: bool, is_staff: bool, is_superuser: bool, password_marker: str):
+        self.id = self.pk = id
+        self.is_active = is_active
+        self.is_staff = is_staff
+        self.is_superuser = is_superuser
+        self.password_marker = password_marker
+
+    def __str__(self):
+        return f'CachedUser {self.id}'
+
+    def __eq__(self, other):
+        return isinstance(other, CachedUser) and self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+def user_fields(user) -> dict:
+    return {
+        'id': user.pk,
+        'is_active': user.is_active,
+        'is_staff': user.is_staff,
+        'is_superuser': user.is_superuser,
+        'password_marker': get_md5_hash_password(user.password),
+    }
+
+
+def build_user(fields):
+    return CachedUser(**fields) if fields is not None else None
+
+
+def get_cache():
+    return caches[settings.AUTHS_USER_CACHE_ALIAS]
+
+
+def version_key(user_id) -> str:
+    return f'{KEY_PREFIX}:version:{user_id}'
+
+
+def user_key(user_id, version) -> str:
+    return f'{KEY_PREFIX}:{user_id}:{version}'
+
+
+def get_user(user_id):
+    """ will return (version, cached user or None) of given user id """
+    cache = get_cache()
+    version = cache.get(version_key(user_id), 0)
+    return version, build_user(cache.get(user_key(user_id, version)))
+
+
+def store_user(user_id, version, user) -> CachedUser:
+    """ will cache fields of user and return the CachedUser built from them, like a cache hit would """
+    fields = user_fields(user)
+    get_cache().set(user_key(user_id, version), fields, timeout=settings.AUTHS_USER_CACHE_TTL)
+    return build_user(fields)
+
+
+async def aget_user(user_id):
+    """ async twin of get_user """
+    cache = get_cache()
+    version = await cache.aget(version_key(user_id), 0)
+    return version, build_user(await cache.aget(user_key(user_id, version)))
+
+
+async def astore_user(user_id, version, user) -> CachedUser:
+    """ async twin of store_user """
+    fields = user_fields(user)
+    await get_cache().aset(user_key(user_id, version), fields, timeout=settings.AUTHS_USER_CACHE_TTL)
+    return build_user(fields)
+
+
+def bump_version(user_id):
+    cache = get_cache()
+    try:
+        cache.incr(version_key(user_id))
+    except ValueError:
+        cache.set(version_key(user_id), 1, timeout=None)
+
+
+@receiver([post_save, post_delete], sender=get_user_model())
+def invalidate_user(instance, **kwargs):
+    """
+    will bump version of the user once committed, so its cached copy is not used anymore. a bump before commit
+    would let another request cache the old row under the new version
+    """
+    user_id = instance.pk
+    transaction.on_commit(lambda: bump_version(user_id))
@@ -0,0 +1,4 @@
+"""
+benchmarks for the cart subsystem, they run against a throwaway test database.
+run one with ``python -m benchmarks <name>``
+"""
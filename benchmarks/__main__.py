@@ -0,0 +1,42 @@
+import argparse
+import importlib
+import os
+import platform
+import sys
+
+from benchmarks import results
+
+BENCHMARKS = ['sweeper', 'catalog', 'endpoints', 'serialization', 'asgi', 'hot_stock', 'cart_totals']
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('names', nargs='*', help=f"benchmarks to run, default all of: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--output', help='save results of this run as json to this path')
+    parser.add_argument('--baseline', help='json results of an earlier run to diff this run against')
+    args = parser.parse_args()
+
+    names = args.names or BENCHMARKS
+    for name in names:
+        if name not in BENCHMARKS:
+            sys.exit(f"unknown benchmark {name!r}, choose from: {', '.join(BENCHMARKS)}")
+
+    run_results = {
+        'meta': {
+            'database_profile': os.environ.get('DATABASE_PROFILE', 'sqlite'),
+            'python': platform.python_version(),
+        },
+    }
+    for name in names:
+        print(f"== {name}")
+        run_results[name] = importlib.import_module(f'benchmarks.{name}').run()
+
+    if args.output:
+        results.save(run_results, args.output)
+    if args.baseline:
+        print(f"== compared to {args.baseline}")
+        print(results.format_comparison(results.compare(run_results, results.load(args.baseline))))
+
+
+if __name__ == '__main__':
+    main()
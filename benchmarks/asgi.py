@@ -0,0 +1,58 @@
+"""
+compares cart list and report reads under ASGI (uvicorn, pip install uvicorn) against the threaded WSGI server,
+at the same client concurrency. under ASGI both the sync DRF views and their async twins are measured.
+report and cart snapshot caches are switched off, so every request reaches the database
+"""
+import random
+
+from benchmarks.runners import run_asgi, run_wsgi
+from benchmarks.seed import seed
+from benchmarks.stats import summarize
+from benchmarks.utils import setup_django, test_database
+
+
+def run(users_count: int = 1000, products_count: int = 200, requests_count: int = 300, concurrency: int = 16,
+        random_seed: int = 0):
+    setup_django()
+    from django.conf import settings
+    from django.test.utils import override_settings
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    try:
+        import uvicorn  # noqa: F401
+    except ImportError:
+        result = {'skipped': 'uvicorn is not installed'}
+        print(result)
+        return result
+
+    uncached = override_settings(
+        CACHES={**settings.CACHES, 'uncached': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+        CART_REPORT_CACHE_ALIAS='uncached',
+        CART_SNAPSHOT_CACHE_ALIAS='uncached',
+    )
+    result = {}
+    with test_database(), uncached:
+        dataset = seed(users_count, products_count, users_count, random_seed=random_seed)
+        generator = random.Random(random_seed)
+        users = [generator.choice(dataset['users']) for _ in range(requests_count)]
+        headers = {user.pk: {'Authorization': f'Bearer {AccessToken.for_user(user)}'} for user in users}
+        paths = {
+            'cart_list': ('/cart/cart/', '/cart/async/cart/'),
+            'report': ('/cart/report/', '/cart/async/report/'),
+        }
+        for name, (sync_path, async_path) in paths.items():
+            sync_requests = [('GET', sync_path, None, headers[user.pk]) for user in users]
+            async_requests = [('GET', async_path, None, headers[user.pk]) for user in users]
+            result[name] = {
+                'wsgi_sync_view': summarize(*run_wsgi(sync_requests, threads=concurrency)),
+                'asgi_sync_view': summarize(*run_asgi(sync_requests, threads=concurrency)),
+                'asgi_async_view': summarize(*run_asgi(async_requests, threads=concurrency)),
+            }
+
+    result['config'] = {'users': users_count, 'requests': requests_count, 'concurrency': concurrency}
+    print(result)
+    return result
+
+
+if __name__ == '__main__':
+    run()
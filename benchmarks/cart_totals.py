@@ -0,0 +1,61 @@
+"""
+measures the all users cart report read from the CartDailyTotal rollup of carts denormalized totals against the
+same report joined live from cart items and products, and the price of keeping totals up to date on cart writes
+"""
+from benchmarks.seed import seed
+from benchmarks.utils import setup_django, test_database, timer
+
+
+def normalized(report: dict) -> dict:
+    """ will sort entries of each day, carts with equal totals may come in any order """
+    return {date: sorted(entries, key=lambda entry: (entry['total_amount'], entry['username']))
+            for date, entries in report.items()}
+
+
+def count_joins(report) -> int:
+    """ will return number of joins in the queries a report runs """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as queries:
+        report()
+    return sum(query['sql'].upper().count(' JOIN ') for query in queries.captured_queries)
+
+
+def run(users_count: int = 5000, products_count: int = 500, items_per_cart: int = 5, repeats: int = 20,
+        writes_count: int = 200):
+    setup_django()
+    from carts.models import Cart, CartItem
+
+    result = {}
+    with test_database():
+        dataset = seed(users_count, products_count, users_count, items_per_cart=items_per_cart)
+        assert normalized(Cart.get_all_carts_sum()) == normalized(Cart.get_all_carts_sum_live())
+
+        reports = {'denormalized': Cart.get_all_carts_sum, 'live_join': Cart.get_all_carts_sum_live}
+        for name, report in reports.items():
+            with timer() as elapsed:
+                for _ in range(repeats):
+                    report()
+            result[name] = {
+                'ms_per_report': round(elapsed['seconds'] / repeats * 1000, 2),
+                'joins': count_joins(report),
+            }
+
+        carts = dataset['carts'][:writes_count]
+        products = dataset['products']
+        with timer() as elapsed:
+            for index, cart in enumerate(carts):
+                CartItem.create_cart_items_and_subtract_from_stock(
+                    user=cart.user, items=[{'products_id': products[index % len(products)].id, 'quantity': 7}]
+                )
+        result['cart_write_ms'] = round(elapsed['seconds'] / len(carts) * 1000, 3)
+        result['drifted_carts'] = len(Cart.find_drifted_totals(Cart.objects.all()))
+
+    result['config'] = {'carts': users_count, 'items_per_cart': items_per_cart, 'repeats': repeats}
+    print(result)
+    return result
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,37 @@
+""" measures warm product catalog reads per second through the django test client """
+from benchmarks.utils import setup_django, test_database, timer
+
+
+def run(products_count: int = 2000, requests_count: int = 2000, page_size: int = 50):
+    setup_django()
+    from django.core.cache import cache
+    from django.db import connection
+    from django.test import Client
+    from django.test.utils import CaptureQueriesContext
+
+    from products.models import Product
+
+    with test_database():
+        Product.objects.bulk_create(
+            Product(name=f'product_{i}', price=10, stock_quantity=i % 5) for i in range(products_count)
+        )
+        cache.clear()
+        client = Client()
+        url = f'/products/catalog/?page_size={page_size}'
+        assert client.get(url).status_code == 200
+        with CaptureQueriesContext(connection) as queries, timer() as elapsed:
+            for _ in range(requests_count):
+                client.get(url)
+
+    result = {
+        'requests': requests_count,
+        'seconds': round(elapsed['seconds'], 3),
+        'requests_per_second': round(requests_count / elapsed['seconds'], 1),
+        'queries_per_request': len(queries.captured_queries) / requests_count,
+    }
+    print(result)
+    return result
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,84 @@
+"""
+load test of cart endpoints: a kill_old_carts run, then POST and GET /cart/cart/ and GET /cart/report/.
+every scenario goes through the django test client and through a threaded wsgi server, against a seeded
+sqlite test database with local memory cache, no redis needed
+"""
+import random
+
+from benchmarks.runners import run_client, run_wsgi
+from benchmarks.seed import seed
+from benchmarks.stats import summarize
+from benchmarks.utils import count_queries, setup_django, test_database, timer
+
+
+def build_requests(dataset: dict, requests_count: int, random_seed: int) -> dict:
+    """ will return deterministic request lists by scenario name """
+    from django.utils import timezone
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    generator = random.Random(random_seed)
+    users, products = dataset['users'], dataset['products']
+    headers = {user.pk: {'Authorization': f'Bearer {AccessToken.for_user(user)}'} for user in users}
+    today = timezone.localdate()
+    report_ranges = [(today - timezone.timedelta(days=days), today) for days in (1, 7, 30)]
+
+    def cart_body():
+        picked = generator.sample(products, generator.randint(1, min(3, len(products))))
+        return {'items_cart': [{'products': product.pk, 'quantity': generator.randint(1, 3)} for product in picked]}
+
+    def report_path():
+        start_date, end_date = generator.choice(report_ranges)
+        return f'/cart/report/?start_date={start_date.isoformat()}&end_date={end_date.isoformat()}'
+
+    return {
+        'cart_create': [
+            ('POST', '/cart/cart/', cart_body(), headers[generator.choice(users).pk]) for _ in range(requests_count)
+        ],
+        'cart_list': [
+            ('GET', '/cart/cart/', None, headers[generator.choice(users).pk]) for _ in range(requests_count)
+        ],
+        'report': [
+            ('GET', report_path(), None, headers[generator.choice(users).pk]) for _ in range(requests_count)
+        ],
+    }
+
+
+def run(users_count: int = 300, products_count: int = 200, carts_count: int = 200, requests_count: int = 500,
+        threads: int = 8, processes: int = 1, random_seed: int = 0):
+    setup_django()
+    from django.core.cache import caches
+
+    from carts.tasks import kill_old_carts
+
+    result = {'client': {}, 'wsgi': {}}
+    with test_database():
+        dataset = seed(users_count, products_count, carts_count, random_seed=random_seed)
+        scenarios = build_requests(dataset, requests_count, random_seed)
+        # sweep first, requests below touch carts and would save the seeded expired ones
+        with count_queries() as queries, timer() as elapsed:
+            killed_count = kill_old_carts()
+        result['kill_old_carts'] = {
+            'carts_killed': killed_count,
+            'seconds': round(elapsed['seconds'], 3),
+            'queries': queries.count,
+        }
+        for name, requests in scenarios.items():
+            for runner_name, runner in (('client', run_client), ('wsgi', run_wsgi)):
+                for cache in caches.all():
+                    cache.clear()
+                if runner is run_wsgi:
+                    samples, seconds = runner(requests, threads=threads, processes=processes)
+                else:
+                    samples, seconds = runner(requests)
+                result[runner_name][name] = summarize(samples, seconds)
+
+    result['config'] = {
+        'users': users_count, 'products': products_count, 'carts': carts_count, 'requests': requests_count,
+        'threads': threads, 'processes': processes, 'random_seed': random_seed,
+    }
+    print(result)
+    return result
+
+
+if __name__ == '__main__':
+    run()
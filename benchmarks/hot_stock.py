@@ -0,0 +1,78 @@
+"""
+measures reservations per second of a single product from concurrent threads, once with its stock in the
+database row and once with it in hot stock counters (carts.hot_stock, redis with CART_REDIS_URL, process local
+counters otherwise as everything runs in this one process)
+"""
+import threading
+
+from benchmarks.utils import setup_django, test_database, timer
+
+
+def hammer(product_id: int, threads: int, reservations_per_thread: int) -> dict:
+    from django.db import connection
+
+    from carts.exceptions import LowStockQuantityException
+    from carts.reservations import apply_stock_deltas
+
+    failures = []
+    barrier = threading.Barrier(threads + 1)
+
+    def worker():
+        try:
+            barrier.wait()
+            for _ in range(reservations_per_thread):
+                try:
+                    apply_stock_deltas({product_id: 1})
+                except LowStockQuantityException as lsq:
+                    failures.append(lsq)
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    with timer() as elapsed:
+        barrier.wait()
+        for thread in workers:
+            thread.join()
+
+    reservations_count = threads * reservations_per_thread - len(failures)
+    return {
+        'reservations': reservations_count,
+        'failures': len(failures),
+        'seconds': round(elapsed['seconds'], 3),
+        'reservations_per_second': round(reservations_count / elapsed['seconds'], 1),
+    }
+
+
+def run(threads: int = 8, reservations_per_thread: int = 200):
+    setup_django()
+    from django.conf import settings
+    from django.test.utils import override_settings
+
+    from carts import hot_stock
+    from products.models import Product
+
+    stock = threads * reservations_per_thread
+    result = {}
+    with test_database(), override_settings(HOT_STOCK_BACKEND=settings.HOT_STOCK_BACKEND or 'local'):
+        product = Product.objects.create(name='best seller', price=10, stock_quantity=stock)
+        result['database_row'] = hammer(product.id, threads, reservations_per_thread)
+
+        Product.objects.filter(pk=product.id).update(stock_quantity=stock)
+        hot_stock.heat(product.id)
+        try:
+            result['hot_counters'] = hammer(product.id, threads, reservations_per_thread)
+            hot_stock.reconcile([product.id])
+            product.refresh_from_db()
+            result['hot_counters']['reconciled_stock'] = product.stock_quantity
+        finally:
+            hot_stock.cool(product.id)
+
+    result['config'] = {'threads': threads, 'reservations_per_thread': reservations_per_thread}
+    print(result)
+    return result
+
+
+if __name__ == '__main__':
+    run()
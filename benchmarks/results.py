@@ -0,0 +1,44 @@
+""" saving benchmark results as json and diffing them against a baseline run """
+import json
+
+
+def save(results: dict, path: str):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def flatten(results: dict, prefix: str = '') -> dict:
+    """ will turn nested results into {'a.b.c': number}, dropping everything that is not a number """
+    flat = {}
+    for key, value in results.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{name}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(current: dict, baseline: dict) -> list:
+    """ will return (metric, baseline, current, change percent or None) for every metric present in both runs """
+    current, baseline = flatten(current), flatten(baseline)
+    rows = []
+    for name in sorted(current.keys() & baseline.keys()):
+        old, new = baseline[name], current[name]
+        change = round((new - old) / old * 100, 1) if old else None
+        rows.append((name, old, new, change))
+    return rows
+
+
+def format_comparison(rows) -> str:
+    width = max((len(name) for name, *_ in rows), default=0)
+    lines = []
+    for name, old, new, change in rows:
+        change = 'n/a' if change is None else f'{change:+.1f}%'
+        lines.append(f'{name.ljust(width)}  {old:>12}  {new:>12}  {change:>8}')
+    return '\n'.join(lines)
@@ -0,0 +1,166 @@
+"""
+ways to drive a list of requests, each a (method, path, json body or None, headers) tuple, through the project.
+they all return (samples, wall seconds), a sample being (latency seconds, queries count, status code)
+
+run_client - django test client, in process and sequential, no network or server overhead
+run_wsgi   - threaded wsgiref server on localhost, hammered by client threads, or client processes
+run_asgi   - uvicorn on localhost (pip install uvicorn), hammered the same way
+"""
+import http.client
+import json
+import multiprocessing
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+QUERIES_HEADER = 'X-Benchmark-Queries'
+HOST = 'testserver'
+
+
+def run_client(requests):
+    from django.test import Client
+
+    from benchmarks.utils import count_queries
+
+    client = Client()
+    samples = []
+    started = time.perf_counter()
+    for method, path, body, headers in requests:
+        with count_queries() as queries:
+            request_started = time.perf_counter()
+            response = client.generic(
+                method, path, data=json.dumps(body) if body is not None else '',
+                content_type='application/json', headers=headers,
+            )
+            latency = time.perf_counter() - request_started
+        samples.append((latency, queries.count, response.status_code))
+    return samples, time.perf_counter() - started
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def counting_application(application):
+    """
+    will wrap wsgi application so each response carries number of queries it ran in a header.
+    every request gets its own server thread, so this includes opening the connection
+    """
+    from benchmarks.utils import count_queries
+
+    def counted(environ, start_response):
+        with count_queries() as queries:
+            def counted_start_response(status, headers, exc_info=None):
+                return start_response(status, headers + [(QUERIES_HEADER, str(queries.count))], exc_info)
+
+            # responses here are not streamed, so the whole body is built before start_response is called
+            response = application(environ, counted_start_response)
+            try:
+                body = b''.join(response)
+            finally:
+                response.close()
+        return [body]
+
+    return counted
+
+
+def send(port: int, request) -> tuple:
+    method, path, body, headers = request
+    http_connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    headers = {'Host': HOST, 'Content-Type': 'application/json', **headers}
+    started = time.perf_counter()
+    http_connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = http_connection.getresponse()
+    response.read()
+    latency = time.perf_counter() - started
+    http_connection.close()
+    return latency, int(response.getheader(QUERIES_HEADER, 0)), response.status
+
+
+def send_all(port: int, requests, threads: int) -> list:
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(lambda request: send(port, request), requests))
+
+
+def load(port: int, requests, threads: int, processes: int):
+    """ will send requests to the server on port from client threads, spread over client processes if asked """
+    started = time.perf_counter()
+    if processes > 1:
+        # spawned clients only need the stdlib, so they do not inherit the server or django state
+        slices = [requests[i::processes] for i in range(processes)]
+        with multiprocessing.get_context('spawn').Pool(processes) as pool:
+            parts = pool.starmap(send_all, [(port, part, threads) for part in slices])
+        samples = [sample for part in parts for sample in part]
+    else:
+        samples = send_all(port, requests, threads)
+    return samples, time.perf_counter() - started
+
+
+def run_wsgi(requests, threads: int = 8, processes: int = 1):
+    from django.core.wsgi import get_wsgi_application
+
+    server = make_server(
+        '127.0.0.1', 0, counting_application(get_wsgi_application()),
+        server_class=ThreadingWSGIServer, handler_class=QuietHandler,
+    )
+    port = server.server_address[1]
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    try:
+        samples, seconds = load(port, requests, threads, processes)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return samples, seconds
+
+
+def counting_asgi_application(application):
+    """ asgi twin of counting_application """
+    from benchmarks.utils import count_queries
+
+    async def counted(scope, receive, send):
+        if scope['type'] != 'http':
+            return await application(scope, receive, send)
+
+        with count_queries() as queries:
+            async def counted_send(message):
+                if message['type'] == 'http.response.start':
+                    header = (QUERIES_HEADER.lower().encode(), str(queries.count).encode())
+                    message = {**message, 'headers': [*message.get('headers', []), header]}
+                await send(message)
+
+            await application(scope, receive, counted_send)
+
+    return counted
+
+
+def run_asgi(requests, threads: int = 8, processes: int = 1):
+    import uvicorn
+    from django.core.asgi import get_asgi_application
+
+    listening = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listening.bind(('127.0.0.1', 0))
+    port = listening.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(
+        counting_asgi_application(get_asgi_application()), lifespan='off', log_level='warning', access_log=False,
+    ))
+    server_thread = threading.Thread(target=server.run, kwargs={'sockets': [listening]}, daemon=True)
+    server_thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        samples, seconds = load(port, requests, threads, processes)
+    finally:
+        server.should_exit = True
+        server_thread.join()
+        listening.close()
+    return samples, seconds
@@ -0,0 +1,42 @@
+""" deterministic dataset for the endpoint benchmarks, same arguments give the same rows on every run """
+import random
+
+
+def seed(users_count: int, products_count: int, carts_count: int, items_per_cart: int = 3,
+         expired_share: float = 0.2, random_seed: int = 0) -> dict:
+    """
+    will create users, products with plenty of stock and carts for the first carts_count users. expired_share
+    of carts are older than cart life span, so kill_old_carts has something to do.
+    returns {'users': [...], 'products': [...], 'carts': [...]}
+    """
+    from django.contrib.auth import get_user_model
+    from django.utils import timezone
+
+    from carts import server_settings
+    from carts.models import Cart, CartItem
+    from products.models import Product
+
+    generator = random.Random(random_seed)
+    now = timezone.now()
+    life_span = server_settings.get_int('cart_life_span')
+    products = Product.objects.bulk_create(
+        Product(name=f'bench_product_{i}', price=generator.randint(1, 1000), stock_quantity=1_000_000)
+        for i in range(products_count)
+    )
+    users = get_user_model().objects.bulk_create(
+        get_user_model()(username=f'bench_user_{i}') for i in range(users_count)
+    )
+    carts = Cart.objects.bulk_create(Cart(user=user) for user in users[:carts_count])
+    for cart in carts:
+        if generator.random() < expired_share:
+            age = timezone.timedelta(minutes=life_span + generator.randint(1, 60 * 24))
+        else:
+            age = timezone.timedelta(minutes=generator.randint(0, life_span - 1))
+        Cart.objects.filter(pk=cart.pk).update(updated=now - age)
+    CartItem.objects.bulk_create(
+        CartItem(cart=cart, products=product, quantity=generator.randint(1, 5))
+        for cart in carts
+        for product in generator.sample(products, min(items_per_cart, products_count))
+    )
+    Cart.refresh_totals(Cart.objects.filter(pk__in=[cart.pk for cart in carts]))
+    return {'users': users, 'products': products, 'carts': carts}
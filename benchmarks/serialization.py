@@ -0,0 +1,70 @@
+"""
+measures per item cost of serving a cart: CartSerializer with JSONRenderer against the values_list fast path
+with FastJSONRenderer, queries included. also renders a big report payload with both renderers
+"""
+from benchmarks.utils import setup_django, test_database, timer
+
+
+def per_item_microseconds(seconds: float, repeats: int, items_count: int) -> float:
+    return round(seconds / repeats / items_count * 1_000_000, 3)
+
+
+def run(items_counts=(10, 100, 1000), repeats: int = 50, report_rows: int = 20000):
+    setup_django()
+    from django.contrib.auth import get_user_model
+    from rest_framework.renderers import JSONRenderer
+
+    from amazingstor import renderers
+    from amazingstor.renderers import FastJSONRenderer
+    from carts.fast_serializers import serialize_carts
+    from carts.models import Cart, CartItem
+    from carts.serializers import CartSerializer
+    from products.models import Product
+
+    result = {'orjson': renderers.orjson is not None, 'cart': {}}
+    with test_database():
+        products = Product.objects.bulk_create(
+            Product(name=f'product_{i}', price=10, stock_quantity=10) for i in range(max(items_counts))
+        )
+        for items_count in items_counts:
+            user = get_user_model().objects.create(username=f'serialization_user_{items_count}')
+            cart = Cart.objects.create(user=user)
+            CartItem.objects.bulk_create(
+                CartItem(cart=cart, products=product, quantity=1) for product in products[:items_count]
+            )
+            carts = Cart.objects.filter(user_id=user.pk)
+
+            with timer() as serializer_elapsed:
+                for _ in range(repeats):
+                    JSONRenderer().render(CartSerializer(carts.prefetch_related('items_cart'), many=True).data)
+            with timer() as fast_elapsed:
+                for _ in range(repeats):
+                    FastJSONRenderer().render(serialize_carts(carts)[1])
+
+            result['cart'][f'{items_count}_items'] = {
+                'serializer_us_per_item': per_item_microseconds(serializer_elapsed['seconds'], repeats, items_count),
+                'fast_path_us_per_item': per_item_microseconds(fast_elapsed['seconds'], repeats, items_count),
+            }
+
+    report = {
+        f'2024-10-{day:02d}': [
+            {'username': f'user_{i}', 'total_amount': i * 10} for i in range(report_rows // 30)
+        ]
+        for day in range(1, 31)
+    }
+    rows = sum(len(entries) for entries in report.values())
+    with timer() as stdlib_elapsed:
+        JSONRenderer().render(report)
+    with timer() as fast_elapsed:
+        FastJSONRenderer().render(report)
+    result['report'] = {
+        'rows': rows,
+        'json_renderer_us_per_row': per_item_microseconds(stdlib_elapsed['seconds'], 1, rows),
+        'fast_renderer_us_per_row': per_item_microseconds(fast_elapsed['seconds'], 1, rows),
+    }
+    print(result)
+    return result
+
+
+if __name__ == '__main__':
+    run()
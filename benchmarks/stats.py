@@ -0,0 +1,32 @@
+""" latency percentiles and throughput of a list of request samples """
+
+
+def percentile(values, fraction: float) -> float:
+    """ will return the given percentile (0..1) of values, interpolated between the nearest ranks """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(samples, seconds: float) -> dict:
+    """
+    will summarize samples, each a (latency seconds, queries count, status code) tuple, measured over
+    given wall time. latencies are reported in milliseconds
+    """
+    latencies = [latency for latency, _, _ in samples]
+    queries = [queries_count for _, queries_count, _ in samples]
+    count = len(samples)
+    return {
+        'requests': count,
+        'errors': sum(1 for _, _, status_code in samples if status_code >= 400),
+        'seconds': round(seconds, 3),
+        'requests_per_second': round(count / seconds, 1) if seconds else 0.0,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'queries_per_request': round(sum(queries) / count, 2) if count else 0.0,
+    }
@@ -0,0 +1,46 @@
+""" measures kill_old_carts throughput in carts per second """
+from benchmarks.utils import setup_django, test_database, timer
+
+
+def seed_expired_carts(carts_count: int, items_per_cart: int, products_count: int):
+    from django.contrib.auth import get_user_model
+    from django.utils import timezone
+
+    from carts.models import Cart, CartItem
+    from products.models import Product
+
+    products = Product.objects.bulk_create(
+        Product(name=f'product_{i}', price=10, stock_quantity=0) for i in range(products_count)
+    )
+    users = get_user_model().objects.bulk_create(
+        get_user_model()(username=f'sweeper_user_{i}') for i in range(carts_count)
+    )
+    carts = Cart.objects.bulk_create(Cart(user=user) for user in users)
+    CartItem.objects.bulk_create(
+        CartItem(cart=cart, products=products[(cart_index + i) % products_count], quantity=1)
+        for cart_index, cart in enumerate(carts)
+        for i in range(items_per_cart)
+    )
+    Cart.objects.update(updated=timezone.now() - timezone.timedelta(days=1))
+
+
+def run(carts_count: int = 5000, items_per_cart: int = 5, products_count: int = 200, chunk_size: int = None):
+    setup_django()
+    from carts.tasks import kill_old_carts
+
+    with test_database():
+        seed_expired_carts(carts_count, items_per_cart, products_count)
+        with timer() as elapsed:
+            killed_count = kill_old_carts(chunk_size=chunk_size)
+
+    result = {
+        'carts_killed': killed_count,
+        'seconds': round(elapsed['seconds'], 3),
+        'carts_per_second': round(killed_count / elapsed['seconds'], 1),
+    }
+    print(result)
+    return result
+
+
+if __name__ == '__main__':
+    run()
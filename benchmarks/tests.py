@@ -0,0 +1,30 @@
+from django.test import SimpleTestCase
+
+from benchmarks.results import compare
+from benchmarks.stats import percentile, summarize
+
+
+class BenchmarkStatsTest(SimpleTestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50.5)
+        self.assertEqual(percentile(values, 0.99), 99.01)
+        self.assertEqual(percentile([3.0], 0.95), 3.0)
+        self.assertEqual(percentile([], 0.5), 0.0)
+
+    def test_summarize(self):
+        samples = [(0.010, 2, 200), (0.020, 4, 201), (0.030, 0, 400)]
+        summary = summarize(samples, seconds=0.5)
+        self.assertEqual(summary['requests'], 3)
+        self.assertEqual(summary['errors'], 1)
+        self.assertEqual(summary['requests_per_second'], 6.0)
+        self.assertEqual(summary['p50_ms'], 20.0)
+        self.assertEqual(summary['queries_per_request'], 2.0)
+
+    def test_compare_with_baseline(self):
+        baseline = {'meta': {'python': '3.11'}, 'endpoints': {'wsgi': {'p95_ms': 10.0, 'errors': 0}}}
+        current = {'meta': {'python': '3.12'}, 'endpoints': {'wsgi': {'p95_ms': 12.5, 'errors': 0}, 'new': 1}}
+        self.assertEqual(compare(current, baseline), [
+            ('endpoints.wsgi.errors', 0, 0, None),
+            ('endpoints.wsgi.p95_ms', 10.0, 12.5, 25.0),
+        ])
@@ -0,0 +1,48 @@
+import os
+import time
+from contextlib import contextmanager
+
+import django
+
+
+def setup_django():
+    """ will configure django for a standalone benchmark run """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'amazingstor.settings')
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    """ will create a fresh test database for the duration of the block and destroy it afterwards """
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+@contextmanager
+def timer():
+    """ will measure wall time of the block, read it from the yielded dict after the block """
+    result = {}
+    started = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result['seconds'] = time.perf_counter() - started
+
+
+def count_queries():
+    """
+    will return a context manager counting queries run in its block, read its count after the block.
+    unlike CaptureQueriesContext it keeps no log, and it sees queries async views run on other threads
+    """
+    from amazingstor.metrics import QueryTimer
+
+    return QueryTimer()
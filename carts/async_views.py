@@ -0,0 +1,81 @@
+"""
+async twins of the cart read endpoints, for ASGI deployments. they are plain django async views, since DRF views
+are sync only, and answer with the same json as CartViewSet.list and AllUsersCartSumView. authentication,
+cache and database access all stay on the event loop. writes are left to the sync views, they run in
+transactions that the async orm does not offer.
+"""
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views import View
+from rest_framework import exceptions, status
+
+from amazingstor.renderers import FastJSONRenderer
+from auths.authentication import CachedJWTAuthentication
+from carts import cart_cache, report_cache
+from carts.fast_serializers import aserialize_carts
+from carts.models import Cart
+
+
+def json_response(data, status_code: int = status.HTTP_200_OK, headers=None) -> HttpResponse:
+    return HttpResponse(FastJSONRenderer().render(data), status=status_code, headers=headers,
+                        content_type='application/json')
+
+
+def error_response(exc: exceptions.APIException, headers=None) -> HttpResponse:
+    """ will answer the way DRF's exception handler does """
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return json_response(data, exc.status_code, headers)
+
+
+class AsyncAPIView(View):
+    """ base of async views, authenticates the request like CachedJWTAuthentication does for DRF views """
+    authentication = CachedJWTAuthentication()
+    login_required = False
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            authenticated = await self.authentication.aauthenticate(request)
+        except exceptions.AuthenticationFailed as e:
+            return error_response(e, {'WWW-Authenticate': self.authentication.authenticate_header(request)})
+        request.user = authenticated[0] if authenticated else AnonymousUser()
+        if self.login_required and not request.user.is_authenticated:
+            return error_response(
+                exceptions.NotAuthenticated(),
+                {'WWW-Authenticate': self.authentication.authenticate_header(request)},
+            )
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class AsyncCartView(AsyncAPIView):
+    """ async twin of CartViewSet.list, same snapshot cache and validators """
+    login_required = True
+
+    async def get(self, request):
+        user_id = request.user.id
+        version, snapshot = await cart_cache.aget_snapshot(user_id)
+        if snapshot is None:
+            carts, data = await aserialize_carts(Cart.objects.filter(user_id=user_id))
+            snapshot = await cart_cache.astore_snapshot(user_id, version, carts, data)
+
+        response = get_conditional_response(request, etag=snapshot['etag'], last_modified=snapshot['last_modified'])
+        if response is None:
+            response = json_response(snapshot['data'])
+        response['ETag'] = snapshot['etag']
+        if snapshot['last_modified'] is not None:
+            response['Last-Modified'] = http_date(snapshot['last_modified'])
+        return response
+
+
+class AsyncAllUsersCartSumView(AsyncAPIView):
+    """ async twin of AllUsersCartSumView, without streaming """
+    async def get(self, request):
+        try:
+            start_date = report_cache.normalize_date(request.GET.get('start_date', None))
+            end_date = report_cache.normalize_date(request.GET.get('end_date', None))
+        except ValueError as ve:
+            return error_response(exceptions.ParseError(str(ve)))
+
+        result, cache_status = await report_cache.aget_or_compute(start_date, end_date, Cart.aget_all_carts_sum)
+        return json_response(result, headers={'X-Cache': cache_status.upper()})
@@ -0,0 +1,72 @@
+"""
+per user snapshot of the cart list response, with its ETag and Last-Modified validators.
+snapshots are stored under a per user version, every cart write bumps the version after commit, so a snapshot
+computed before a write can never be served after it. the ETag is a hash of the response itself, so it changes
+with the content even when no cart updated time does.
+"""
+import calendar
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+
+KEY_PREFIX = 'cart_snapshot'
+
+
+def get_cache():
+    return caches[settings.CART_SNAPSHOT_CACHE_ALIAS]
+
+
+def version_key(user_id) -> str:
+    return f'{KEY_PREFIX}:version:{user_id}'
+
+
+def snapshot_key(user_id, version) -> str:
+    return f'{KEY_PREFIX}:{user_id}:{version}'
+
+
+def get_snapshot(user_id):
+    """ will return (version, snapshot) of the user, snapshot is None if there is no usable one """
+    cache = get_cache()
+    version = cache.get(version_key(user_id), 0)
+    return version, cache.get(snapshot_key(user_id, version))
+
+
+def build_snapshot(carts, data) -> dict:
+    return {
+        'data': data,
+        'etag': '"{}"'.format(hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()),
+        'last_modified': max((calendar.timegm(cart.updated.utctimetuple()) for cart in carts), default=None),
+    }
+
+
+def store_snapshot(user_id, version, carts, data) -> dict:
+    """ will cache serialized data of given carts with its validators and return the snapshot """
+    snapshot = build_snapshot(carts, data)
+    get_cache().set(snapshot_key(user_id, version), snapshot, timeout=settings.CART_SNAPSHOT_CACHE_TTL)
+    return snapshot
+
+
+async def aget_snapshot(user_id):
+    """ async twin of get_snapshot """
+    cache = get_cache()
+    version = await cache.aget(version_key(user_id), 0)
+    return version, await cache.aget(snapshot_key(user_id, version))
+
+
+async def astore_snapshot(user_id, version, carts, data) -> dict:
+    """ async twin of store_snapshot """
+    snapshot = build_snapshot(carts, data)
+    await get_cache().aset(snapshot_key(user_id, version), snapshot, timeout=settings.CART_SNAPSHOT_CACHE_TTL)
+    return snapshot
+
+
+def invalidate(*user_ids):
+    """ will bump version of given users, so their snapshots are not used anymore """
+    cache = get_cache()
+    for user_id in user_ids:
+        try:
+            cache.incr(version_key(user_id))
+        except ValueError:
+            cache.set(version_key(user_id), 1, timeout=None)
@@ -0,0 +1,254 @@
+"""
+group commit of stock reservations. reservations of one product asked for by concurrent requests of a process
+within STOCK_COALESCE_WINDOW seconds are merged into a single conditional decrement of its row, committed on
+its own by a flusher thread. when the batch does not fit in stock, requests are granted in arrival order while
+stock lasts and the rest get their LowStockQuantityException, just as if each one had run its own UPDATE.
+up to STOCK_COALESCE_WORKERS flusher threads write batches of different products at the same time.
+
+a granted reservation is committed before the transaction of its request, together with a
+carts.models.PendingReservation row. the request deletes that row in its own transaction, which makes the
+reservation final once committed. a row left behind means the request failed: hot_stock.journal() releases it
+right away, carts.tasks.release_stale_reservations after STOCK_COALESCE_GRACE seconds (say the process died).
+the flusher writes on its own connection, so the caller must not have written products rows in its transaction
+yet, and sqlite (a single write lock per database) is never coalesced.
+"""
+import logging
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from carts import hot_stock
+from carts.exceptions import LowStockQuantityException
+from products import catalog
+from products.models import Product
+
+logger = logging.getLogger(__name__)
+
+# seconds an idle coalescer thread waits for new reservations before it stops its flushers and exits
+IDLE_TIMEOUT = 1.0
+
+
+class ReservationCoalescer:
+    """ per process queue of pending reservations, flushed product by product every window """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def submit(self, product_id: int, quantity: int) -> Future:
+        """
+        will queue a reservation, its future resolves to the token of its pending reservation once granted, to
+        None if the product turned out to be hot, or raises LowStockQuantityException
+        """
+        future = Future()
+        with self.lock:
+            self.pending.setdefault(product_id, []).append((quantity, future))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='reservation-coalescer', daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+        return future
+
+    def run(self):
+        """ will gather reservations every window and hand batches of each product to flusher threads """
+        batches = queue.SimpleQueue()
+        flushers = []
+        taken = {}
+        try:
+            while True:
+                if not self.wakeup.wait(IDLE_TIMEOUT):
+                    with self.lock:
+                        if not self.pending:
+                            self.thread = None
+                            return
+                    continue
+                time.sleep(settings.STOCK_COALESCE_WINDOW)
+                with self.lock:
+                    taken, self.pending = self.pending, {}
+                    self.wakeup.clear()
+                while len(flushers) < min(settings.STOCK_COALESCE_WORKERS, len(taken)):
+                    flusher = threading.Thread(target=self.flush_batches, args=(batches,),
+                                               name='reservation-flusher', daemon=True)
+                    flusher.start()
+                    flushers.append(flusher)
+                for batch in sorted(taken.items()):
+                    batches.put(batch)
+                taken = {}
+        except BaseException as e:
+            # nothing may wait forever, reservations not handed to a flusher yet fail and the next one restarts
+            with self.lock:
+                for product_id, waiters in self.pending.items():
+                    taken.setdefault(product_id, []).extend(waiters)
+                self.pending, self.thread = {}, None
+            for waiters in taken.values():
+                for _, future in waiters:
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            logger.exception('reservation coalescer stopped')
+        finally:
+            for _ in flushers:
+                batches.put(None)
+
+    def flush_batches(self, batches: queue.SimpleQueue):
+        """ will flush batches until told to stop by None, on a connection of its own """
+        try:
+            while (batch := batches.get()) is not None:
+                try:
+                    self.flush(*batch)
+                except Exception:
+                    logger.exception('could not flush reservations of product %s', batch[0])
+        finally:
+            connection.close()
+
+    def flush(self, product_id: int, waiters: list):
+        """ will reserve quantities of all waiters of a product with as few conditional UPDATEs as possible """
+        try:
+            granted, short = self.reserve(product_id, waiters)
+        except Exception as e:
+            for _, future in waiters:
+                future.set_exception(e)
+            return
+        for quantity, future in waiters:
+            if future in short:
+                future.set_exception(short[future])
+            else:
+                future.set_result(granted.get(future))
+        if granted:
+            catalog.invalidate_stocks([product_id])
+
+    @classmethod
+    def reserve(cls, product_id: int, waiters: list) -> tuple:
+        """
+        will take stock of granted waiters and write their pending reservations in one transaction.
+        returns ({granted future: token of its pending reservation}, {short future: exception})
+        """
+        from carts.models import PendingReservation
+
+        with transaction.atomic():
+            granted, short = cls.take(product_id, waiters)
+            tokens = {future: uuid.uuid4().hex for future in granted}
+            PendingReservation.objects.bulk_create(
+                PendingReservation(token=tokens[future], product_id=product_id, quantity=quantity)
+                for quantity, future in waiters if future in tokens
+            )
+        return tokens, short
+
+    @staticmethod
+    def take(product_id: int, waiters: list) -> tuple:
+        """ will return (granted futures, {short future: exception}) """
+        products = Product.objects.filter(pk=product_id, is_hot=False)
+        total = sum(quantity for quantity, _ in waiters)
+        if products.filter(stock_quantity__gte=total).update(stock_quantity=F('stock_quantity') - total):
+            return {future for _, future in waiters}, {}
+
+        while True:
+            row = Product.objects.filter(pk=product_id).values_list('name', 'stock_quantity', 'is_hot').first()
+            if row is None:
+                error = Product.DoesNotExist(f"product with id {product_id} does not exist!")
+                return set(), {future: error for _, future in waiters}
+            name, available, is_hot = row
+            if is_hot:
+                return set(), {}
+            granted, short, left = set(), {}, available
+            for quantity, future in waiters:
+                if quantity <= left:
+                    granted.add(future)
+                    left -= quantity
+                else:
+                    short[future] = LowStockQuantityException(
+                        f"requested extra quantity of product: {name} is {quantity}, while {left} is available!"
+                    )
+            reserved = available - left
+            if not reserved or products.filter(stock_quantity__gte=reserved).update(
+                stock_quantity=F('stock_quantity') - reserved
+            ):
+                return granted, short
+            # stock dropped (or the product turned hot) since it was read, grant again from a fresh read
+
+
+coalescer = ReservationCoalescer()
+
+
+def enabled() -> bool:
+    return settings.STOCK_COALESCE_WINDOW > 0 and connection.vendor != 'sqlite'
+
+
+def release(reservations) -> int:
+    """
+    will delete pending reservations of given queryset and give their quantity back to stock, returns number
+    of released reservations. rows locked by a transaction confirming or releasing them are skipped
+    """
+    from carts.models import PendingReservation
+    from carts.reservations import apply_stock_deltas
+
+    with transaction.atomic():
+        rows = list(reservations.select_for_update(skip_locked=True).values_list('pk', 'product_id', 'quantity'))
+        deltas = {}
+        for _, product_id, quantity in rows:
+            deltas[product_id] = deltas.get(product_id, 0) - quantity
+        PendingReservation.objects.filter(pk__in=[pk for pk, _, _ in rows]).delete()
+        apply_stock_deltas(deltas)
+    return len(rows)
+
+
+def release_tokens(tokens: list) -> int:
+    from carts.models import PendingReservation
+
+    return release(PendingReservation.objects.filter(token__in=tokens))
+
+
+def release_stale(batch_size: int) -> int:
+    """ will release up to batch_size reservations pending longer than STOCK_COALESCE_GRACE seconds """
+    from carts.models import PendingReservation
+
+    stale_before = timezone.now() - timezone.timedelta(seconds=settings.STOCK_COALESCE_GRACE)
+    return release(PendingReservation.objects.filter(
+        pk__in=PendingReservation.objects.filter(created_at__lt=stale_before).order_by('pk').values('pk')[:batch_size]
+    ))
+
+
+def confirm(tokens: list):
+    """ will make pending reservations final with the transaction it runs in """
+    from carts.models import PendingReservation
+
+    deleted_count, _ = PendingReservation.objects.filter(token__in=tokens).delete()
+    if deleted_count != len(tokens):
+        raise LowStockQuantityException('stock reservation expired before it was saved, try again!')
+
+
+def reserve(deltas: dict) -> dict:
+    """
+    will reserve positive deltas (product id -> quantity) through the coalescer, wait for all of them and confirm
+    them in the current transaction. returns deltas left for the database path: releases and products that
+    turned out to be hot
+    """
+    futures = {product_id: coalescer.submit(product_id, delta) for product_id, delta in deltas.items() if delta > 0}
+    remaining = {product_id: delta for product_id, delta in deltas.items() if product_id not in futures}
+    tokens, error = [], None
+    for product_id, future in futures.items():
+        try:
+            token = future.result()
+        except Exception as e:
+            error = error or e
+            continue
+        if token is None:
+            remaining[product_id] = deltas[product_id]
+        else:
+            tokens.append(token)
+    if error is not None:
+        if tokens:
+            release_tokens(tokens)
+        raise error
+    if tokens:
+        hot_stock.track(lambda: release_tokens(tokens))
+        confirm(tokens)
+    return remaining
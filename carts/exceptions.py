@@ -1,6 +1,21 @@
+from rest_framework import status
+from rest_framework.exceptions import APIException
 
 
 class LowStockQuantityException(Exception):
     """ indicate that needed quantity of a product is less than its actual quantity """
     ...
 
+
+class IdempotencyKeyReused(APIException):
+    """ indicate that an Idempotency-Key was sent again with a different request body """
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'Idempotency-Key was already used with a different request.'
+    default_code = 'idempotency_key_reused'
+
+
+class IdempotentRequestInProgress(APIException):
+    """ indicate that the first request of an Idempotency-Key is still running """
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'a request with this Idempotency-Key is still in progress, retry later.'
+    default_code = 'idempotent_request_in_progress'
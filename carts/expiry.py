@@ -0,0 +1,97 @@
+"""
+time ordered index of cart expirations, so due carts can be killed seconds after they expire while idle runs
+cost a single index lookup. a cart is (re)scheduled whenever it is touched and dropped when it is killed.
+the index is a hint: carts are checked against their real age before being killed.
+"""
+import datetime
+
+from django.conf import settings
+from django.utils import timezone
+
+from carts.locks import get_redis_client
+
+
+class RedisExpiryIndex:
+    """ expiry index kept in a redis sorted set, scored by expiry timestamp """
+    key = 'cart_expiry'
+    pop_due_script = """
+        local ids = redis.call('zrangebyscore', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+        if #ids > 0 then
+            redis.call('zrem', KEYS[1], unpack(ids))
+        end
+        return ids
+    """
+
+    def __init__(self):
+        self.client = get_redis_client(settings.CART_REDIS_URL)
+
+    def schedule(self, expirations: dict):
+        """ will (re)schedule carts, expirations maps cart id to its expiry datetime """
+        if expirations:
+            self.client.zadd(self.key, {cart_id: expires_at.timestamp() for cart_id, expires_at in expirations.items()})
+
+    def remove(self, cart_ids):
+        if cart_ids:
+            self.client.zrem(self.key, *cart_ids)
+
+    def pop_due(self, now: datetime.datetime, limit: int) -> list:
+        """ will atomically take out and return up to limit carts due by now """
+        return [int(cart_id) for cart_id in self.client.eval(self.pop_due_script, 1, self.key, now.timestamp(), limit)]
+
+
+class DatabaseExpiryIndex:
+    """ expiry index kept in CartExpiry table """
+    def schedule(self, expirations: dict):
+        from carts.models import CartExpiry
+
+        CartExpiry.objects.bulk_create(
+            [CartExpiry(cart_id=cart_id, expires_at=expires_at) for cart_id, expires_at in expirations.items()],
+            update_conflicts=True, unique_fields=['cart'], update_fields=['expires_at'],
+        )
+
+    def remove(self, cart_ids):
+        from carts.models import CartExpiry
+
+        CartExpiry.objects.filter(cart_id__in=cart_ids).delete()
+
+    def pop_due(self, now: datetime.datetime, limit: int) -> list:
+        from django.db import transaction
+
+        from carts.models import CartExpiry
+
+        with transaction.atomic():
+            cart_ids = list(
+                CartExpiry.objects.select_for_update(skip_locked=True).filter(expires_at__lte=now).order_by(
+                    'expires_at'
+                ).values_list('cart_id', flat=True)[:limit]
+            )
+            if cart_ids:
+                CartExpiry.objects.filter(cart_id__in=cart_ids).delete()
+        return cart_ids
+
+
+EXPIRY_BACKENDS = {
+    'redis': RedisExpiryIndex,
+    'database': DatabaseExpiryIndex,
+}
+
+
+def get_expiry_index():
+    """ will return expiry index of the backend chosen by CART_EXPIRY_BACKEND setting """
+    return EXPIRY_BACKENDS[settings.CART_EXPIRY_BACKEND]()
+
+
+def get_life_span() -> datetime.timedelta:
+    from carts import server_settings
+
+    return timezone.timedelta(minutes=server_settings.get_int('cart_life_span'))
+
+
+def schedule_carts(last_updates: dict):
+    """ will schedule carts to expire a life span after their last update, last_updates maps cart id to it """
+    life_span = get_life_span()
+    get_expiry_index().schedule({cart_id: updated + life_span for cart_id, updated in last_updates.items()})
+
+
+def remove_carts(cart_ids):
+    get_expiry_index().remove(list(cart_ids))
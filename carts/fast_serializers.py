@@ -0,0 +1,87 @@
+"""
+read only fast path of CartSerializer. it builds the same response straight from values_list rows, instead of
+model instances going through every serializer field of every item. the field mapping (output name, orm lookup,
+converter) is compiled once from the serializers themselves, so both stay in step when fields change.
+"""
+from functools import cache
+
+from rest_framework import serializers
+
+from carts.models import CartItem
+from carts.serializers import CartItemSerializer, CartSerializer
+
+# fields whose to_representation gives back what the database returned already
+PLAIN_FIELDS = (serializers.IntegerField, serializers.BooleanField, serializers.CharField)
+
+
+def compile_fields(serializer) -> tuple:
+    """ will return (output name, orm lookup, converter or None) of each non nested field of the serializer """
+    compiled = []
+    for name, field in serializer.fields.items():
+        if isinstance(field, serializers.BaseSerializer):
+            continue
+        if isinstance(field, serializers.PrimaryKeyRelatedField):
+            compiled.append((name, f'{field.source}_id', None))
+        elif isinstance(field, PLAIN_FIELDS):
+            compiled.append((name, field.source.replace('.', '__'), None))
+        else:
+            compiled.append((name, field.source.replace('.', '__'), field.to_representation))
+    return tuple(compiled)
+
+
+@cache
+def get_cart_fields() -> tuple:
+    return compile_fields(CartSerializer())
+
+
+@cache
+def get_item_fields() -> tuple:
+    return compile_fields(CartItemSerializer())
+
+
+def to_dict(fields, row) -> dict:
+    return {name: value if convert is None else convert(value) for (name, _, convert), value in zip(fields, row)}
+
+
+def build_data(cart_fields, carts, items_by_cart) -> list:
+    data = []
+    for cart in carts:
+        cart_data = to_dict(cart_fields, cart)
+        cart_data['items_cart'] = items_by_cart[cart.id]
+        data.append(cart_data)
+    return data
+
+
+def serialize_carts(carts_queryset) -> tuple:
+    """
+    will return (cart rows, data) of given carts queryset, data being what CartSerializer(many=True) would give.
+    cart rows are named tuples with id and updated, enough for cart_cache validators. runs two queries
+    """
+    cart_fields, item_fields = get_cart_fields(), get_item_fields()
+    carts = list(carts_queryset.prefetch_related(None).values_list(
+        *(lookup for _, lookup, _ in cart_fields), named=True,
+    ))
+    items_by_cart = {cart.id: [] for cart in carts}
+    if items_by_cart:
+        item_rows = CartItem.objects.filter(cart_id__in=items_by_cart).order_by('id').values_list(
+            'cart_id', *(lookup for _, lookup, _ in item_fields),
+        )
+        for cart_id, *row in item_rows:
+            items_by_cart[cart_id].append(to_dict(item_fields, row))
+    return carts, build_data(cart_fields, carts, items_by_cart)
+
+
+async def aserialize_carts(carts_queryset) -> tuple:
+    """ async twin of serialize_carts """
+    cart_fields, item_fields = get_cart_fields(), get_item_fields()
+    carts = [cart async for cart in carts_queryset.prefetch_related(None).values_list(
+        *(lookup for _, lookup, _ in cart_fields), named=True,
+    )]
+    items_by_cart = {cart.id: [] for cart in carts}
+    if items_by_cart:
+        item_rows = CartItem.objects.filter(cart_id__in=items_by_cart).order_by('id').values_list(
+            'cart_id', *(lookup for _, lookup, _ in item_fields),
+        )
+        async for cart_id, *row in item_rows:
+            items_by_cart[cart_id].append(to_dict(item_fields, row))
+    return carts, build_data(cart_fields, carts, items_by_cart)
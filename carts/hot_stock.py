@@ -0,0 +1,630 @@
+"""
+sharded stock counters of hot products.
+a product flagged hot keeps its stock in HOT_STOCK_SHARDS counters instead of its database row, so reservations
+of a best seller stop queuing on one row lock. a reservation takes from a random shard and only drains across
+shards when that one runs short, never below zero in total. products that are not hot keep the database as
+source of truth.
+
+counters live outside of the database transaction, so every change of them is journaled twice:
+- a carts.models.HotStockEntry row (token, product, change of stock), written in the transaction of the change
+  before counters are touched, so only committed changes have one
+- a pending marker of the token next to the counters, set by the same atomic counters operation. takes change
+  counters right away, given back quantities and imports only once committed
+once its transaction is over a marker is settled: a rolled back take is given back, a committed give is added.
+journal() settles when its block fails, transaction.on_commit() when it commits, and reconcile() settles markers
+left by anything else (a rollback outside of any journal, a crashed process) after HOT_STOCK_SETTLE_GRACE
+seconds, asking the database whether their row committed.
+
+products.Product.stock_quantity of a hot product plus its journal rows is its committed stock. reconcile(), run
+every HOT_STOCK_RECONCILE_INTERVAL seconds by carts.tasks.reconcile_hot_stock, folds settled rows into
+stock_quantity and rebuilds counters that got lost (say redis was flushed) from it.
+"""
+import contextlib
+import contextvars
+import logging
+import random
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DatabaseError, IntegrityError, models, transaction
+from django.db.models import Case, F, Sum, When
+from django.db.models.functions import Greatest
+
+from carts.exceptions import LowStockQuantityException
+from carts.locks import get_redis_client
+from products import catalog
+from products.models import Product
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'hot_stock:version'
+
+# results of a take
+TAKEN, SHORT, COLD = 1, 0, -1
+
+
+class RedisStockCounters:
+    """
+    counters kept in redis, one key per shard, next to a hash of pending markers. all keys of a product share
+    one hash tag, so scripts touching several of them keep working on a redis cluster. a product without its
+    marker key is not hot
+    """
+    take_script = """
+        if redis.call('exists', KEYS[1]) == 0 then
+            return -1
+        end
+        local need = tonumber(ARGV[1])
+        local first = KEYS[tonumber(ARGV[2]) + 3]
+        if tonumber(redis.call('get', first) or '0') >= need then
+            redis.call('decrby', first, need)
+        else
+            local values = redis.call('mget', unpack(KEYS, 3))
+            local total = 0
+            for i = 1, #values do
+                values[i] = tonumber(values[i] or '0')
+                total = total + values[i]
+            end
+            if total < need then
+                return 0
+            end
+            for i = 1, #values do
+                local part = math.min(values[i], need)
+                if part > 0 then
+                    redis.call('decrby', KEYS[i + 2], part)
+                    need = need - part
+                end
+            end
+        end
+        redis.call('hset', KEYS[2], ARGV[3], '-' .. ARGV[1] .. ':1:' .. ARGV[4])
+        return 1
+    """
+    pend_script = """
+        if redis.call('exists', KEYS[1]) == 0 then
+            return 0
+        end
+        redis.call('hset', KEYS[2], ARGV[1], ARGV[2] .. ':0:' .. ARGV[3])
+        return 1
+    """
+    settle_script = """
+        if redis.call('hdel', KEYS[2], ARGV[1]) == 0 then
+            return 0
+        end
+        if tonumber(ARGV[2]) ~= 0 and redis.call('exists', KEYS[1]) == 1 then
+            redis.call('incrby', KEYS[3], ARGV[2])
+        end
+        return 1
+    """
+    drop_script = """
+        if redis.call('exists', KEYS[1]) == 0 then
+            return false
+        end
+        local total = 0
+        for _, value in ipairs(redis.call('mget', unpack(KEYS, 3))) do
+            total = total + tonumber(value or '0')
+        end
+        redis.call('del', unpack(KEYS))
+        return total
+    """
+
+    def __init__(self):
+        self.client = get_redis_client(settings.CART_REDIS_URL)
+        self.shards = settings.HOT_STOCK_SHARDS
+
+    def keys(self, product_id: int) -> list:
+        """ will return marker key, pending markers key and shard keys of a product """
+        return [f'hot_stock:{{{product_id}}}', f'hot_stock:{{{product_id}}}:pending'] + [
+            f'hot_stock:{{{product_id}}}:{shard}' for shard in range(self.shards)
+        ]
+
+    def load(self, product_id: int, quantity: int):
+        """ will (re)set counters of a product to quantity, spread evenly over its shards """
+        marker, _, *shard_keys = self.keys(product_id)
+        share, rest = divmod(quantity, self.shards)
+        pipeline = self.client.pipeline()
+        pipeline.mset({key: share + (shard < rest) for shard, key in enumerate(shard_keys)})
+        pipeline.set(marker, 1)
+        pipeline.execute()
+
+    def take(self, product_id: int, quantity: int, token: str) -> int:
+        """ will take quantity from counters and mark the take pending under token """
+        keys = self.keys(product_id)
+        return self.client.eval(self.take_script, len(keys), *keys, quantity, random.randrange(self.shards), token,
+                                time.time())
+
+    def pend(self, product_id: int, change: int, token: str) -> bool:
+        """ will mark a change to add to counters once committed, returns False if the product is not hot """
+        marker, pending, *_ = self.keys(product_id)
+        return bool(self.client.eval(self.pend_script, 2, marker, pending, token, change, time.time()))
+
+    def settle(self, product_id: int, token: str, change: int) -> bool:
+        """ will drop the pending marker of token and add change to counters, returns False if there was none """
+        marker, pending, *shard_keys = self.keys(product_id)
+        return bool(self.client.eval(self.settle_script, 3, marker, pending, random.choice(shard_keys), token,
+                                     change))
+
+    def pending(self, product_id: int) -> dict:
+        """ will return pending markers of a product, token -> (change, applied already, marked at) """
+        markers = {}
+        for token, value in self.client.hgetall(self.keys(product_id)[1]).items():
+            change, applied, marked_at = value.decode().split(':')
+            markers[token.decode()] = (int(change), applied == '1', float(marked_at))
+        return markers
+
+    def totals(self, product_ids) -> dict:
+        """ will return total stock of given products, products without counters are left out """
+        totals = {}
+        for product_id in product_ids:
+            marker, _, *shard_keys = self.keys(product_id)
+            marker_value, *values = self.client.mget([marker, *shard_keys])
+            if marker_value is not None:
+                totals[product_id] = sum(int(value or 0) for value in values)
+        return totals
+
+    def drop(self, product_id: int):
+        """ will atomically remove counters of a product and return their total, None if it had none """
+        keys = self.keys(product_id)
+        return self.client.eval(self.drop_script, len(keys), *keys)
+
+
+class LocalProductCounters:
+    """ counters and pending markers of one product in LocalStockCounters """
+    def __init__(self, values: list):
+        self.values = values
+        self.locks = [threading.Lock() for _ in values]
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+
+
+class LocalStockCounters:
+    """
+    process local counters, a stand-in for redis in tests only: other processes never see them.
+    each shard has its own lock, only a drain across shards takes all of them (in shard order)
+    """
+    products = {}
+    guard = threading.Lock()
+
+    def __init__(self):
+        self.shards = settings.HOT_STOCK_SHARDS
+
+    @classmethod
+    def clear(cls):
+        with cls.guard:
+            cls.products.clear()
+
+    def load(self, product_id: int, quantity: int):
+        share, rest = divmod(quantity, self.shards)
+        with self.guard:
+            self.products[product_id] = LocalProductCounters([share + (shard < rest) for shard in range(self.shards)])
+
+    def take(self, product_id: int, quantity: int, token: str) -> int:
+        counters = self.products.get(product_id)
+        if counters is None:
+            return COLD
+        result = self.take_from(product_id, counters, quantity)
+        if result == TAKEN:
+            with counters.pending_lock:
+                counters.pending[token] = (-quantity, True, time.time())
+        return result
+
+    def take_from(self, product_id: int, counters: LocalProductCounters, quantity: int) -> int:
+        values, locks = counters.values, counters.locks
+        shard = random.randrange(len(values))
+        with locks[shard]:
+            if self.products.get(product_id) is not counters:
+                return COLD
+            if values[shard] >= quantity:
+                values[shard] -= quantity
+                return TAKEN
+        with contextlib.ExitStack() as stack:
+            for lock in locks:
+                stack.enter_context(lock)
+            if self.products.get(product_id) is not counters:
+                return COLD
+            if sum(values) < quantity:
+                return SHORT
+            for shard, value in enumerate(values):
+                part = min(max(value, 0), quantity)
+                values[shard] -= part
+                quantity -= part
+            return TAKEN
+
+    def pend(self, product_id: int, change: int, token: str) -> bool:
+        counters = self.products.get(product_id)
+        if counters is None:
+            return False
+        with counters.pending_lock:
+            counters.pending[token] = (change, False, time.time())
+        return True
+
+    def settle(self, product_id: int, token: str, change: int) -> bool:
+        counters = self.products.get(product_id)
+        if counters is None:
+            return False
+        with counters.pending_lock:
+            if counters.pending.pop(token, None) is None:
+                return False
+        shard = random.randrange(len(counters.values))
+        with counters.locks[shard]:
+            counters.values[shard] += change
+        return True
+
+    def pending(self, product_id: int) -> dict:
+        counters = self.products.get(product_id)
+        if counters is None:
+            return {}
+        with counters.pending_lock:
+            return dict(counters.pending)
+
+    def totals(self, product_ids) -> dict:
+        totals = {}
+        for product_id in product_ids:
+            counters = self.products.get(product_id)
+            if counters is not None:
+                totals[product_id] = sum(counters.values)
+        return totals
+
+    def drop(self, product_id: int):
+        with self.guard:
+            counters = self.products.pop(product_id, None)
+        if counters is None:
+            return None
+        with contextlib.ExitStack() as stack:
+            for lock in counters.locks:
+                stack.enter_context(lock)
+            return sum(counters.values)
+
+
+HOT_STOCK_BACKENDS = {
+    'redis': RedisStockCounters,
+    'local': LocalStockCounters,
+}
+
+
+def get_counters():
+    """ will return stock counters of the backend chosen by HOT_STOCK_BACKEND setting """
+    if settings.HOT_STOCK_BACKEND is None:
+        raise ImproperlyConfigured('hot stock counters must be shared by every process, set CART_REDIS_URL')
+    return HOT_STOCK_BACKENDS[settings.HOT_STOCK_BACKEND]()
+
+
+class HotProductsSnapshot:
+    """
+    process local set of hot product ids, trusted for HOT_STOCK_CACHE_TTL seconds and then checked against
+    a version key in the shared cache. it is only a routing hint, a stale one costs a retry, never stock
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.product_ids = None
+        self.version = None
+        self.fresh_until = 0.0
+
+    def get_product_ids(self) -> frozenset:
+        if self.product_ids is not None and time.monotonic() < self.fresh_until:
+            return self.product_ids
+        with self.lock:
+            if self.product_ids is not None and time.monotonic() < self.fresh_until:
+                return self.product_ids
+            version = cache.get(VERSION_CACHE_KEY, 0)
+            if self.product_ids is None or version != self.version:
+                self.product_ids = frozenset(Product.objects.filter(is_hot=True).values_list('pk', flat=True))
+                self.version = version
+            self.fresh_until = time.monotonic() + settings.HOT_STOCK_CACHE_TTL
+            return self.product_ids
+
+    def invalidate(self):
+        with self.lock:
+            self.product_ids = None
+
+
+snapshot = HotProductsSnapshot()
+
+
+def bump_version():
+    snapshot.invalidate()
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(VERSION_CACHE_KEY, 1, timeout=None)
+
+
+def split(deltas: dict) -> tuple:
+    """ will split deltas (product id -> quantity) into (hot deltas, other deltas) """
+    hot_ids = snapshot.get_product_ids()
+    if not hot_ids:
+        return {}, deltas
+    hot_deltas, other_deltas = {}, {}
+    for product_id, delta in deltas.items():
+        (hot_deltas if product_id in hot_ids else other_deltas)[product_id] = delta
+    return hot_deltas, other_deltas
+
+
+compensations = contextvars.ContextVar('stock_compensations', default=None)
+
+
+@contextlib.contextmanager
+def journal():
+    """
+    will undo stock changes made outside of the database transaction (see track) inside the block if the block
+    raises. wrap the outermost transaction with it, nested journals join the outer one
+    """
+    if compensations.get() is not None:
+        yield
+        return
+    undo = []
+    token = compensations.set(undo)
+    try:
+        yield
+    except BaseException:
+        # compensations run transactions of their own, which must not join this journal
+        compensations.reset(token)
+        for compensate in undo:
+            try:
+                compensate()
+            except Exception:
+                # journal rows and pending markers let a later reconcile finish the job
+                logger.exception('could not undo a stock change of a failed transaction')
+        raise
+    else:
+        compensations.reset(token)
+
+
+def track(compensate):
+    """ will note how to undo a stock change made outside of the database transaction, for the current journal """
+    undo = compensations.get()
+    if undo is not None:
+        undo.append(compensate)
+
+
+def is_committed(token: str, product_id: int) -> bool:
+    """
+    will tell if the journal row of token is committed. the row is written before counters change, so while
+    the transaction writing it is running, inserting the same token waits for it to end
+    """
+    from carts.models import HotStockEntry
+
+    try:
+        with transaction.atomic():
+            HotStockEntry.objects.create(token=token, product_id=product_id, quantity=0)
+            transaction.set_rollback(True)
+    except IntegrityError:
+        return True
+    return False
+
+
+def settle(product_id: int, token: str, change: int, applied: bool, committed: bool):
+    """
+    will settle the pending change of token once its transaction is over: an applied change that rolled back
+    is undone, a committed one that was not applied yet is added. a product cooled meanwhile has no counters
+    anymore, its row gets the change instead
+    """
+    if applied:
+        due = 0 if committed else -change
+    else:
+        due = change if committed else 0
+    if not get_counters().settle(product_id, token, due) and due:
+        Product.objects.filter(pk=product_id, is_hot=False).update(
+            stock_quantity=Greatest(F('stock_quantity') + due, 0)
+        )
+
+
+def settle_failed(marked: list):
+    """ will settle (entry, applied) changes of a failed block, which may have failed after its commit """
+    for entry, applied in marked:
+        try:
+            committed = is_committed(entry.token, entry.product_id)
+        except DatabaseError:
+            logger.exception('could not check hot stock entry %s, leaving it to reconcile', entry.token)
+            continue
+        settle(entry.product_id, entry.token, entry.quantity, applied, committed)
+
+
+def journal_changes(changes: dict, mark) -> dict:
+    """
+    will write journal rows of changes (product id -> change of stock) and mark each of them next to counters
+    with mark(counters, entry), returning TAKEN, SHORT or COLD. stops at the first SHORT one, rows of COLD ones
+    are deleted again. returns {product id: change} of products not marked
+    """
+    from carts.models import HotStockEntry
+
+    entries = HotStockEntry.objects.bulk_create(
+        HotStockEntry(token=uuid.uuid4().hex, product_id=product_id, quantity=change)
+        for product_id, change in sorted(changes.items()) if change
+    )
+    counters = get_counters()
+    marked, unmarked = [], []
+    try:
+        for entry in entries:
+            result = mark(counters, entry)
+            if result == TAKEN:
+                marked.append((entry, entry.quantity < 0))
+            else:
+                unmarked.append((entry, result))
+                if result == SHORT:
+                    break
+    finally:
+        if marked:
+            def settle_committed():
+                for entry, applied in marked:
+                    settle(entry.product_id, entry.token, entry.quantity, applied, True)
+
+            transaction.on_commit(settle_committed)
+            track(lambda: settle_failed(marked))
+    cold_tokens = [entry.token for entry, result in unmarked if result == COLD]
+    if cold_tokens:
+        HotStockEntry.objects.filter(token__in=cold_tokens).delete()
+    return {entry.product_id: entry.quantity for entry, _ in unmarked}
+
+
+def apply(deltas: dict) -> dict:
+    """
+    will take positive deltas from counters and give negative ones back once committed. returns deltas of
+    products that turned out not to be hot, for the database to handle
+    """
+    def mark(counters, entry):
+        if entry.quantity < 0:
+            result = counters.take(entry.product_id, -entry.quantity, entry.token)
+            if result == SHORT:
+                raise_shortage(entry.product_id, -entry.quantity)
+            return result
+        return TAKEN if counters.pend(entry.product_id, entry.quantity, entry.token) else COLD
+
+    cold = journal_changes({product_id: -delta for product_id, delta in deltas.items()}, mark)
+    return {product_id: -change for product_id, change in cold.items()}
+
+
+def raise_shortage(product_id: int, delta: int):
+    product = Product.objects.get(pk=product_id)
+    available = get_counters().totals([product_id]).get(product_id, 0)
+    raise LowStockQuantityException(f"requested extra quantity of product: {product} is {delta},"
+                                    f" while {available} is available!")
+
+
+def restock(stocks: dict):
+    """
+    will set stock of hot products (product id -> stock), like an import does to a database row. run it in the
+    transaction holding their rows locks: the difference to their committed stock is journaled and reaches
+    counters once committed, so reservations running meanwhile are kept
+    """
+    committed = Product.objects.filter(pk__in=stocks, is_hot=True).annotate(
+        journaled=Sum('hot_stock_entries__quantity')
+    ).values_list('pk', 'stock_quantity', 'journaled')
+    def mark(counters, entry):
+        # lost counters are rebuilt by reconcile, journal rows included
+        counters.pend(entry.product_id, entry.quantity, entry.token)
+        return TAKEN
+
+    journal_changes(
+        {product_id: stocks[product_id] - stock - (journaled or 0) for product_id, stock, journaled in committed},
+        mark,
+    )
+
+
+def heat(product_id: int) -> bool:
+    """
+    will move stock of a product into counters and flag it hot, returns False if it is hot already.
+    run it outside of any transaction
+    """
+    from carts.models import HotStockEntry
+
+    counters = get_counters()
+    loaded = False
+    try:
+        with transaction.atomic():
+            stock = Product.objects.select_for_update().filter(pk=product_id, is_hot=False).values_list(
+                'stock_quantity', flat=True
+            ).first()
+            if stock is None:
+                return False
+            # rows committed after the product was cooled last time, their changes are in stock already
+            HotStockEntry.objects.filter(product_id=product_id).delete()
+            counters.load(product_id, stock)
+            loaded = True
+            Product.objects.filter(pk=product_id).update(is_hot=True)
+            transaction.on_commit(bump_version)
+    except BaseException:
+        if loaded:
+            counters.drop(product_id)
+        raise
+    return True
+
+
+def cool(product_id: int) -> bool:
+    """
+    will move counters of a hot product back into its database row and drop the hot flag, returns False if it
+    was not hot. run it outside of any transaction, changes pending then reach the row once settled
+    """
+    from carts.models import HotStockEntry
+
+    counters = get_counters()
+    stock = None
+    try:
+        with transaction.atomic():
+            if not Product.objects.select_for_update().filter(pk=product_id, is_hot=True).exists():
+                return False
+            stock = counters.drop(product_id)
+            if stock is None:
+                # counters got lost, the journal tells what is left
+                fold([product_id], counters)
+            else:
+                Product.objects.filter(pk=product_id).update(stock_quantity=max(stock, 0))
+            HotStockEntry.objects.filter(product_id=product_id).delete()
+            Product.objects.filter(pk=product_id).update(is_hot=False)
+            transaction.on_commit(bump_version)
+            transaction.on_commit(lambda: catalog.invalidate_stocks([product_id]))
+    except BaseException:
+        if stock is not None:
+            counters.load(product_id, stock)
+        raise
+    return True
+
+
+def fold(product_ids: list, counters) -> dict:
+    """
+    will add settled journal rows of given products to their stock quantity and delete them, rows of pending
+    changes are kept for is_committed(). returns {product id: stock quantity}. run it holding their rows locks
+    """
+    from carts.models import HotStockEntry
+
+    # a committed row was marked before its commit, so markers read after rows include its marker if pending
+    rows = list(HotStockEntry.objects.filter(product_id__in=product_ids).values_list('pk', 'token', 'product_id',
+                                                                                     'quantity'))
+    pending_tokens = set()
+    for product_id in product_ids:
+        pending_tokens.update(counters.pending(product_id))
+    rows = [(pk, product_id, quantity) for pk, token, product_id, quantity in rows if token not in pending_tokens]
+
+    changes = {}
+    for _, product_id, quantity in rows:
+        changes[product_id] = changes.get(product_id, 0) + quantity
+    if changes:
+        Product.objects.filter(pk__in=changes).update(
+            stock_quantity=Greatest(Case(
+                *(When(pk=product_id, then=F('stock_quantity') + change) for product_id, change in changes.items()),
+                default=F('stock_quantity'),
+                output_field=models.IntegerField(),
+            ), 0)
+        )
+        pks = [pk for pk, _, _ in rows]
+        for index in range(0, len(pks), 1000):
+            HotStockEntry.objects.filter(pk__in=pks[index:index + 1000]).delete()
+    return dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'stock_quantity'))
+
+
+def reconcile(product_ids=None) -> int:
+    """
+    will settle changes of hot products (all of them by default) pending longer than HOT_STOCK_SETTLE_GRACE
+    seconds, fold settled journal rows into their stock quantity and load counters that got lost (say redis
+    was flushed) back from it. returns number of reconciled products
+    """
+    from carts.models import HotStockEntry
+
+    hot_products = Product.objects.filter(is_hot=True)
+    if product_ids is not None:
+        hot_products = hot_products.filter(pk__in=product_ids)
+    hot_ids = list(hot_products.values_list('pk', flat=True))
+    if not hot_ids:
+        return 0
+    counters = get_counters()
+
+    stale_before = time.time() - settings.HOT_STOCK_SETTLE_GRACE
+    for product_id in hot_ids:
+        for token, (change, applied, marked_at) in counters.pending(product_id).items():
+            if marked_at < stale_before:
+                settle(product_id, token, change, applied, is_committed(token, product_id))
+
+    with transaction.atomic():
+        # a product being cooled holds its row lock until it is cold
+        locked_ids = list(Product.objects.select_for_update().filter(pk__in=hot_ids, is_hot=True).order_by(
+            'pk'
+        ).values_list('pk', flat=True))
+        stocks = fold(locked_ids, counters)
+        for product_id in set(locked_ids) - set(counters.totals(locked_ids)):
+            counters.load(product_id, stocks[product_id])
+        # rows committed after their product was cooled, their changes are in stock already
+        HotStockEntry.objects.filter(product__is_hot=False).delete()
+        transaction.on_commit(lambda: catalog.invalidate_stocks(locked_ids))
+    return len(locked_ids)
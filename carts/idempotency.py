@@ -0,0 +1,79 @@
+"""
+Idempotency-Key support of cart writes.
+the first successful response of a key is kept for CART_IDEMPOTENCY_TTL seconds and replayed to every retry
+carrying the same key, so a retried request never reserves stock twice. while the first request runs it holds
+a lock, duplicates wait up to CART_IDEMPOTENCY_WAIT seconds for its response instead of running again.
+keys are scoped per user, a key sent again with another body is refused. failed requests are not kept, a
+retry of them runs again.
+"""
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+from carts.exceptions import IdempotencyKeyReused, IdempotentRequestInProgress
+
+KEY_PREFIX = 'idempotency'
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+# seconds between two looks at the response of a running duplicate
+POLL_INTERVAL = 0.05
+
+
+def get_cache():
+    return caches[settings.CART_IDEMPOTENCY_CACHE_ALIAS]
+
+
+def fingerprint(data) -> str:
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def replay(entry: dict, request_fingerprint: str) -> Response:
+    if entry['fingerprint'] != request_fingerprint:
+        raise IdempotencyKeyReused()
+    return Response(entry['data'], status=entry['status'], headers={**entry['headers'], REPLAYED_HEADER: 'true'})
+
+
+def run_once(scope, key: str, data, execute) -> Response:
+    """
+    will return the response kept for key in scope, or call execute() and keep its response if it succeeded.
+    raises IdempotencyKeyReused when key was used with other data, and IdempotentRequestInProgress when
+    the request holding key does not finish in time
+    """
+    cache = get_cache()
+    request_fingerprint = fingerprint(data)
+    entry_key = f'{KEY_PREFIX}:{scope}:{key}'
+    lock_key = f'{entry_key}:lock'
+    deadline = time.monotonic() + settings.CART_IDEMPOTENCY_WAIT
+    while True:
+        entry = cache.get(entry_key)
+        if entry is not None:
+            return replay(entry, request_fingerprint)
+        if cache.add(lock_key, request_fingerprint, timeout=settings.CART_IDEMPOTENCY_LOCK_TTL):
+            break
+        running_fingerprint = cache.get(lock_key)
+        if running_fingerprint is not None and running_fingerprint != request_fingerprint:
+            raise IdempotencyKeyReused()
+        if time.monotonic() >= deadline:
+            raise IdempotentRequestInProgress()
+        time.sleep(POLL_INTERVAL)
+
+    try:
+        # the first request may have finished between the look above and taking the lock
+        entry = cache.get(entry_key)
+        if entry is not None:
+            return replay(entry, request_fingerprint)
+        response = execute()
+        if response.status_code < 400:
+            cache.set(entry_key, {
+                'fingerprint': request_fingerprint,
+                'status': response.status_code,
+                'data': response.data,
+                'headers': {name: value for name, value in response.items() if name != 'Content-Type'},
+            }, timeout=settings.CART_IDEMPOTENCY_TTL)
+        return response
+    finally:
+        cache.delete(lock_key)
@@ -0,0 +1,96 @@
+"""
+leases keep a periodic task from running on several workers at once.
+a lease is held by one owner until it is released or its ttl runs out, so a crashed worker can not block
+the task forever.
+"""
+import functools
+import uuid
+
+import redis
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+
+class Lease:
+    """ base class of leases, use it as a context manager and check ``acquired`` """
+    def __init__(self, name: str, ttl: float):
+        self.name = name
+        self.ttl = ttl
+        self.token = uuid.uuid4().hex
+        self.acquired = False
+
+    def acquire(self) -> bool:
+        raise NotImplementedError
+
+    def release(self):
+        raise NotImplementedError
+
+    def __enter__(self):
+        self.acquired = self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.acquired:
+            self.release()
+            self.acquired = False
+
+
+@functools.lru_cache
+def get_redis_client(url: str):
+    return redis.Redis.from_url(url)
+
+
+class RedisLease(Lease):
+    """ lease stored as a redis key with an expiry, only its owner may delete it """
+    release_script = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, name: str, ttl: float):
+        super().__init__(name, ttl)
+        self.client = get_redis_client(settings.CART_REDIS_URL)
+        self.key = f'lease:{name}'
+
+    def acquire(self) -> bool:
+        return bool(self.client.set(self.key, self.token, nx=True, px=int(self.ttl * 1000)))
+
+    def release(self):
+        self.client.eval(self.release_script, 1, self.key, self.token)
+
+
+class DatabaseLease(Lease):
+    """ lease stored as a row of TaskLease, needs nothing but the database """
+    def acquire(self) -> bool:
+        from carts.models import TaskLease
+
+        now = timezone.now()
+        expires_at = now + timezone.timedelta(seconds=self.ttl)
+        if TaskLease.objects.filter(name=self.name, expires_at__lte=now).update(owner=self.token,
+                                                                               expires_at=expires_at):
+            return True
+        try:
+            with transaction.atomic():
+                TaskLease.objects.create(name=self.name, owner=self.token, expires_at=expires_at)
+        except IntegrityError:
+            return False
+        return True
+
+    def release(self):
+        from carts.models import TaskLease
+
+        TaskLease.objects.filter(name=self.name, owner=self.token).delete()
+
+
+LEASE_BACKENDS = {
+    'redis': RedisLease,
+    'database': DatabaseLease,
+}
+
+
+def get_lease(name: str, ttl: float) -> Lease:
+    """ will return a lease of the backend chosen by CART_LEASE_BACKEND setting """
+    return LEASE_BACKENDS[settings.CART_LEASE_BACKEND](name, ttl)
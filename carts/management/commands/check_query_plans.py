@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from carts.query_plans import check_query_plans, seed
+
+
+class Command(BaseCommand):
+    help = ('explains hot cart queries against a seeded throwaway database and fails if any of them '
+            'falls back to a full table scan')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--carts', type=int, default=2000, help='number of carts to seed')
+        parser.add_argument('--verbose-plans', action='store_true', help='print every query plan')
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            seed(carts_count=options['carts'])
+            results = check_query_plans()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        failed = []
+        for name, (plan, full_scans) in results.items():
+            if full_scans:
+                failed.append(name)
+                self.stdout.write(self.style.ERROR(f'{name}: full scan of {", ".join(full_scans)}'))
+            else:
+                self.stdout.write(self.style.SUCCESS(f'{name}: ok'))
+            if full_scans or options['verbose_plans']:
+                self.stdout.write(plan)
+
+        if failed:
+            raise CommandError(f'{len(failed)} hot queries fall back to a full scan')
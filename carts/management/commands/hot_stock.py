@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from carts import hot_stock
+
+
+class Command(BaseCommand):
+    help = 'moves stock of products into hot stock counters and back, or reconciles counters with products'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['heat', 'cool', 'reconcile'])
+        parser.add_argument('product_ids', nargs='*', type=int)
+
+    def handle(self, *args, **options):
+        if settings.HOT_STOCK_BACKEND != 'redis':
+            # counters of any other backend would live and die with this process
+            raise CommandError('hot stock counters need redis shared by every process, set CART_REDIS_URL')
+        action, product_ids = options['action'], options['product_ids']
+        if action == 'reconcile':
+            written_count = hot_stock.reconcile(product_ids or None)
+            self.stdout.write(self.style.SUCCESS(f'reconciled {written_count} hot products'))
+            return
+        move = hot_stock.heat if action == 'heat' else hot_stock.cool
+        moved_ids = [product_id for product_id in product_ids if move(product_id)]
+        self.stdout.write(self.style.SUCCESS(f'{action}ed products: {moved_ids}'))
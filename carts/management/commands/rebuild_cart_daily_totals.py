@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from carts.models import Cart, CartDailyTotal
+from carts.tasks import refresh_carts_in_chunks
+
+
+class Command(BaseCommand):
+    help = 'rebuilds CartDailyTotal rollup of all carts from scratch'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            CartDailyTotal.objects.all().delete()
+            carts_count = refresh_carts_in_chunks(Cart.objects.all())
+        self.stdout.write(self.style.SUCCESS(f'rebuilt daily totals of {carts_count} carts'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from carts.models import Cart
+
+
+class Command(BaseCommand):
+    help = ('checks total_amount and item_count of every cart against its items, chunk by chunk, '
+            'and recomputes the drifted ones with --repair')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true', help='recompute totals of drifted carts')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='number of carts checked at once')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        cart_ids = list(Cart.objects.order_by('pk').values_list('pk', flat=True))
+        drifted_ids = []
+        for index in range(0, len(cart_ids), chunk_size):
+            chunk = Cart.objects.filter(pk__in=cart_ids[index:index + chunk_size])
+            chunk_drifted_ids = Cart.find_drifted_totals(chunk)
+            if chunk_drifted_ids and options['repair']:
+                Cart.refresh_totals(Cart.objects.filter(pk__in=chunk_drifted_ids))
+            drifted_ids.extend(chunk_drifted_ids)
+
+        if not drifted_ids:
+            self.stdout.write(self.style.SUCCESS(f'totals of all {len(cart_ids)} carts are right'))
+        elif options['repair']:
+            self.stdout.write(self.style.SUCCESS(f'repaired totals of {len(drifted_ids)} carts: {drifted_ids}'))
+        else:
+            raise CommandError(f'totals of {len(drifted_ids)} carts drifted: {drifted_ids}')
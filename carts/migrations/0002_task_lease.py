@@ -0,0 +1,32 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskLease',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=64, unique=True, verbose_name='unique name of lease')),
+                ('owner', models.CharField(max_length=32, verbose_name='token of current owner')),
+                ('expires_at', models.DateTimeField(verbose_name='lease expires at')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='cart',
+            name='is_dead',
+            field=models.BooleanField(db_index=True, default=False, verbose_name='is the cart left out'),
+        ),
+        migrations.AlterField(
+            model_name='cart',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='last updated at'),
+        ),
+    ]
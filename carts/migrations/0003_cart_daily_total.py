@@ -0,0 +1,29 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0002_task_lease'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartDailyTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='day of cart last update')),
+                ('updated', models.DateTimeField(db_index=True, verbose_name='cart last updated at')),
+                ('total_amount', models.PositiveBigIntegerField(verbose_name='sum of cart items price')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cart_daily_totals', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'user'), name='unique_date_user')],
+            },
+        ),
+    ]
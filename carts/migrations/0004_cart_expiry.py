@@ -0,0 +1,21 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0003_cart_daily_total'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CartExpiry',
+            fields=[
+                ('cart', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='expiry', serialize=False, to='carts.cart')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='cart expires at')),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:54
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0004_cart_expiry'),
+        ('products', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cart',
+            name='is_dead',
+            field=models.BooleanField(default=False, verbose_name='is the cart left out'),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(condition=models.Q(('is_dead', False)), fields=['updated'], name='cart_alive_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cartdailytotal',
+            index=models.Index(fields=['date', '-total_amount', 'user'], name='dailytotal_date_amount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cartitem',
+            index=models.Index(fields=['cart', 'products', 'quantity'], name='cartitem_cart_quantity_idx'),
+        ),
+    ]
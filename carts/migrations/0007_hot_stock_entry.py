@@ -0,0 +1,24 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0006_cart_totals'),
+        ('products', '0003_product_is_hot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HotStockEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=32, unique=True, verbose_name='token of the change')),
+                ('quantity', models.IntegerField(verbose_name='change of stock, negative for a take')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hot_stock_entries', to='products.product')),
+            ],
+        ),
+    ]
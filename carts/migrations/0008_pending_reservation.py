@@ -0,0 +1,25 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0007_hot_stock_entry'),
+        ('products', '0003_product_is_hot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=32, unique=True, verbose_name='token of the reservation')),
+                ('quantity', models.PositiveIntegerField(verbose_name='reserved quantity')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='reserved at')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_reservations', to='products.product')),
+            ],
+        ),
+    ]
@@ -1,49 +1,199 @@
 from collections import defaultdict
 
 from django.db import models, transaction
-from django.db.models import Sum
+from django.db.models import Case, F, OuterRef, Subquery, Sum, Value, When
 from django.contrib.auth import get_user_model
-from django.db.models.functions import JSONObject
+from django.db.models.functions import Coalesce, JSONObject
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from carts import cart_cache, expiry, hot_stock, report_cache
 from carts.exceptions import LowStockQuantityException
+from carts.reservations import apply_stock_deltas, reserve_stock, release_stock
+from products.models import Product
 
 
 class Cart(models.Model):
     """ contain records of carts """
     user = models.OneToOneField(to=get_user_model(), on_delete=models.CASCADE)
     updated = models.DateTimeField(_('last updated at'), auto_now=True, db_index=True)
-    is_dead = models.BooleanField(_('is the cart left out'), default=False, db_index=True)
+    is_dead = models.BooleanField(_('is the cart left out'), default=False)
+    # kept up to date by every write of cart items, see Cart.change_totals
+    total_amount = models.PositiveBigIntegerField(_('sum of cart items price'), default=0)
+    item_count = models.PositiveIntegerField(_('sum of cart items quantity'), default=0)
+
+    class Meta:
+        indexes = [
+            # expiry sweep only ever looks for alive carts, oldest first
+            models.Index(fields=['updated'], condition=models.Q(is_dead=False), name='cart_alive_updated_idx'),
+        ]
 
     def kill(self):
-        """ will give back quantities to products and turn the is_dead tp False """
+        """ will give back quantities to products and turn the is_dead to True """
         if self.is_dead:
             return
-        with transaction.atomic():
-            self.is_dead = True
-            items = CartItem.objects.filter(cart=self).prefetch_related()
-            for item in items:
-                item.add_from_stock()
-            self.save()
+        Cart.kill_many([self.pk])
+        self.is_dead = True
 
     def revive(self):
         """
         will retake products in cart from products quantity if possible and switch is_dead
-        if is_dead is True
+        if is_dead is True. stock of every item is checked before anything is written, so a cart
+        short on stock fails fast
         """
         if not self.is_dead:
             return
-        with transaction.atomic():
-            self.is_dead = False
-            items = CartItem.objects.filter(cart=self).prefetch_related()
+        with hot_stock.journal(), transaction.atomic():
+            items = list(CartItem.objects.filter(cart=self).select_related('products'))
             for item in items:
-                item.subtract_from_stock()
-            self.save()
+                # stock quantity of a hot product lags behind, its counters do the check
+                if not item.products.is_hot and item.products.stock_quantity < item.quantity:
+                    raise LowStockQuantityException(f"requested quantity of product: {item.products} is "
+                                                    f"{item.quantity}, while {item.products.stock_quantity} "
+                                                    f"is available!")
+            apply_stock_deltas({item.products_id: item.quantity for item in items})
+            self.is_dead = False
+            self.save(update_fields=["is_dead", "updated"])
+            transaction.on_commit(lambda: cart_cache.invalidate(self.user_id))
+
+    @staticmethod
+    def kill_many(cart_ids, updated_before=None) -> int:
+        """
+        will kill given carts in bulk: quantities to give back are summed per product with one GROUP BY,
+        returned to all products with one UPDATE and all carts are flipped to dead with one UPDATE.
+        given updated_before, carts touched since then are left alive, checked under their row locks.
+        returns number of carts actually killed
+        """
+        if not cart_ids:
+            return 0
+        with transaction.atomic():
+            carts = Cart.objects.select_for_update().filter(pk__in=cart_ids, is_dead=False)
+            if updated_before is not None:
+                carts = carts.filter(updated__lt=updated_before)
+            alive_carts = dict(carts.values_list('pk', 'user_id'))
+            if not alive_carts:
+                return 0
+            alive_ids = list(alive_carts)
+            returned_quantities = CartItem.objects.filter(cart_id__in=alive_ids).values('products_id').annotate(
+                total_quantity=Sum('quantity')
+            ).order_by('products_id').values_list('products_id', 'total_quantity')
+            apply_stock_deltas({product_id: -total_quantity for product_id, total_quantity in returned_quantities})
+            Cart.objects.filter(pk__in=alive_ids).update(is_dead=True, updated=timezone.now())
+            transaction.on_commit(lambda: cart_cache.invalidate(*alive_carts.values()))
+            transaction.on_commit(lambda: expiry.remove_carts(alive_ids))
+        return len(alive_ids)
+
+    @staticmethod
+    def kill_expired_chunk(expired_before, chunk_size: int) -> int:
+        """
+        will claim up to chunk_size expired carts and kill them. carts claimed by another worker are skipped
+        (SKIP LOCKED where supported), so several workers can drain a backlog side by side
+        """
+        with transaction.atomic():
+            cart_ids = list(
+                Cart.objects.select_for_update(skip_locked=True).filter(
+                    is_dead=False, updated__lt=expired_before
+                ).order_by('updated').values_list('pk', flat=True)[:chunk_size]
+            )
+            return Cart.kill_many(cart_ids)
+
+    @staticmethod
+    def change_totals(cart_id: int, deltas: dict, **fields):
+        """
+        will add quantity deltas (product id -> quantity) of a cart's items to its total_amount and item_count,
+        pricing them in the same UPDATE, which also writes given extra fields
+        """
+        if not deltas:
+            return
+        amount = Product.objects.filter(pk__in=deltas).order_by().annotate(group=Value(1)).values('group').annotate(
+            amount=Sum(Case(
+                *(When(pk=product_id, then=F('price') * delta) for product_id, delta in deltas.items()),
+                default=0,
+                output_field=models.BigIntegerField(),
+            ))
+        ).values('amount')
+        Cart.objects.filter(pk=cart_id).update(
+            total_amount=F('total_amount') + Coalesce(Subquery(amount), 0),
+            item_count=F('item_count') + sum(deltas.values()),
+            **fields,
+        )
+
+    @staticmethod
+    def live_totals():
+        """ will return (total_amount, item_count) expressions of a cart computed from its items """
+        items = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+        return (
+            Coalesce(Subquery(items.annotate(amount=Sum(F('products__price') * F('quantity'))).values('amount')), 0),
+            Coalesce(Subquery(items.annotate(count=Sum('quantity')).values('count')), 0),
+        )
+
+    @staticmethod
+    def refresh_totals(carts) -> int:
+        """ will recompute total_amount and item_count of given carts queryset from their items, and their rollup """
+        total_amount, item_count = Cart.live_totals()
+        with transaction.atomic():
+            cart_ids = list(carts.values_list('pk', flat=True))
+            refreshed_count = Cart.objects.filter(pk__in=cart_ids).update(total_amount=total_amount,
+                                                                          item_count=item_count)
+            CartDailyTotal.refresh_carts(cart_ids)
+        return refreshed_count
+
+    @staticmethod
+    def find_drifted_totals(carts) -> list:
+        """ will return ids of carts in given queryset whose total_amount or item_count differ from their items """
+        total_amount, item_count = Cart.live_totals()
+        return list(carts.annotate(live_amount=total_amount, live_count=item_count).exclude(
+            total_amount=F('live_amount'), item_count=F('live_count')
+        ).values_list('pk', flat=True))
+
+    @staticmethod
+    def report_rows(start_date=None, end_date=None):
+        """
+        will return (date, username, total_amount) rows of carts with items for a given interval,
+        read from CartDailyTotal rollup, the one source of every report
+        """
+        filters = {}
+        if start_date is not None:
+            filters['updated__gte'] = start_date
+        if end_date is not None:
+            filters['updated__lte'] = end_date
+
+        return CartDailyTotal.objects.filter(**filters).values_list('date', 'user__username', 'total_amount')
 
     @staticmethod
     def get_all_carts_sum(start_date=None, end_date=None) -> dict:
-        """ will return aggregate sum for all carts for a given interval """
+        """ will return aggregate sum for all carts for a given interval, read from CartDailyTotal rollup """
+        data = defaultdict(lambda: [])
+        for date, username, total_amount in Cart.report_rows(start_date, end_date).order_by('-total_amount'):
+            data[date.strftime('%Y-%m-%d')].append({'username': username, 'total_amount': total_amount})
+
+        return dict(data)
+
+    @staticmethod
+    async def aget_all_carts_sum(start_date=None, end_date=None) -> dict:
+        """ async twin of get_all_carts_sum """
+        data = defaultdict(lambda: [])
+        async for date, username, total_amount in Cart.report_rows(start_date, end_date).order_by('-total_amount'):
+            data[date.strftime('%Y-%m-%d')].append({'username': username, 'total_amount': total_amount})
+
+        return dict(data)
+
+    @staticmethod
+    def iter_all_carts_sum(start_date=None, end_date=None, chunk_size: int = 2000):
+        """
+        will lazily yield (date, username, total_amount) of all carts for a given interval, newest day first,
+        reading the rollup in chunks so memory stays flat no matter how big the report is
+        """
+        all_carts = Cart.report_rows(start_date, end_date).order_by('-date', '-total_amount')
+        for date, username, total_amount in all_carts.iterator(chunk_size=chunk_size):
+            yield date.strftime('%Y-%m-%d'), username, total_amount
+
+    @staticmethod
+    def get_all_carts_sum_live(start_date=None, end_date=None) -> dict:
+        """
+        will return aggregate sum for all carts for a given interval straight from cart items,
+        it is expensive and kept to check CartDailyTotal rollup against
+        """
         filters = {}
         if start_date is not None:
             filters['cart__updated__gte'] = start_date
@@ -76,50 +226,209 @@ class CartItem(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['cart', 'products'], name='unique_cart_products')
         ]
+        indexes = [
+            # covers per cart quantity sums (kill, report) without touching the table
+            models.Index(fields=['cart', 'products', 'quantity'], name='cartitem_cart_quantity_idx'),
+        ]
 
     @staticmethod
     def create_cart_items_and_subtract_from_stock(user, items):
-        with transaction.atomic():
-            cart, created = Cart.objects.get_or_create(user=user)
-            if not created:
-                cart.updated = timezone.now()
+        """
+        will upsert given items into user's cart and reserve their quantities from stock,
+        using a fixed number of queries no matter how many items are given
+        """
+        quantities = {item['products_id']: item['quantity'] for item in items}
+        with hot_stock.journal(), transaction.atomic():
+            # a sweep killing the cart meanwhile holds its row lock, is_dead is read after it committed
+            cart, created = Cart.objects.select_for_update().get_or_create(user_id=user.pk)
+            if cart.is_dead:
+                cart.revive()
+            elif not created:
                 cart.save(update_fields=["updated"])
+
+            old_items = {
+                item.products_id: item
+                for item in CartItem.objects.filter(cart=cart, products_id__in=quantities)
+            }
+            deltas = {}
+            new_items = []
+            changed_items = []
+            for product_id, quantity in quantities.items():
+                old_item = old_items.get(product_id)
+                if old_item is None:
+                    deltas[product_id] = quantity
+                    new_items.append(CartItem(cart=cart, products_id=product_id, quantity=quantity))
+                elif old_item.quantity != quantity:
+                    deltas[product_id] = quantity - old_item.quantity
+                    old_item.quantity = quantity
+                    changed_items.append(old_item)
+
+            apply_stock_deltas(deltas)
+            if new_items:
+                CartItem.objects.bulk_create(new_items)
+            if changed_items:
+                CartItem.objects.bulk_update(changed_items, ['quantity'])
+            Cart.change_totals(cart.id, deltas)
+            transaction.on_commit(lambda: cart_cache.invalidate(cart.user_id))
+            transaction.on_commit(lambda: expiry.schedule_carts({cart.id: cart.updated}))
+
+            return cart
+
+    @staticmethod
+    def apply_line_operations(user, operations) -> tuple:
+        """
+        will apply line operations ({'op': 'set' | 'increment' | 'remove', 'products_id', 'quantity'}) to user's
+        cart in order, touching only the items and products they name. removed lines give their quantity back to
+        stock. returns (cart, items still in cart after the change, ids of removed products)
+        """
+        product_ids = {operation['products_id'] for operation in operations}
+        with hot_stock.journal(), transaction.atomic():
+            # a sweep killing the cart meanwhile holds its row lock, is_dead is read after it committed
+            cart, created = Cart.objects.select_for_update().get_or_create(user_id=user.pk)
+            if cart.is_dead:
                 cart.revive()
-            for item in items:
-                if CartItem.objects.filter(cart=cart, products=item["products"]).exists():
-                    old_cart_item = CartItem.objects.filter(cart=cart, products=item["products"]).get()
-                    old_cart_item.update_quantity(item['quantity'])
+            elif not created:
+                cart.save(update_fields=["updated"])
+
+            old_items = {
+                item.products_id: item
+                for item in CartItem.objects.select_for_update().filter(cart=cart, products_id__in=product_ids)
+            }
+            quantities = {product_id: item.quantity for product_id, item in old_items.items()}
+            for operation in operations:
+                product_id, quantity = operation['products_id'], operation.get('quantity', 0)
+                if operation['op'] == 'set':
+                    quantities[product_id] = quantity
+                elif operation['op'] == 'increment':
+                    quantities[product_id] = quantities.get(product_id, 0) + quantity
                 else:
-                    cart_item = CartItem.objects.create(cart=cart, **item)
-                    cart_item.subtract_from_stock()
+                    quantities[product_id] = 0
+                if quantities[product_id] < 0:
+                    raise ValueError(f"quantity of product with id {product_id} can not go below zero!")
 
-            return cart
+            deltas = {}
+            new_items, changed_items, removed_ids = [], [], []
+            for product_id, quantity in quantities.items():
+                old_item = old_items.get(product_id)
+                old_quantity = old_item.quantity if old_item is not None else 0
+                if quantity == old_quantity:
+                    continue
+                deltas[product_id] = quantity - old_quantity
+                if old_item is None:
+                    new_items.append(CartItem(cart=cart, products_id=product_id, quantity=quantity))
+                elif quantity:
+                    old_item.quantity = quantity
+                    changed_items.append(old_item)
+                else:
+                    removed_ids.append(product_id)
+
+            apply_stock_deltas(deltas)
+            if new_items:
+                CartItem.objects.bulk_create(new_items)
+            if changed_items:
+                CartItem.objects.bulk_update(changed_items, ['quantity'])
+            if removed_ids:
+                CartItem.objects.filter(cart=cart, products_id__in=removed_ids).delete()
+            Cart.change_totals(cart.id, deltas)
+            transaction.on_commit(lambda: cart_cache.invalidate(cart.user_id))
+            transaction.on_commit(lambda: expiry.schedule_carts({cart.id: cart.updated}))
 
+        items = [item for item in old_items.values() if quantities[item.products_id]] + new_items
+        return cart, sorted(items, key=lambda item: item.products_id), removed_ids
 
     def update_quantity(self, new_quantity: int):
-        """ will update quantity of a CartItem and its Product stock_quantity """
-        diff = new_quantity - self.quantity
-        if self.products.stock_quantity < diff:
-            raise LowStockQuantityException(f"requested quantity of product: {self.products} is {new_quantity},"
-                                            f" while {self.products.stock_quantity} is available!")
-        with transaction.atomic():
-            self.products.stock_quantity = models.F('stock_quantity') - diff
+        """
+        will update quantity of a CartItem and its Product stock_quantity, touching its cart like every other
+        item write, so the rollup refresh, the expiry index and cart validators see the change
+        """
+        with hot_stock.journal(), transaction.atomic():
+            deltas = {self.products_id: new_quantity - self.quantity}
+            apply_stock_deltas(deltas)
             self.quantity = new_quantity
-            self.save()
-            self.products.save()
+            self.save(update_fields=["quantity"])
+            updated = timezone.now()
+            Cart.change_totals(self.cart_id, deltas, updated=updated)
+            transaction.on_commit(lambda: cart_cache.invalidate(self.cart.user_id))
+            transaction.on_commit(lambda: expiry.schedule_carts({self.cart_id: updated}))
 
     def subtract_from_stock(self):
         """ will subtract item quantity from product stock quantity """
-        self.products.stock_quantity = models.F("stock_quantity") - self.quantity
-        self.products.save(update_fields=["stock_quantity"])
+        reserve_stock(self.products_id, self.quantity)
 
     def add_from_stock(self):
         """ will add item quantity to product stock quantity """
-        self.products.stock_quantity = models.F("stock_quantity") + self.quantity
-        self.products.save(update_fields=["stock_quantity"])
+        release_stock(self.products_id, self.quantity)
 
 
 class ServerSetting(models.Model):
     """ contains dynamic settings for serverside appliance """
     name = models.CharField(_('unique name of setting'), unique=True, max_length=32)
     int_value = models.IntegerField(_('integer value of setting'))
+
+
+class CartDailyTotal(models.Model):
+    """
+    rollup of carts total amount per day and user, kept fresh by carts.tasks.refresh_cart_daily_totals.
+    a user has a single cart, so it has a single row, on the date its cart was last updated
+    """
+    date = models.DateField(_('day of cart last update'))
+    user = models.ForeignKey(to=get_user_model(), on_delete=models.CASCADE, related_name='cart_daily_totals')
+    updated = models.DateTimeField(_('cart last updated at'), db_index=True)
+    total_amount = models.PositiveBigIntegerField(_('sum of cart items price'))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'user'], name='unique_date_user')
+        ]
+        indexes = [
+            # one day report pages, biggest carts first
+            models.Index(fields=['date', '-total_amount', 'user'], name='dailytotal_date_amount_idx'),
+        ]
+
+    @staticmethod
+    def refresh_carts(cart_ids):
+        """ will recompute rollup rows of given carts, carts without any item get no row """
+        totals = Cart.objects.filter(pk__in=cart_ids, item_count__gt=0).values_list('user_id', 'updated',
+                                                                                     'total_amount')
+
+        with transaction.atomic():
+            old_rows = CartDailyTotal.objects.filter(
+                user_id__in=Cart.objects.filter(pk__in=cart_ids).values('user_id')
+            )
+            changed_dates = set(old_rows.values_list('date', flat=True))
+            old_rows.delete()
+            new_rows = CartDailyTotal.objects.bulk_create(
+                CartDailyTotal(date=timezone.localdate(updated), user_id=user_id, updated=updated,
+                               total_amount=total_amount)
+                for user_id, updated, total_amount in totals
+            )
+            changed_dates.update(row.date for row in new_rows)
+            transaction.on_commit(lambda: report_cache.invalidate_dates(changed_dates))
+
+
+class CartExpiry(models.Model):
+    """ database backed entry of cart expiry index, see carts.expiry """
+    cart = models.OneToOneField(to=Cart, on_delete=models.CASCADE, primary_key=True, related_name='expiry')
+    expires_at = models.DateTimeField(_('cart expires at'), db_index=True)
+
+
+class TaskLease(models.Model):
+    """ database backed lease of a periodic task, see carts.locks """
+    name = models.CharField(_('unique name of lease'), unique=True, max_length=64)
+    owner = models.CharField(_('token of current owner'), max_length=32)
+    expires_at = models.DateTimeField(_('lease expires at'))
+
+
+class HotStockEntry(models.Model):
+    """ journal row of a committed change of hot product stock, see carts.hot_stock """
+    token = models.CharField(_('token of the change'), unique=True, max_length=32)
+    product = models.ForeignKey(to='products.Product', on_delete=models.CASCADE, related_name='hot_stock_entries')
+    quantity = models.IntegerField(_('change of stock, negative for a take'))
+
+
+class PendingReservation(models.Model):
+    """ stock taken by carts.coalescer for a request that has not saved it yet """
+    token = models.CharField(_('token of the reservation'), unique=True, max_length=32)
+    product = models.ForeignKey(to='products.Product', on_delete=models.CASCADE, related_name='pending_reservations')
+    quantity = models.PositiveIntegerField(_('reserved quantity'))
+    created_at = models.DateTimeField(_('reserved at'), auto_now_add=True, db_index=True)
@@ -0,0 +1,78 @@
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+
+
+class ReportCursorPagination(CursorPagination):
+    """
+    cursor pagination of one day cart report, biggest carts first.
+    many carts share a total amount, so a cursor position holds the values of all ordering fields (integers
+    joined by ':') and pages are cut with a keyset filter over all of them, not over the first field only.
+    positions are unique, so pages never skip or repeat rows and cursors never need an offset
+    """
+    ordering = ('-total_amount', 'user_id')
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def _get_position_from_instance(self, instance, ordering):
+        fields = [order.lstrip('-') for order in ordering]
+        values = [instance[field] if isinstance(instance, dict) else getattr(instance, field) for field in fields]
+        return ':'.join(str(value) for value in values)
+
+    def decode_position(self, position: str) -> list:
+        try:
+            values = [int(value) for value in position.split(':')]
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+        if len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def after_position(self, position: str, reverse: bool) -> Q:
+        """ will return filter of rows coming after position, in the direction the cursor goes """
+        after, equal = Q(), Q()
+        for order, value in zip(self.ordering, self.decode_position(position)):
+            field = order.lstrip('-')
+            lookup = 'lt' if order.startswith('-') != reverse else 'gt'
+            after |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return after
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            reverse, current_position = False, None
+        else:
+            _, reverse, current_position = self.cursor
+
+        queryset = queryset.order_by(*(_reverse_ordering(self.ordering) if reverse else self.ordering))
+        if current_position is not None:
+            queryset = queryset.filter(self.after_position(current_position, reverse))
+
+        # one extra row tells if there is a page following this one
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        following_position = None
+        if len(results) > len(self.page):
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+
+        if reverse:
+            self.page = list(reversed(self.page))
+            self.has_next, self.next_position = current_position is not None, current_position
+            self.has_previous, self.previous_position = following_position is not None, following_position
+        else:
+            self.has_next, self.next_position = following_position is not None, following_position
+            self.has_previous, self.previous_position = current_position is not None, current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
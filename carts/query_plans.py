@@ -0,0 +1,106 @@
+"""
+hot queries of carts.models and carts.tasks, and a check that none of them falls back to a full table scan.
+used by check_query_plans management command, run it after touching those queries or the indexes behind them.
+"""
+import random
+import re
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Sum
+from django.utils import timezone
+
+from carts.models import Cart, CartDailyTotal, CartExpiry, CartItem, TaskLease
+from carts.tasks import REFRESH_WATERMARK
+from products.models import Product
+
+TABLE_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (\w+)$', re.MULTILINE),
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+}
+# walking a whole index in order, fine only when the query stops after a few rows
+INDEX_WALK_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (\w+) USING (?:COVERING )?INDEX \w+$', re.MULTILINE),
+}
+
+
+def seed(carts_count: int = 2000, products_count: int = 200, items_per_cart: int = 5, random_seed: int = 0):
+    """ will fill database with a deterministic dataset big enough for the planner to prefer indexes """
+    generator = random.Random(random_seed)
+    now = timezone.now()
+    products = Product.objects.bulk_create(
+        Product(name=f'plan_product_{i}', price=generator.randint(1, 1000), stock_quantity=1000)
+        for i in range(products_count)
+    )
+    users = get_user_model().objects.bulk_create(
+        get_user_model()(username=f'plan_user_{i}') for i in range(carts_count)
+    )
+    carts = Cart.objects.bulk_create(
+        Cart(user=user, is_dead=generator.random() < 0.8) for user in users
+    )
+    for cart in carts:
+        Cart.objects.filter(pk=cart.pk).update(updated=now - timezone.timedelta(minutes=generator.randint(0, 60 * 24 * 30)))
+    CartItem.objects.bulk_create(
+        CartItem(cart=cart, products=product, quantity=generator.randint(1, 5))
+        for cart in carts
+        for product in generator.sample(products, items_per_cart)
+    )
+    Cart.refresh_totals(Cart.objects.all())
+    CartExpiry.objects.bulk_create(
+        CartExpiry(cart=cart, expires_at=now + timezone.timedelta(minutes=generator.randint(-60, 60)))
+        for cart in carts if not cart.is_dead
+    )
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def get_hot_queries() -> dict:
+    """ will return hot queries by name, with parameters typical for them """
+    now = timezone.now()
+    some_cart_ids = list(Cart.objects.order_by('?').values_list('pk', flat=True)[:20])
+    some_product_ids = list(Product.objects.order_by('?').values_list('pk', flat=True)[:20])
+    return {
+        'kill_old_carts claim chunk': Cart.objects.filter(
+            is_dead=False, updated__lt=now - timezone.timedelta(days=20)
+        ).order_by('updated').values_list('pk', flat=True)[:500],
+        'kill_many returned quantities': CartItem.objects.filter(cart_id__in=some_cart_ids).values(
+            'products_id'
+        ).annotate(total_quantity=Sum('quantity')).order_by('products_id'),
+        'cart upsert existing items': CartItem.objects.filter(
+            cart_id=some_cart_ids[0], products_id__in=some_product_ids
+        ),
+        'stock lock products': Product.objects.filter(pk__in=some_product_ids).order_by('pk').values_list(
+            'pk', flat=True
+        ),
+        'refresh totals watermark': TaskLease.objects.filter(name=REFRESH_WATERMARK).values_list('expires_at', flat=True),
+        'refresh totals carts since watermark': Cart.objects.filter(
+            updated__gte=now - timezone.timedelta(minutes=5)
+        ).values_list('pk', flat=True),
+        'report date range': Cart.report_rows(now - timezone.timedelta(days=1)).order_by('-total_amount'),
+        'report one day page': CartDailyTotal.objects.filter(date=now.date()).order_by(
+            '-total_amount', 'user_id'
+        ).select_related('user')[:100],
+        'live report date range': CartItem.objects.filter(
+            cart__updated__gte=now - timezone.timedelta(days=1)
+        ).values('cart_id').annotate(total_amount=Sum('quantity')),
+        'expiry due carts': CartExpiry.objects.filter(expires_at__lte=now).order_by('expires_at').values_list(
+            'cart_id', flat=True
+        )[:500],
+    }
+
+
+def find_full_scans(plan: str, limited: bool = False) -> list:
+    """ will return names of tables given query plan fully scans, limited tells if the query has a LIMIT """
+    patterns = [TABLE_SCAN_PATTERNS.get(connection.vendor)]
+    if not limited:
+        patterns.append(INDEX_WALK_PATTERNS.get(connection.vendor))
+    return [table for pattern in patterns if pattern is not None for table in pattern.findall(plan)]
+
+
+def check_query_plans() -> dict:
+    """ will explain every hot query and return (plan, fully scanned tables) of each one by name """
+    results = {}
+    for name, queryset in get_hot_queries().items():
+        plan = queryset.explain()
+        results[name] = (plan, find_full_scans(plan, limited=queryset.query.high_mark is not None))
+    return results
@@ -0,0 +1,218 @@
+"""
+cache in front of the all users cart report, keyed by normalized date range.
+entries are fresh for CART_REPORT_CACHE_FRESH_TTL seconds, after that (or after carts of a covered day change)
+they are stale: a single worker recomputes them, while the others keep serving the stale value until
+CART_REPORT_CACHE_STALE_TTL runs out. a cold miss is computed by a single worker as well, the others wait up to
+CART_REPORT_CACHE_MISS_WAIT seconds for its result. the registry of cached ranges is only updated under a lock,
+so concurrent stores do not drop each other's ranges.
+"""
+import asyncio
+import contextlib
+import datetime
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+KEY_PREFIX = 'cart_report'
+RANGES_KEY = f'{KEY_PREFIX}:ranges'
+RANGES_LOCK_KEY = f'{RANGES_KEY}:lock'
+# seconds a worker may hold the ranges registry lock, in case it dies holding it
+RANGES_LOCK_TTL = 5
+STATS = ('hit', 'miss', 'stale')
+# seconds between two looks at a lock held by another worker
+POLL_INTERVAL = 0.05
+
+
+def get_cache():
+    return caches[settings.CART_REPORT_CACHE_ALIAS]
+
+
+def normalize_date(value):
+    """
+    will turn a report date parameter into an aware datetime, the same way the orm reads it,
+    so equal ranges get equal keys. raises ValueError on garbage
+    """
+    if value is None:
+        return None
+    parsed = parse_datetime(value) or parse_date(value)
+    if parsed is None:
+        raise ValueError(f'{value} is not a valid date')
+    if not isinstance(parsed, datetime.datetime):
+        parsed = datetime.datetime.combine(parsed, datetime.time())
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def as_date(value):
+    return timezone.localdate(value) if value is not None else None
+
+
+def make_key(start_date, end_date) -> str:
+    return f"{KEY_PREFIX}:{start_date.isoformat() if start_date else ''}:{end_date.isoformat() if end_date else ''}"
+
+
+def count(stat: str):
+    cache = get_cache()
+    key = f'{KEY_PREFIX}:stats:{stat}'
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, timeout=None)
+
+
+def stats() -> dict:
+    """ will return hit, miss and stale counters of the report cache """
+    values = get_cache().get_many([f'{KEY_PREFIX}:stats:{stat}' for stat in STATS])
+    return {stat: values.get(f'{KEY_PREFIX}:stats:{stat}', 0) for stat in STATS}
+
+
+def make_entry(result) -> dict:
+    return {'result': result, 'fresh_until': time.time() + settings.CART_REPORT_CACHE_FRESH_TTL}
+
+
+def add_range(ranges, key: str, start_date, end_date) -> dict:
+    """ will return ranges registry without its expired ranges and with the given one """
+    now = time.time()
+    ranges = {range_key: covered for range_key, covered in (ranges or {}).items() if covered[2] > now}
+    ranges[key] = (as_date(start_date), as_date(end_date), now + settings.CART_REPORT_CACHE_STALE_TTL)
+    return ranges
+
+
+@contextlib.contextmanager
+def ranges_lock():
+    """ will hold the ranges registry lock, a holder that died lets it go after RANGES_LOCK_TTL seconds """
+    cache = get_cache()
+    while not cache.add(RANGES_LOCK_KEY, 1, timeout=RANGES_LOCK_TTL):
+        time.sleep(POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        cache.delete(RANGES_LOCK_KEY)
+
+
+def store(key: str, start_date, end_date, result):
+    cache = get_cache()
+    cache.set(key, make_entry(result),
+              timeout=settings.CART_REPORT_CACHE_FRESH_TTL + settings.CART_REPORT_CACHE_STALE_TTL)
+    with ranges_lock():
+        cache.set(RANGES_KEY, add_range(cache.get(RANGES_KEY), key, start_date, end_date), timeout=None)
+
+
+def get_or_compute(start_date, end_date, compute):
+    """
+    will return (report, cache status) of given range, compute(start_date, end_date) is called only by the one
+    worker that won the right to fill a missing entry or to refresh a stale one
+    """
+    cache = get_cache()
+    key = make_key(start_date, end_date)
+    lock_key = f'{key}:refreshing'
+    deadline = time.monotonic() + settings.CART_REPORT_CACHE_MISS_WAIT
+    while True:
+        entry = cache.get(key)
+        if entry is not None and time.time() < entry['fresh_until']:
+            count('hit')
+            return entry['result'], 'hit'
+        locked = cache.add(lock_key, 1, timeout=settings.CART_REPORT_CACHE_LOCK_TTL)
+        if locked:
+            break
+        if entry is not None:
+            count('stale')
+            return entry['result'], 'stale'
+        if time.monotonic() >= deadline:
+            # the worker filling it takes too long, do not keep the request waiting any longer
+            break
+        time.sleep(POLL_INTERVAL)
+
+    count('miss')
+    try:
+        result = compute(start_date, end_date)
+        store(key, start_date, end_date, result)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return result, 'miss'
+
+
+async def acount(stat: str):
+    """ async twin of count """
+    cache = get_cache()
+    key = f'{KEY_PREFIX}:stats:{stat}'
+    await cache.aadd(key, 0, timeout=None)
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        await cache.aset(key, 1, timeout=None)
+
+
+@contextlib.asynccontextmanager
+async def aranges_lock():
+    """ async twin of ranges_lock """
+    cache = get_cache()
+    while not await cache.aadd(RANGES_LOCK_KEY, 1, timeout=RANGES_LOCK_TTL):
+        await asyncio.sleep(POLL_INTERVAL)
+    try:
+        yield
+    finally:
+        await cache.adelete(RANGES_LOCK_KEY)
+
+
+async def astore(key: str, start_date, end_date, result):
+    """ async twin of store """
+    cache = get_cache()
+    await cache.aset(key, make_entry(result),
+                     timeout=settings.CART_REPORT_CACHE_FRESH_TTL + settings.CART_REPORT_CACHE_STALE_TTL)
+    async with aranges_lock():
+        await cache.aset(RANGES_KEY, add_range(await cache.aget(RANGES_KEY), key, start_date, end_date),
+                         timeout=None)
+
+
+async def aget_or_compute(start_date, end_date, acompute):
+    """ async twin of get_or_compute, acompute(start_date, end_date) being a coroutine function """
+    cache = get_cache()
+    key = make_key(start_date, end_date)
+    lock_key = f'{key}:refreshing'
+    deadline = time.monotonic() + settings.CART_REPORT_CACHE_MISS_WAIT
+    while True:
+        entry = await cache.aget(key)
+        if entry is not None and time.time() < entry['fresh_until']:
+            await acount('hit')
+            return entry['result'], 'hit'
+        locked = await cache.aadd(lock_key, 1, timeout=settings.CART_REPORT_CACHE_LOCK_TTL)
+        if locked:
+            break
+        if entry is not None:
+            await acount('stale')
+            return entry['result'], 'stale'
+        if time.monotonic() >= deadline:
+            break
+        await asyncio.sleep(POLL_INTERVAL)
+
+    await acount('miss')
+    try:
+        result = await acompute(start_date, end_date)
+        await astore(key, start_date, end_date, result)
+    finally:
+        if locked:
+            await cache.adelete(lock_key)
+    return result, 'miss'
+
+
+def invalidate_dates(dates):
+    """ will mark every cached report covering any of given dates as stale """
+    dates = set(dates)
+    if not dates:
+        return
+    cache = get_cache()
+    for key, (start_date, end_date, _) in (cache.get(RANGES_KEY) or {}).items():
+        if not any((start_date is None or start_date <= date) and (end_date is None or date <= end_date)
+                   for date in dates):
+            continue
+        entry = cache.get(key)
+        if entry is not None:
+            entry['fresh_until'] = 0
+            cache.set(key, entry, timeout=settings.CART_REPORT_CACHE_STALE_TTL)
@@ -0,0 +1,105 @@
+"""
+stock reservation layer for carts.
+every decrement is a single conditional UPDATE (``... WHERE stock_quantity >= n``) so stock can never be
+oversold, and multi product reservations lock their rows in primary key order so they can not deadlock.
+products flagged hot are reserved from sharded counters instead of their rows, see carts.hot_stock.
+"""
+from django.db import models, transaction
+from django.db.models import Q, F, Case, When
+
+from carts import coalescer, hot_stock
+from carts.exceptions import LowStockQuantityException
+from products import catalog
+from products.models import Product
+
+
+def lock_products(product_ids):
+    """ will lock given products rows (where supported) in a deterministic primary key order """
+    return list(
+        Product.objects.select_for_update().filter(pk__in=product_ids).order_by('pk').values_list('pk', flat=True)
+    )
+
+
+def reserve_stock(product_id: int, quantity: int):
+    """ will subtract quantity from product stock quantity, only if enough of it is available """
+    if product_id in hot_stock.snapshot.get_product_ids():
+        return apply_stock_deltas({product_id: quantity})
+    reserved = Product.objects.filter(pk=product_id, stock_quantity__gte=quantity, is_hot=False).update(
+        stock_quantity=F('stock_quantity') - quantity
+    )
+    if not reserved:
+        # short on stock, or the product just turned hot
+        return apply_stock_deltas({product_id: quantity})
+    transaction.on_commit(lambda: catalog.invalidate_stocks([product_id]))
+
+
+def release_stock(product_id: int, quantity: int):
+    """ will give quantity back to product stock quantity """
+    if product_id in hot_stock.snapshot.get_product_ids():
+        return apply_stock_deltas({product_id: -quantity})
+    if not Product.objects.filter(pk=product_id, is_hot=False).update(stock_quantity=F('stock_quantity') + quantity):
+        return apply_stock_deltas({product_id: -quantity})
+    transaction.on_commit(lambda: catalog.invalidate_stocks([product_id]))
+
+
+def apply_stock_deltas(deltas: dict):
+    """
+    will subtract each delta (product id -> quantity) from its product stock quantity in a single
+    conditional UPDATE, negative deltas give quantity back to stock. deltas of hot products go to their counters,
+    with STOCK_COALESCE_WINDOW set reservations are batched with concurrent ones, see carts.coalescer
+    """
+    if not deltas:
+        return
+    hot_deltas, deltas = hot_stock.split(deltas)
+    with hot_stock.journal(), transaction.atomic():
+        if deltas and coalescer.enabled():
+            deltas = coalescer.reserve(deltas)
+        if deltas:
+            hot_deltas.update(apply_database_deltas(deltas))
+        if hot_deltas:
+            cold_deltas = hot_stock.apply(hot_deltas)
+            if cold_deltas and apply_database_deltas(cold_deltas):
+                raise LowStockQuantityException(f"stock of products {sorted(cold_deltas)} is being moved,"
+                                                f" try again!")
+
+
+def apply_database_deltas(deltas: dict) -> dict:
+    """
+    will apply deltas to products rows, see apply_stock_deltas. products found hot (the snapshot of hot
+    products was stale) are skipped and their deltas returned
+    """
+    lock_products(deltas)
+    updated_count = Product.objects.filter(
+        Q(*(Q(pk=product_id, stock_quantity__gte=max(delta, 0)) for product_id, delta in deltas.items()),
+          _connector=Q.OR),
+        is_hot=False,
+    ).update(
+        stock_quantity=Case(
+            *(When(pk=product_id, then=F('stock_quantity') - delta) for product_id, delta in deltas.items()),
+            default=F('stock_quantity'),
+            output_field=models.PositiveIntegerField(),
+        )
+    )
+    hot_deltas = {}
+    if updated_count != len(deltas):
+        hot_ids = set(Product.objects.filter(pk__in=deltas, is_hot=True).values_list('pk', flat=True))
+        if updated_count != len(deltas) - len(hot_ids):
+            raise_stock_shortage({product_id: delta for product_id, delta in deltas.items()
+                                  if product_id not in hot_ids})
+        hot_stock.snapshot.invalidate()
+        hot_deltas = {product_id: deltas[product_id] for product_id in hot_ids}
+    transaction.on_commit(lambda: catalog.invalidate_stocks(list(deltas)))
+    return hot_deltas
+
+
+def raise_stock_shortage(deltas: dict):
+    """ will find out which product failed a reservation and raise a proper exception naming it """
+    products = Product.objects.in_bulk(list(deltas))
+    for product_id, delta in deltas.items():
+        product = products.get(product_id)
+        if product is None:
+            raise Product.DoesNotExist(f"product with id {product_id} does not exist!")
+        if product.stock_quantity < delta:
+            raise LowStockQuantityException(f"requested extra quantity of product: {product} is {delta},"
+                                            f" while {product.stock_quantity} is available!")
+    raise LowStockQuantityException(f"could not reserve stock for products: {sorted(deltas)}")
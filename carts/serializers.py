@@ -1,13 +1,19 @@
+from contextlib import contextmanager
+
 from django.db import transaction, IntegrityError
 from django.utils import timezone
 from rest_framework import serializers
 
 from carts.exceptions import LowStockQuantityException
-from carts.models import Cart, CartItem
+from carts.models import Cart, CartDailyTotal, CartItem
+from products.models import Product
 
 
 class CartItemSerializer(serializers.ModelSerializer):
     """ serializer for CartItem model """
+    # plain id instead of a related field, so validating a big cart does not fetch products one by one
+    products = serializers.IntegerField(source='products_id', min_value=1)
+
     class Meta:
         model = CartItem
         fields = ['id', 'products', 'quantity']
@@ -24,16 +30,63 @@ class CartSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         items = validated_data.pop('items_cart')
-        try:
+        with stock_errors():
             return CartItem.create_cart_items_and_subtract_from_stock(user=validated_data['user'], items=items)
-        except LowStockQuantityException as lsq:
-            raise serializers.ValidationError({"error": str(lsq)}, code="product_low_on_stock")
-        except IntegrityError as ie:
-            raise serializers.ValidationError({"error": "not enough stock on product"}, code='not_enough_stock')
 
 
+@contextmanager
+def stock_errors():
+    """ will turn stock reservation failures into validation errors """
+    try:
+        yield
+    except Product.DoesNotExist as dne:
+        raise serializers.ValidationError({"error": str(dne)}, code="product_not_found")
+    except LowStockQuantityException as lsq:
+        raise serializers.ValidationError({"error": str(lsq)}, code="product_low_on_stock")
+    except IntegrityError as ie:
+        raise serializers.ValidationError({"error": "not enough stock on product"}, code='not_enough_stock')
+
 
+class CartLineOperationSerializer(serializers.Serializer):
+    """ one change of a cart line: set its quantity, increment it (negative decrements) or remove it """
+    op = serializers.ChoiceField(choices=['set', 'increment', 'remove'])
+    products = serializers.IntegerField(source='products_id', min_value=1)
+    quantity = serializers.IntegerField(required=False)
 
+    def validate(self, attrs):
+        if attrs['op'] != 'remove' and 'quantity' not in attrs:
+            raise serializers.ValidationError({'quantity': f"is required by {attrs['op']}"})
+        if attrs['op'] == 'set' and attrs['quantity'] < 0:
+            raise serializers.ValidationError({'quantity': 'can not be negative'})
+        return attrs
 
 
+class CartLinesSerializer(serializers.Serializer):
+    """ a batch of line operations applied to the user's cart at once, answering with the touched lines only """
+    operations = CartLineOperationSerializer(many=True, allow_empty=False, max_length=100)
+
+    def create(self, validated_data):
+        with stock_errors():
+            try:
+                return CartItem.apply_line_operations(user=validated_data['user'],
+                                                      operations=validated_data['operations'])
+            except ValueError as ve:
+                raise serializers.ValidationError({"error": str(ve)}, code="negative_quantity")
 
+    def to_representation(self, instance):
+        cart, items, removed_ids = instance
+        return {
+            'id': cart.id,
+            'updated': serializers.DateTimeField().to_representation(cart.updated),
+            'items_cart': CartItemSerializer(items, many=True).data,
+            'removed': removed_ids,
+        }
+
+
+class CartDailyTotalSerializer(serializers.ModelSerializer):
+    """ serializer for CartDailyTotal model, in the same shape as report entries """
+    username = serializers.CharField(source='user.username')
+
+    class Meta:
+        model = CartDailyTotal
+        fields = ['username', 'total_amount']
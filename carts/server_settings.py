@@ -0,0 +1,121 @@
+"""
+typed and cached access to carts.models.ServerSetting values.
+every setting must be declared with its default, values are kept in a process local snapshot for
+SERVER_SETTINGS_CACHE_TTL seconds, after that a version key in the shared cache tells if the snapshot is
+still fresh, so reads almost never touch the database. saving or deleting a ServerSetting bumps the version once
+its transaction commits, a bump before that would let another process cache the old value under the new version.
+"""
+import threading
+import time
+from dataclasses import dataclass
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from carts.models import ServerSetting
+
+VERSION_CACHE_KEY = 'server_settings:version'
+
+
+@dataclass(frozen=True)
+class SettingDefinition:
+    """ declaration of a server setting """
+    name: str
+    default: int | bool
+    value_type: type = int
+    description: str = ''
+
+
+REGISTRY: dict[str, SettingDefinition] = {}
+
+
+def register(name: str, default, value_type: type = int, description: str = ''):
+    """ will declare a server setting, so it can be read by get() """
+    REGISTRY[name] = SettingDefinition(name=name, default=default, value_type=value_type, description=description)
+
+
+register('cart_life_span', 30, description='minutes a cart may stay untouched before it gets killed')
+register('request_metrics', True, value_type=bool, description='record request and task metrics, 0 turns it off')
+
+
+class SettingsSnapshot:
+    """ process local copy of all ServerSetting values """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = None
+        self.version = None
+        self.fresh_until = 0.0
+
+    def get_values(self) -> dict:
+        if self.values is not None and time.monotonic() < self.fresh_until:
+            return self.values
+        with self.lock:
+            if self.values is not None and time.monotonic() < self.fresh_until:
+                return self.values
+            version = cache.get(VERSION_CACHE_KEY, 0)
+            if self.values is None or version != self.version:
+                self.values = dict(ServerSetting.objects.values_list('name', 'int_value'))
+                self.version = version
+            self.fresh_until = time.monotonic() + settings.SERVER_SETTINGS_CACHE_TTL
+            return self.values
+
+    async def aget_values(self) -> dict:
+        """ async twin of get_values, only a reload leaves the event loop """
+        if self.values is not None and time.monotonic() < self.fresh_until:
+            return self.values
+        return await sync_to_async(self.get_values)()
+
+    def invalidate(self):
+        with self.lock:
+            self.values = None
+
+
+snapshot = SettingsSnapshot()
+
+
+def get(name: str):
+    """ will return value of a declared setting, converted to its declared type """
+    definition = REGISTRY[name]
+    value = snapshot.get_values().get(name)
+    if value is None:
+        return definition.default
+    return definition.value_type(value)
+
+
+async def aget(name: str):
+    """ async twin of get """
+    definition = REGISTRY[name]
+    value = (await snapshot.aget_values()).get(name)
+    if value is None:
+        return definition.default
+    return definition.value_type(value)
+
+
+def get_int(name: str) -> int:
+    return int(get(name))
+
+
+def get_bool(name: str) -> bool:
+    return bool(get(name))
+
+
+async def aget_bool(name: str) -> bool:
+    return bool(await aget(name))
+
+
+@receiver([post_save, post_delete], sender=ServerSetting)
+def invalidate_server_settings(**kwargs):
+    """ will drop local snapshot and bump shared version once committed, so other processes reload too """
+    transaction.on_commit(bump_version)
+
+
+def bump_version():
+    snapshot.invalidate()
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(VERSION_CACHE_KEY, 1, timeout=None)
@@ -1,20 +1,120 @@
+import logging
+import time
+
 from celery import shared_task
+from django.conf import settings
 from django.utils import timezone
 
-from carts.models import Cart, ServerSetting
+from carts import coalescer, expiry, hot_stock, server_settings
+from carts.expiry import get_expiry_index
+from carts.locks import get_lease
+from carts.models import Cart, CartDailyTotal, TaskLease
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def kill_old_carts(chunk_size: int = None, time_budget: float = None, worker: int = 0):
+    """
+    will kill all carts that are too old, chunk by chunk, until none is left or time budget (in seconds)
+    is spent. each worker slot holds a lease while running, so an overlapping run of the same slot is skipped.
+    returns number of killed carts, or None if the run was skipped
+    """
+    chunk_size = chunk_size or settings.CART_SWEEP_CHUNK_SIZE
+    time_budget = time_budget or settings.CART_SWEEP_TIME_BUDGET
+
+    with get_lease(f'kill_old_carts:{worker}', ttl=time_budget + settings.CART_SWEEP_LEASE_MARGIN) as lease:
+        if not lease.acquired:
+            return None
+
+        life_span = server_settings.get_int('cart_life_span')  # in minutes
+        expired_before = timezone.now() - timezone.timedelta(minutes=life_span)
+        deadline = time.monotonic() + time_budget
+        killed_count = 0
+        while time.monotonic() < deadline:
+            try:
+                chunk_killed_count = Cart.kill_expired_chunk(expired_before, chunk_size)
+            except Exception:
+                # the next run picks up what is left, the error still has to reach the admins
+                logger.exception('could not kill a chunk of expired carts, %s killed so far', killed_count)
+                break
+            if not chunk_killed_count:
+                break
+            killed_count += chunk_killed_count
+        return killed_count
+
+
+# TaskLease row keeping the start time of the last refresh_cart_daily_totals run
+REFRESH_WATERMARK = 'watermark:refresh_cart_daily_totals'
+
+
+@shared_task
+def refresh_cart_daily_totals() -> int:
+    """
+    will bring CartDailyTotal rollup up to date, only carts updated since the last run started (minus a safety
+    margin for late commits) are recomputed, the first run ever recomputes all of them.
+    returns number of recomputed carts
+    """
+    started_at = timezone.now()
+    watermark = TaskLease.objects.filter(name=REFRESH_WATERMARK).values_list('expires_at', flat=True).first()
+    carts = Cart.objects.all()
+    if watermark is not None:
+        carts = carts.filter(
+            updated__gte=watermark - timezone.timedelta(seconds=settings.CART_TOTALS_REFRESH_MARGIN)
+        )
+    refreshed_count = refresh_carts_in_chunks(carts)
+    if not TaskLease.objects.filter(name=REFRESH_WATERMARK).update(expires_at=started_at):
+        TaskLease.objects.create(name=REFRESH_WATERMARK, owner='', expires_at=started_at)
+    return refreshed_count
+
+
+def refresh_carts_in_chunks(carts) -> int:
+    """ will recompute rollup rows of given carts queryset, chunk by chunk """
+    chunk_size = settings.CART_TOTALS_REFRESH_CHUNK_SIZE
+    cart_ids = list(carts.values_list('pk', flat=True))
+    for index in range(0, len(cart_ids), chunk_size):
+        CartDailyTotal.refresh_carts(cart_ids[index:index + chunk_size])
+    return len(cart_ids)
+
+
+@shared_task
+def kill_due_carts(batch_size: int = None) -> int:
+    """
+    will kill carts that are due in expiry index, so stock comes back seconds after a cart expires.
+    carts whose life span grew since they were scheduled are scheduled again. returns number of killed carts
+    """
+    batch_size = batch_size or settings.CART_EXPIRY_BATCH_SIZE
+    index = get_expiry_index()
+    killed_count = 0
+    while True:
+        now = timezone.now()
+        due_ids = index.pop_due(now, batch_size)
+        if not due_ids:
+            break
+        expired_before = now - expiry.get_life_span()
+        last_updates = dict(Cart.objects.filter(pk__in=due_ids, is_dead=False).values_list('pk', 'updated'))
+        expired_ids = [cart_id for cart_id, updated in last_updates.items() if updated < expired_before]
+        expiry.schedule_carts({cart_id: updated for cart_id, updated in last_updates.items()
+                               if updated >= expired_before})
+        # a cart may be touched after it was read, so its age is checked again under its row lock
+        killed_count += Cart.kill_many(expired_ids, updated_before=expired_before)
+        if len(due_ids) < batch_size:
+            break
+    return killed_count
+
+
+@shared_task
+def reconcile_hot_stock() -> int:
+    """ will settle and fold journaled changes of hot products into their stock quantity, returns number of products """
+    return hot_stock.reconcile()
+
 
 @shared_task
-def kill_old_carts():
-    """ will kill all carts that are too old by running kill() on them """
-    try:
-        life_span: int = ServerSetting.objects.get(name='cart_life_span')
-    except ServerSetting.DoesNotExist:
-        life_span: int = 30  # in minutes
-
-    old_carts = Cart.objects.filter(is_dead=False, updated__lt=timezone.now()-timezone.timedelta(minutes=life_span))
-    for cart in old_carts:
-        try:
-            cart.kill()
-        except Exception as e:
-            # Do some logging or admin informing
-            pass
+def release_stale_reservations(batch_size: int = 500) -> int:
+    """ will give back coalesced reservations their requests never saved, returns number of released ones """
+    released_count = 0
+    while released := coalescer.release_stale(batch_size):
+        released_count += released
+        if released < batch_size:
+            break
+    return released_count
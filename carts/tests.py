@@ -1,11 +1,42 @@
-from django.test import TestCase
+import io
+import json
+import threading
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
 
-from carts.models import Cart, CartItem
+from carts import cart_cache, coalescer, expiry, hot_stock, report_cache, server_settings
+from carts.fast_serializers import serialize_carts
+from carts.locks import DatabaseLease, get_lease
+from carts.models import (Cart, CartDailyTotal, CartExpiry, CartItem, PendingReservation, ServerSetting,
+                          TaskLease)
 from products.models import Product
 from django.contrib.auth import get_user_model
 from carts.exceptions import LowStockQuantityException
+from carts.query_plans import check_query_plans, find_full_scans, seed
+from carts.reservations import apply_stock_deltas, reserve_stock
 from carts.serializers import CartSerializer
+from carts.tasks import (kill_due_carts, kill_old_carts, reconcile_hot_stock, refresh_cart_daily_totals,
+                         release_stale_reservations)
+from products.bulk import upsert_chunk
+
+try:
+    import fakeredis
+    import lupa  # noqa: F401, fakeredis runs lua scripts with it
+except ImportError:
+    fakeredis = None
 
 UserModel = get_user_model()
 
@@ -17,6 +48,7 @@ class CartTest(TestCase):
         return {"Authorization": f"Bearer {access}"}
 
     def setUp(self):
+        cache.clear()
         self.user_1_login_data = {
             'username': 'user_1',
             'password': 'pass',
@@ -174,4 +206,1218 @@ class CartTest(TestCase):
 
         response = self.client.get(self.add_cart_item_url, content_type='application/json', headers=headers)
         assert response.status_code == 200
-        self.assertEqual(response.json(), expect_response)
\ No newline at end of file
+        self.assertEqual(response.json(), expect_response)
+
+    def test_add_cart_items_query_count_is_constant(self):
+        headers = self.get_auth_header(**self.user_1_login_data)
+        products = [Product.objects.create(name=f'product_{i}', stock_quantity=10, price=10) for i in range(40)]
+
+        def post_items(user, products_to_post, quantity=2):
+            items = [{'products_id': product.id, 'quantity': quantity} for product in products_to_post]
+            with CaptureQueriesContext(connection) as ctx:
+                CartItem.create_cart_items_and_subtract_from_stock(user=user, items=items)
+            return len(ctx.captured_queries)
+
+        single_item_queries = post_items(self.user_1, products[:1])
+        many_items_queries = post_items(self.user_2, products)
+        self.assertEqual(single_item_queries, many_items_queries)
+
+        # updating existing lines costs the same too
+        self.assertEqual(post_items(self.user_1, products[:1], 3), post_items(self.user_2, products, 3))
+
+        response = self.client.post(self.add_cart_item_url, content_type='application/json', headers=headers,
+                                    data={"items_cart": [{"products": 999, "quantity": 1}]})
+        assert response.status_code == 400
+
+        for product in products[1:]:
+            product.refresh_from_db()
+            assert product.stock_quantity == 10 - 3
+        products[0].refresh_from_db()
+        assert products[0].stock_quantity == 10 - 3 - 3
+
+    def test_patch_cart_lines(self):
+        headers = self.get_auth_header(**self.user_1_login_data)
+        products = [Product.objects.create(name=f'line_{i}', stock_quantity=10, price=10) for i in range(3)]
+        CartItem.create_cart_items_and_subtract_from_stock(user=self.user_1, items=[
+            {'products_id': products[0].id, 'quantity': 2}, {'products_id': products[1].id, 'quantity': 5},
+        ])
+        lines_url = f'{self.add_cart_item_url}lines/'
+
+        response = self.client.patch(lines_url, content_type='application/json', headers=headers, data={
+            'operations': [
+                {'op': 'increment', 'products': products[0].id, 'quantity': 3},
+                {'op': 'remove', 'products': products[1].id},
+                {'op': 'set', 'products': products[2].id, 'quantity': 4},
+                {'op': 'increment', 'products': products[2].id, 'quantity': -1},
+            ]
+        })
+        assert response.status_code == 200
+        data = response.json()
+        assert [(item['products'], item['quantity']) for item in data['items_cart']] == [
+            (products[0].id, 5), (products[2].id, 3),
+        ]
+        assert data['removed'] == [products[1].id]
+        assert dict(CartItem.objects.filter(cart__user=self.user_1).values_list('products_id', 'quantity')) == {
+            products[0].id: 5, products[2].id: 3,
+        }
+        assert [Product.objects.get(pk=product.pk).stock_quantity for product in products] == [5, 10, 7]
+
+        for operations in (
+            [{'op': 'increment', 'products': products[0].id, 'quantity': -6}],
+            [{'op': 'set', 'products': products[0].id, 'quantity': 11}],
+            [{'op': 'set', 'products': 999, 'quantity': 1}],
+            [{'op': 'set', 'products': products[0].id}],
+            [],
+        ):
+            response = self.client.patch(lines_url, content_type='application/json', headers=headers,
+                                         data={'operations': operations})
+            assert response.status_code == 400, operations
+        assert Product.objects.get(pk=products[0].pk).stock_quantity == 5
+
+    def test_fast_serializer_matches_cart_serializer(self):
+        products = [Product.objects.create(name=f'fast_{i}', stock_quantity=10, price=10) for i in range(5)]
+        items = [{'products_id': product.id, 'quantity': i + 1} for i, product in enumerate(reversed(products))]
+        CartItem.create_cart_items_and_subtract_from_stock(user=self.user_1, items=items)
+        Cart.objects.create(user=self.user_2, is_dead=True)
+
+        carts = Cart.objects.order_by('id').prefetch_related('items_cart')
+        expected = json.loads(JSONRenderer().render(CartSerializer(carts, many=True).data))
+        rows, data = serialize_carts(Cart.objects.order_by('id'))
+        actual = json.loads(JSONRenderer().render(data))
+        for cart in expected + actual:
+            cart['items_cart'].sort(key=lambda item: item['id'])
+        assert actual == expected
+        assert [(row.id, row.updated) for row in rows] == [(cart.id, cart.updated) for cart in carts]
+
+    def test_get_cart_api_conditional_requests(self):
+        headers = self.get_auth_header(**self.user_1_login_data)
+        sosis = Product.objects.create(name='sossssis', stock_quantity=10, price=50)
+        payload = {"items_cart": [{"products": sosis.id, "quantity": 4}]}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.add_cart_item_url, content_type='application/json', headers=headers, data=payload)
+        response = self.client.get(self.add_cart_item_url, headers=headers)
+        assert response.status_code == 200
+        etag = response['ETag']
+
+        # neither the cart nor the authenticated user is read from database
+        with self.assertNumQueries(0):
+            warm_response = self.client.get(self.add_cart_item_url, headers=headers)
+        assert warm_response.json() == response.json()
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.add_cart_item_url, headers={**headers, 'If-None-Match': etag})
+        assert response.status_code == 304
+
+        response = self.client.get(self.add_cart_item_url,
+                                   headers={**headers, 'If-Modified-Since': response['Last-Modified']})
+        assert response.status_code == 304
+
+        payload["items_cart"][0]["quantity"] = 2
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.add_cart_item_url, content_type='application/json', headers=headers, data=payload)
+        response = self.client.get(self.add_cart_item_url, headers={**headers, 'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+        assert response.json()[0]['items_cart'][0]['quantity'] == 2
+
+        # content changed behind a cart updated time that did not move
+        etag, updated = response['ETag'], Cart.objects.get(user=self.user_1).updated
+        CartItem.objects.filter(cart__user=self.user_1).update(quantity=3)
+        cart_cache.invalidate(self.user_1.id)
+        response = self.client.get(self.add_cart_item_url, headers={**headers, 'If-None-Match': etag})
+        assert Cart.objects.get(user=self.user_1).updated == updated
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+
+
+class StockReservationConcurrencyTest(TransactionTestCase):
+    """ hammers stock reservations from several threads, each one on its own database connection """
+    workers_count = 12
+
+    def run_in_threads(self, targets):
+        errors = []
+        barrier = threading.Barrier(len(targets))
+
+        def runner(target):
+            try:
+                barrier.wait()
+                target()
+            except LowStockQuantityException as lsq:
+                errors.append(lsq)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=runner, args=(target,)) for target in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=60)
+            assert not thread.is_alive(), "reservation worker got stuck"
+        return errors
+
+    def test_no_oversell(self):
+        product = Product.objects.create(name='hot', stock_quantity=20, price=10)
+        users = [UserModel.objects.create_user(username=f'buyer_{i}', password='pass')
+                 for i in range(self.workers_count)]
+
+        errors = self.run_in_threads([
+            lambda user=user: CartItem.create_cart_items_and_subtract_from_stock(
+                user=user, items=[{'products_id': product.id, 'quantity': 3}]
+            )
+            for user in users
+        ])
+
+        product.refresh_from_db()
+        succeeded = CartItem.objects.filter(products=product).count()
+        assert succeeded == 20 // 3
+        assert len(errors) == self.workers_count - succeeded
+        assert all('hot' in str(error) for error in errors)
+        assert product.stock_quantity == 20 - 3 * succeeded
+
+    def test_no_deadlock_on_crossed_product_order(self):
+        if connection.vendor != 'postgresql':
+            # sqlite takes its write lock at BEGIN, writers never hold row locks side by side to deadlock on
+            self.skipTest('row lock order only matters on postgresql')
+        first = Product.objects.create(name='first', stock_quantity=100, price=10)
+        second = Product.objects.create(name='second', stock_quantity=100, price=10)
+
+        def reserve(product_ids):
+            with transaction.atomic():
+                for product_id in product_ids:
+                    reserve_stock(product_id, 1)
+
+        errors = self.run_in_threads([
+            lambda index=index: (
+                apply_stock_deltas({first.id: 1, second.id: 1}) if index % 2
+                else reserve([second.id, first.id])
+            )
+            for index in range(self.workers_count)
+        ])
+
+        assert errors == []
+        first.refresh_from_db()
+        second.refresh_from_db()
+        assert first.stock_quantity == second.stock_quantity == 100 - self.workers_count
+
+    def test_write_waits_for_a_kill_of_its_cart(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('sqlite takes its write lock at BEGIN, a kill and a cart write never overlap')
+        product = Product.objects.create(name='hot', stock_quantity=10, price=10)
+        user = UserModel.objects.create_user(username='waiting_buyer', password='pass')
+        cart = CartItem.create_cart_items_and_subtract_from_stock(
+            user=user, items=[{'products_id': product.id, 'quantity': 3}]
+        )
+        locked = threading.Event()
+
+        def kill():
+            with transaction.atomic():
+                Cart.objects.select_for_update().get(pk=cart.pk)
+                locked.set()
+                # the write queues up on the cart row lock meanwhile
+                time.sleep(0.5)
+                Cart.kill_many([cart.pk])
+
+        def write():
+            locked.wait(10)
+            CartItem.create_cart_items_and_subtract_from_stock(
+                user=user, items=[{'products_id': product.id, 'quantity': 5}]
+            )
+
+        assert self.run_in_threads([kill, write]) == []
+        cart.refresh_from_db()
+        product.refresh_from_db()
+        # the write revived the killed cart with all of its quantity, instead of reserving 2 more for a dead cart
+        assert not cart.is_dead
+        assert product.stock_quantity == 5
+
+    @override_settings(STOCK_COALESCE_WINDOW=0.05)
+    def test_coalesced_reservations_never_oversell(self):
+        product = Product.objects.create(name='hot', stock_quantity=20, price=10)
+        with mock.patch.object(coalescer.ReservationCoalescer, 'reserve',
+                               side_effect=coalescer.ReservationCoalescer.reserve) as batch_reserve:
+            errors = self.run_in_threads([
+                lambda: coalescer.reserve({product.id: 3}) for _ in range(self.workers_count)
+            ])
+
+        product.refresh_from_db()
+        assert len(errors) == self.workers_count - 20 // 3
+        assert all('hot' in str(error) for error in errors)
+        assert product.stock_quantity == 20 - 3 * (20 // 3)
+        assert batch_reserve.call_count < self.workers_count
+
+    @override_settings(STOCK_COALESCE_WINDOW=0.01)
+    def test_coalesced_reservation_is_given_back_on_rollback(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('sqlite takes its write lock at BEGIN, the flusher could not write meanwhile')
+        product = Product.objects.create(name='hot', stock_quantity=5, price=10)
+        with self.assertRaises(ValueError), hot_stock.journal(), transaction.atomic():
+            coalescer.reserve({product.id: 4})
+            assert Product.objects.get(pk=product.id).stock_quantity == 1
+            raise ValueError('cart could not be saved')
+        product.refresh_from_db()
+        assert product.stock_quantity == 5
+
+        # no journal to undo it right away, the row left behind is released once stale
+        with self.assertRaises(ValueError), transaction.atomic():
+            coalescer.reserve({product.id: 4})
+            raise ValueError('cart could not be saved')
+        product.refresh_from_db()
+        assert product.stock_quantity == 1
+        with override_settings(STOCK_COALESCE_GRACE=-1):
+            assert release_stale_reservations() == 1
+        product.refresh_from_db()
+        assert product.stock_quantity == 5
+
+    @override_settings(STOCK_COALESCE_WINDOW=0.01)
+    def test_unsaved_coalesced_reservation_is_released(self):
+        product = Product.objects.create(name='hot', stock_quantity=5, price=10)
+        # sqlite takes its write lock at BEGIN, so the request fails before its transaction starts
+        with self.assertRaises(ValueError), hot_stock.journal():
+            with mock.patch.object(coalescer, 'confirm', side_effect=ValueError('cart could not be saved')):
+                coalescer.reserve({product.id: 4})
+        product.refresh_from_db()
+        assert product.stock_quantity == 5
+
+        # the request died before saving it
+        token = coalescer.coalescer.submit(product.id, 4).result()
+        product.refresh_from_db()
+        assert product.stock_quantity == 1
+        assert release_stale_reservations() == 0
+        with override_settings(STOCK_COALESCE_GRACE=-1):
+            assert release_stale_reservations() == 1
+        product.refresh_from_db()
+        assert product.stock_quantity == 5
+        with self.assertRaises(LowStockQuantityException):
+            coalescer.confirm([token])
+
+    @override_settings(STOCK_COALESCE_WINDOW=0.01)
+    def test_coalescer_failure_resolves_every_reservation(self):
+        product = Product.objects.create(name='hot', stock_quantity=5, price=10)
+        with mock.patch('carts.coalescer.time') as coalescer_time:
+            coalescer_time.sleep.side_effect = RuntimeError('coalescer crashed')
+            with self.assertLogs('carts.coalescer', 'ERROR'):
+                future = coalescer.coalescer.submit(product.id, 1)
+                with self.assertRaises(RuntimeError):
+                    future.result(timeout=10)
+        assert coalescer.coalescer.thread is None
+        assert coalescer.reserve({product.id: 1}) == {}
+        product.refresh_from_db()
+        assert product.stock_quantity == 4
+
+    @override_settings(STOCK_COALESCE_WINDOW=0.05)
+    def test_coalesced_cart_requests(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('sqlite is never coalesced')
+        product = Product.objects.create(name='hot', stock_quantity=20, price=10)
+        users = [UserModel.objects.create_user(username=f'buyer_{i}', password='pass')
+                 for i in range(self.workers_count)]
+        payload = {'items_cart': [{'products': product.id, 'quantity': 3}]}
+        errors = []
+
+        def post(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            response = client.post('/cart/cart/', data=payload, format='json')
+            if response.status_code != 201:
+                errors.append(response)
+
+        with mock.patch.object(coalescer.ReservationCoalescer, 'reserve',
+                               side_effect=coalescer.ReservationCoalescer.reserve) as batch_reserve:
+            assert self.run_in_threads([lambda user=user: post(user) for user in users]) == []
+
+        product.refresh_from_db()
+        succeeded = CartItem.objects.filter(products=product).count()
+        assert succeeded == 20 // 3
+        assert len(errors) == self.workers_count - succeeded
+        assert product.stock_quantity == 20 - 3 * succeeded
+        assert 0 < batch_reserve.call_count < self.workers_count
+        assert not PendingReservation.objects.exists()
+
+    @override_settings(STOCK_COALESCE_WINDOW=0.01)
+    def test_coalesced_cart_request_rollback_gives_stock_back(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('sqlite is never coalesced')
+        product = Product.objects.create(name='hot', stock_quantity=5, price=10)
+        client = APIClient()
+        client.force_authenticate(UserModel.objects.create_user(username='failing_buyer', password='pass'))
+        payload = {'items_cart': [{'products': product.id, 'quantity': 4}]}
+
+        # the cart write fails after its stock was reserved by the flusher
+        with mock.patch.object(coalescer.ReservationCoalescer, 'reserve',
+                               side_effect=coalescer.ReservationCoalescer.reserve) as batch_reserve:
+            with mock.patch.object(Cart, 'change_totals', side_effect=ValueError('cart could not be saved')):
+                with self.assertRaises(ValueError):
+                    client.post('/cart/cart/', data=payload, format='json')
+        assert batch_reserve.call_count == 1
+        product.refresh_from_db()
+        assert product.stock_quantity == 5
+        assert not PendingReservation.objects.exists()
+        assert not CartItem.objects.exists()
+
+        response = client.post('/cart/cart/', data=payload, format='json')
+        assert response.status_code == 201
+        product.refresh_from_db()
+        assert product.stock_quantity == 1
+        assert not PendingReservation.objects.exists()
+
+    @override_settings(HOT_STOCK_BACKEND='local')
+    def test_no_oversell_of_hot_product(self):
+        self.addCleanup(hot_stock.snapshot.invalidate)
+        self.addCleanup(hot_stock.LocalStockCounters.clear)
+        product = Product.objects.create(name='hot', stock_quantity=20, price=10)
+        hot_stock.heat(product.id)
+        users = [UserModel.objects.create_user(username=f'buyer_{i}', password='pass')
+                 for i in range(self.workers_count)]
+
+        errors = self.run_in_threads([
+            lambda user=user: CartItem.create_cart_items_and_subtract_from_stock(
+                user=user, items=[{'products_id': product.id, 'quantity': 3}]
+            )
+            for user in users
+        ])
+
+        succeeded = CartItem.objects.filter(products=product).count()
+        assert succeeded == 20 // 3
+        assert len(errors) == self.workers_count - succeeded
+        assert hot_stock.get_counters().totals([product.id]) == {product.id: 20 - 3 * succeeded}
+        reconcile_hot_stock()
+        product.refresh_from_db()
+        assert product.stock_quantity == 20 - 3 * succeeded
+
+
+@override_settings(CART_LEASE_BACKEND='database')
+@override_settings(HOT_STOCK_BACKEND='local', HOT_STOCK_SHARDS=4)
+class HotStockTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        hot_stock.LocalStockCounters.clear()
+        hot_stock.snapshot.invalidate()
+        self.user = UserModel.objects.create_user(username='hot_buyer', password='pass')
+        self.product = Product.objects.create(name='hot', stock_quantity=10, price=10)
+        self.other = Product.objects.create(name='other hot', stock_quantity=1, price=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            hot_stock.heat(self.product.id)
+            hot_stock.heat(self.other.id)
+        self.counters = hot_stock.get_counters()
+
+    def tearDown(self):
+        hot_stock.LocalStockCounters.clear()
+        hot_stock.snapshot.invalidate()
+
+    def buy(self, quantity, product=None):
+        return CartItem.create_cart_items_and_subtract_from_stock(
+            user=self.user, items=[{'products_id': (product or self.product).id, 'quantity': quantity}]
+        )
+
+    def test_take_drains_across_shards(self):
+        self.counters.load(0, 10)
+        assert self.counters.take(0, 9, 'first') == hot_stock.TAKEN
+        assert self.counters.totals([0]) == {0: 1}
+        assert self.counters.take(0, 2, 'second') == hot_stock.SHORT
+        assert list(self.counters.pending(0)) == ['first']
+        assert self.counters.settle(0, 'first', 9)
+        assert not self.counters.settle(0, 'first', 9)
+        assert self.counters.drop(0) == 10
+        assert self.counters.take(0, 1, 'third') == hot_stock.COLD
+        assert not self.counters.pend(0, 1, 'fourth')
+
+    def test_rollback_outside_journal_is_settled_by_reconcile(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            hot_stock.apply({self.product.id: 4})
+            raise ValueError('cart could not be saved')
+        assert self.counters.totals([self.product.id]) == {self.product.id: 6}
+
+        with override_settings(HOT_STOCK_SETTLE_GRACE=-1):
+            hot_stock.reconcile()
+        assert self.counters.totals([self.product.id]) == {self.product.id: 10}
+        assert self.counters.pending(self.product.id) == {}
+        self.product.refresh_from_db()
+        assert self.product.stock_quantity == 10
+
+    def test_lost_counters_are_rebuilt_from_journal(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.buy(4)
+        # no reconcile ran since, the row still holds the stock before the reservation
+        hot_stock.LocalStockCounters.clear()
+
+        hot_stock.reconcile()
+        assert self.counters.totals([self.product.id]) == {self.product.id: 6}
+        self.product.refresh_from_db()
+        assert self.product.stock_quantity == 6
+
+    def test_import_keeps_reservations_and_rolls_back(self):
+        Product.objects.filter(pk=self.product.id).update(external_id='hot-1')
+        row = {'external_id': 'hot-1', 'name': 'hot', 'price': 10, 'stock_quantity': 20}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.buy(4)
+            upsert_chunk([row])
+        # 20 on hand, 4 of them reserved by the live cart
+        assert self.counters.totals([self.product.id]) == {self.product.id: 16}
+
+        with self.assertRaises(ValueError), transaction.atomic():
+            upsert_chunk([{**row, 'stock_quantity': 50}])
+            raise ValueError('import failed')
+        assert self.counters.totals([self.product.id]) == {self.product.id: 16}
+
+        with override_settings(HOT_STOCK_SETTLE_GRACE=-1):
+            hot_stock.reconcile()
+        assert self.counters.totals([self.product.id]) == {self.product.id: 16}
+        self.product.refresh_from_db()
+        assert self.product.stock_quantity == 16
+
+    def test_reservation_is_mirrored_by_reconcile(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            cart = self.buy(4)
+        self.product.refresh_from_db()
+        assert self.product.stock_quantity == 10
+        assert self.counters.totals([self.product.id]) == {self.product.id: 6}
+
+        with self.assertRaises(LowStockQuantityException):
+            self.buy(11)
+
+        assert hot_stock.reconcile() == 2
+        self.product.refresh_from_db()
+        assert self.product.stock_quantity == 6
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cart.kill()
+        assert self.counters.totals([self.product.id]) == {self.product.id: 10}
+
+    def test_failed_transaction_gives_counters_back(self):
+        with self.assertRaises(LowStockQuantityException):
+            CartItem.create_cart_items_and_subtract_from_stock(user=self.user, items=[
+                {'products_id': self.product.id, 'quantity': 3},
+                {'products_id': self.other.id, 'quantity': 2},
+            ])
+        assert self.counters.totals([self.product.id, self.other.id]) == {self.product.id: 10, self.other.id: 1}
+
+    def test_stale_snapshot_of_hot_products(self):
+        cold = Product.objects.create(name='cold', stock_quantity=5, price=10)
+        hot_stock.snapshot.get_product_ids()
+        hot_stock.heat(cold.id)
+        hot_stock.cool(self.product.id)
+
+        self.buy(2, product=cold)
+        self.buy(3)
+
+        cold.refresh_from_db()
+        self.product.refresh_from_db()
+        assert cold.stock_quantity == 5
+        assert self.counters.totals([cold.id]) == {cold.id: 3}
+        assert self.product.stock_quantity == 7
+        assert not self.product.is_hot
+
+    def test_command_refuses_process_local_counters(self):
+        cold = Product.objects.create(name='cold', stock_quantity=5, price=10)
+        with self.assertRaises(CommandError):
+            call_command('hot_stock', 'heat', str(cold.id))
+        cold.refresh_from_db()
+        assert not cold.is_hot
+        with override_settings(HOT_STOCK_BACKEND=None), self.assertRaises(ImproperlyConfigured):
+            hot_stock.heat(cold.id)
+
+    def test_revive_trusts_counters_over_mirror(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            cart = self.buy(10)
+            hot_stock.reconcile()
+            cart.kill()
+        cart.revive()
+        assert not cart.is_dead
+        assert self.counters.totals([self.product.id]) == {self.product.id: 0}
+
+
+@override_settings(CART_LEASE_BACKEND='database')
+@override_settings(HOT_STOCK_BACKEND='redis', HOT_STOCK_SHARDS=4)
+class RedisStockCountersTest(TestCase):
+    """ runs lua scripts of RedisStockCounters against fakeredis """
+    def setUp(self):
+        if fakeredis is None:
+            self.skipTest('needs pip install "fakeredis[lua]"')
+        cache.clear()
+        hot_stock.snapshot.invalidate()
+        self.addCleanup(hot_stock.snapshot.invalidate)
+        patcher = mock.patch('carts.hot_stock.get_redis_client', return_value=fakeredis.FakeRedis())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.counters = hot_stock.get_counters()
+
+    def test_scripts(self):
+        self.counters.load(0, 10)
+        assert self.counters.take(0, 3, 'first') == hot_stock.TAKEN
+        # no shard holds more than 3, so this one drains across shards
+        assert self.counters.take(0, 6, 'second') == hot_stock.TAKEN
+        assert self.counters.totals([0]) == {0: 1}
+        assert self.counters.take(0, 2, 'third') == hot_stock.SHORT
+        assert self.counters.pend(0, 5, 'fourth')
+        pending = self.counters.pending(0)
+        assert sorted(pending) == ['first', 'fourth', 'second']
+        assert pending['second'][:2] == (-6, True)
+        assert pending['fourth'][:2] == (5, False)
+
+        assert self.counters.settle(0, 'second', 6)
+        assert not self.counters.settle(0, 'second', 6)
+        assert self.counters.settle(0, 'fourth', 5)
+        assert self.counters.settle(0, 'first', 0)
+        assert self.counters.pending(0) == {}
+        assert self.counters.totals([0]) == {0: 12}
+
+        assert self.counters.pend(0, 1, 'fifth')
+        assert self.counters.drop(0) == 12
+        assert self.counters.drop(0) is None
+        assert self.counters.totals([0]) == {}
+        assert self.counters.take(0, 1, 'sixth') == hot_stock.COLD
+        assert not self.counters.pend(0, 1, 'seventh')
+        assert not self.counters.settle(0, 'fifth', 1)
+
+    def test_reservations_through_redis(self):
+        user = UserModel.objects.create_user(username='redis_buyer', password='pass')
+        product = Product.objects.create(name='hot', stock_quantity=10, price=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('hot_stock', 'heat', str(product.id), stdout=io.StringIO())
+        with self.captureOnCommitCallbacks(execute=True):
+            cart = CartItem.create_cart_items_and_subtract_from_stock(
+                user=user, items=[{'products_id': product.id, 'quantity': 4}]
+            )
+        assert self.counters.totals([product.id]) == {product.id: 6}
+        assert self.counters.pending(product.id) == {}
+
+        with self.assertRaises(ValueError), transaction.atomic():
+            hot_stock.apply({product.id: 5})
+            raise ValueError('cart could not be saved')
+        assert self.counters.totals([product.id]) == {product.id: 1}
+        with override_settings(HOT_STOCK_SETTLE_GRACE=-1):
+            call_command('hot_stock', 'reconcile', stdout=io.StringIO())
+        assert self.counters.totals([product.id]) == {product.id: 6}
+        product.refresh_from_db()
+        assert product.stock_quantity == 6
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cart.kill()
+        assert self.counters.totals([product.id]) == {product.id: 10}
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('hot_stock', 'cool', str(product.id), stdout=io.StringIO())
+        product.refresh_from_db()
+        assert product.stock_quantity == 10
+        assert not product.is_hot
+        assert self.counters.totals([product.id]) == {}
+
+
+class IdempotencyKeyTest(TransactionTestCase):
+    url = '/cart/cart/'
+
+    def setUp(self):
+        cache.clear()
+        self.user = UserModel.objects.create_user(username='retrying_user', password='pass')
+        self.product = Product.objects.create(name='shalgham', stock_quantity=10, price=10)
+        self.payload = {'items_cart': [{'products': self.product.id, 'quantity': 4}]}
+
+    def post(self, key, payload=None):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.post(self.url, payload or self.payload, format='json', headers={'Idempotency-Key': key})
+
+    def test_retry_is_replayed(self):
+        with mock.patch.object(CartItem, 'create_cart_items_and_subtract_from_stock',
+                               side_effect=CartItem.create_cart_items_and_subtract_from_stock) as create:
+            first = self.post('key-1')
+            retry = self.post('key-1')
+            other_key = self.post('key-2')
+
+        assert first.status_code == retry.status_code == 201
+        assert 'Idempotent-Replayed' not in first
+        assert retry['Idempotent-Replayed'] == 'true'
+        assert retry.json() == first.json()
+        assert create.call_count == 2
+        assert other_key.status_code == 201
+
+        changed = self.post('key-1', {'items_cart': [{'products': self.product.id, 'quantity': 5}]})
+        assert changed.status_code == 422
+        self.product.refresh_from_db()
+        assert self.product.stock_quantity == 6
+
+    def test_failed_request_is_not_kept(self):
+        too_many = {'items_cart': [{'products': self.product.id, 'quantity': 11}]}
+        assert self.post('key-1', too_many).status_code == 400
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=20)
+        assert self.post('key-1', too_many).status_code == 201
+
+    def test_concurrent_duplicates_run_once(self):
+        workers_count = 8
+        barrier = threading.Barrier(workers_count)
+        responses = []
+
+        def runner():
+            try:
+                barrier.wait()
+                responses.append(self.post('key-1'))
+            finally:
+                connection.close()
+
+        with mock.patch.object(CartItem, 'create_cart_items_and_subtract_from_stock',
+                               side_effect=CartItem.create_cart_items_and_subtract_from_stock) as create:
+            threads = [threading.Thread(target=runner) for _ in range(workers_count)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(timeout=60)
+                assert not thread.is_alive(), "duplicate request got stuck"
+
+        assert create.call_count == 1
+        assert [response.status_code for response in responses] == [201] * workers_count
+        assert sum('Idempotent-Replayed' not in response for response in responses) == 1
+        self.product.refresh_from_db()
+        assert self.product.stock_quantity == 6
+
+
+class KillOldCartsTest(TestCase):
+    def setUp(self):
+        self.product = Product.objects.create(name='old_product', stock_quantity=0, price=10)
+        self.carts = []
+        for i in range(5):
+            cart = Cart.objects.create(user=UserModel.objects.create_user(username=f'old_{i}', password='pass'))
+            CartItem.objects.create(cart=cart, products=self.product, quantity=2)
+            self.carts.append(cart)
+
+    def test_kill_old_carts_in_chunks(self):
+        expired_ids = [cart.id for cart in self.carts[:4]]
+        Cart.objects.filter(pk__in=expired_ids).update(updated=timezone.now() - timezone.timedelta(hours=1))
+
+        assert kill_old_carts(chunk_size=2) == 4
+
+        assert set(Cart.objects.filter(is_dead=True).values_list('pk', flat=True)) == set(expired_ids)
+        self.product.refresh_from_db()
+        assert self.product.stock_quantity == 4 * 2
+
+        assert kill_old_carts(chunk_size=2) == 0
+        self.product.refresh_from_db()
+        assert self.product.stock_quantity == 4 * 2
+
+    def test_failed_chunk_is_logged(self):
+        Cart.objects.update(updated=timezone.now() - timezone.timedelta(hours=1))
+        # the first chunk is killed, the second one fails
+        chunks = [Cart.kill_expired_chunk, mock.Mock(side_effect=RuntimeError('db is gone'))]
+        kill_chunk = mock.patch.object(Cart, 'kill_expired_chunk', side_effect=lambda *args: chunks.pop(0)(*args))
+
+        with kill_chunk, self.assertLogs('carts.tasks', 'ERROR') as logs:
+            assert kill_old_carts(chunk_size=2) == 2
+        assert 'db is gone' in logs.output[0]
+        assert Cart.objects.filter(is_dead=False).count() == 3
+
+    def test_kill_many_skips_dead_carts(self):
+        assert Cart.kill_many([self.carts[0].id]) == 1
+        assert Cart.kill_many([self.carts[0].id, self.carts[1].id]) == 1
+        self.product.refresh_from_db()
+        assert self.product.stock_quantity == 2 * 2
+
+    def test_revive_fails_fast_when_short_on_stock(self):
+        cart = self.carts[0]
+        cart.kill()
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=1)
+
+        # a single read and no write at all
+        with self.assertNumQueries(4), self.assertRaises(LowStockQuantityException):
+            cart.revive()
+
+        cart.refresh_from_db()
+        self.product.refresh_from_db()
+        assert cart.is_dead is True
+        assert self.product.stock_quantity == 1
+
+    def test_overlapping_run_is_skipped(self):
+        Cart.objects.update(updated=timezone.now() - timezone.timedelta(hours=1))
+
+        with get_lease('kill_old_carts:0', ttl=60) as lease:
+            assert lease.acquired
+            assert kill_old_carts() is None
+            assert kill_old_carts(worker=1) == 5
+
+        assert Cart.objects.filter(is_dead=False).count() == 0
+
+
+class DatabaseLeaseTest(TestCase):
+    def test_lease_is_exclusive_until_released_or_expired(self):
+        first = DatabaseLease('some_task', ttl=60)
+        second = DatabaseLease('some_task', ttl=60)
+
+        assert first.acquire()
+        assert not second.acquire()
+        first.release()
+        assert second.acquire()
+
+        TaskLease.objects.filter(name='some_task').update(expires_at=timezone.now() - timezone.timedelta(seconds=1))
+        assert first.acquire()
+        second.release()  # not the owner anymore, must not drop first's lease
+        assert TaskLease.objects.get(name='some_task').owner == first.token
+
+
+class ServerSettingsTest(TestCase):
+    def setUp(self):
+        server_settings.snapshot.invalidate()
+        cache.clear()
+
+    def test_warm_reads_need_no_query(self):
+        assert server_settings.get_int('cart_life_span') == 30
+
+        with self.assertNumQueries(0):
+            for _ in range(100):
+                server_settings.get_int('cart_life_span')
+
+    def test_change_is_picked_up(self):
+        assert server_settings.get_int('cart_life_span') == 30
+
+        with self.captureOnCommitCallbacks(execute=True):
+            setting = ServerSetting.objects.create(name='cart_life_span', int_value=10)
+            # not committed yet, other processes must not cache it under a new version
+            assert cache.get(server_settings.VERSION_CACHE_KEY) is None
+        assert server_settings.get_int('cart_life_span') == 10
+
+        setting.int_value = 20
+        with self.captureOnCommitCallbacks(execute=True):
+            setting.save()
+        assert server_settings.get_int('cart_life_span') == 20
+
+        with self.captureOnCommitCallbacks(execute=True):
+            setting.delete()
+        assert server_settings.get_int('cart_life_span') == 30
+
+    def test_stale_snapshot_is_reloaded_after_version_bump(self):
+        assert server_settings.get_int('cart_life_span') == 30
+
+        # another process changed the value, so only the shared version key tells us
+        ServerSetting.objects.bulk_create([ServerSetting(name='cart_life_span', int_value=15)])
+        assert server_settings.get_int('cart_life_span') == 30
+        cache.set(server_settings.VERSION_CACHE_KEY, 100)
+        assert server_settings.get_int('cart_life_span') == 30  # snapshot is trusted until its ttl ends
+
+        server_settings.snapshot.fresh_until = 0
+        assert server_settings.get_int('cart_life_span') == 15
+
+
+class CartDailyTotalTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sosis = Product.objects.create(name='sosis', stock_quantity=100, price=50)
+        self.kalbas = Product.objects.create(name='kalbas', stock_quantity=100, price=100)
+        self.carts = []
+        for i in range(4):
+            user = UserModel.objects.create_user(username=f'reporter_{i}', password='pass')
+            self.carts.append(CartItem.create_cart_items_and_subtract_from_stock(
+                user=user, items=[{'products_id': self.sosis.id, 'quantity': i + 1},
+                                  {'products_id': self.kalbas.id, 'quantity': 1}]
+            ))
+        Cart.objects.filter(pk=self.carts[0].pk).update(updated=timezone.now() - timezone.timedelta(days=2))
+
+    def test_rollup_matches_live_aggregate(self):
+        refresh_cart_daily_totals()
+        assert Cart.get_all_carts_sum() == Cart.get_all_carts_sum_live()
+
+        start_date = timezone.now() - timezone.timedelta(days=1)
+        assert Cart.get_all_carts_sum(start_date=start_date) == Cart.get_all_carts_sum_live(start_date=start_date)
+        assert len(Cart.get_all_carts_sum(start_date=start_date)) == 1
+
+        # only carts touched since the last run are recomputed, whatever the rollup holds
+        CartItem.create_cart_items_and_subtract_from_stock(
+            user=self.carts[1].user, items=[{'products_id': self.kalbas.id, 'quantity': 5}]
+        )
+        assert refresh_cart_daily_totals() == len(self.carts) - 1
+        assert Cart.get_all_carts_sum() == Cart.get_all_carts_sum_live()
+        CartDailyTotal.objects.all().delete()
+        assert refresh_cart_daily_totals() == len(self.carts) - 1
+
+        # a quantity change alone touches its cart too
+        old_updated = Cart.objects.get(pk=self.carts[2].pk).updated
+        CartItem.objects.get(cart=self.carts[2], products=self.kalbas).update_quantity(3)
+        assert Cart.objects.get(pk=self.carts[2].pk).updated > old_updated
+        refresh_cart_daily_totals()
+        assert CartDailyTotal.objects.get(user=self.carts[2].user).total_amount == 3 * 50 + 3 * 100
+
+    def test_price_change_drift_is_detected(self):
+        refresh_cart_daily_totals()
+        Product.objects.filter(pk=self.kalbas.pk).update(price=120)
+        # every cart holds a kalbas priced at 100, the live aggregate prices it at 120 now
+        assert sorted(Cart.find_drifted_totals(Cart.objects.all())) == sorted(cart.pk for cart in self.carts)
+        assert Cart.get_all_carts_sum() != Cart.get_all_carts_sum_live()
+
+        # repaired carts get their rollup rows recomputed right away
+        Cart.refresh_totals(Cart.objects.all())
+        assert Cart.find_drifted_totals(Cart.objects.all()) == []
+        assert Cart.get_all_carts_sum() == Cart.get_all_carts_sum_live()
+
+    def test_denormalized_totals_follow_every_write(self):
+        cart = self.carts[3]
+        cart.refresh_from_db()
+        assert (cart.total_amount, cart.item_count) == (4 * 50 + 100, 5)
+
+        CartItem.create_cart_items_and_subtract_from_stock(
+            user=cart.user, items=[{'products_id': self.sosis.id, 'quantity': 1}]
+        )
+        CartItem.apply_line_operations(cart.user, [{'op': 'increment', 'products_id': self.kalbas.id, 'quantity': 2},
+                                                   {'op': 'remove', 'products_id': self.sosis.id}])
+        CartItem.objects.get(cart=cart, products=self.kalbas).update_quantity(2)
+        cart.kill()
+        cart.revive()
+
+        cart.refresh_from_db()
+        assert (cart.total_amount, cart.item_count) == (2 * 100, 2)
+        assert Cart.find_drifted_totals(Cart.objects.all()) == []
+
+    def test_verify_cart_totals_command(self):
+        call_command('verify_cart_totals', stdout=io.StringIO())
+        Cart.objects.filter(pk=self.carts[1].pk).update(total_amount=1)
+        Product.objects.filter(pk=self.kalbas.pk).update(price=120)
+
+        with self.assertRaises(CommandError):
+            call_command('verify_cart_totals', chunk_size=2, stdout=io.StringIO())
+        call_command('verify_cart_totals', repair=True, chunk_size=2, stdout=io.StringIO())
+        call_command('verify_cart_totals', stdout=io.StringIO())
+        assert Cart.objects.get(pk=self.carts[1].pk).total_amount == 2 * 50 + 120
+
+    def test_rebuild_command(self):
+        call_command('rebuild_cart_daily_totals', stdout=io.StringIO())
+        assert CartDailyTotal.objects.count() == len(self.carts)
+        assert Cart.get_all_carts_sum() == Cart.get_all_carts_sum_live()
+
+    def test_report_api(self):
+        call_command('rebuild_cart_daily_totals', stdout=io.StringIO())
+        response = self.client.get('/cart/report/')
+        assert response.status_code == 200
+        today = timezone.localdate().strftime('%Y-%m-%d')
+        self.assertEqual(response.json()[today][0], {'username': 'reporter_3', 'total_amount': 4 * 50 + 100})
+
+    def test_streamed_report_api(self):
+        call_command('rebuild_cart_daily_totals', stdout=io.StringIO())
+
+        response = self.client.get('/cart/report/', {'stream': 'json'})
+        assert response.status_code == 200
+        assert response.streaming
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), Cart.get_all_carts_sum())
+
+        response = self.client.get('/cart/report/', {'stream': 'ndjson'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        assert len(lines) == len(self.carts)
+        assert json.loads(lines[0])['total_amount'] == 4 * 50 + 100
+
+        response = self.client.get('/cart/report/', {'stream': 'json', 'start_date': '2000-01-01',
+                                                     'end_date': '2000-01-02'})
+        assert json.loads(b''.join(response.streaming_content)) == {}
+
+    def test_daily_report_cursor_pagination(self):
+        # carts sharing a total amount, a cursor on total amount alone would skip or repeat some of them
+        for i in range(5):
+            user = UserModel.objects.create_user(username=f'twin_{i}', password='pass')
+            CartItem.create_cart_items_and_subtract_from_stock(
+                user=user, items=[{'products_id': self.kalbas.id, 'quantity': 2}]
+            )
+        call_command('rebuild_cart_daily_totals', stdout=io.StringIO())
+        today = timezone.localdate().strftime('%Y-%m-%d')
+        expected = [{'username': username, 'total_amount': total_amount}
+                    for username, total_amount in CartDailyTotal.objects.filter(
+                        date=timezone.localdate()
+                    ).order_by('-total_amount', 'user_id').values_list('user__username', 'total_amount')]
+
+        url = f'/cart/report/{today}/?page_size=2'
+        entries, pages = [], []
+        while url:
+            page = self.client.get(url).json()
+            pages.append(page['results'])
+            entries.extend(page['results'])
+            url = page['next']
+        self.assertEqual(entries, expected)
+
+        # and back again
+        url = self.client.get(f'/cart/report/{today}/?page_size=2').json()['next']
+        url = self.client.get(url).json()['next']
+        page = self.client.get(self.client.get(url).json()['previous']).json()
+        self.assertEqual(page['results'], pages[1])
+
+        assert self.client.get('/cart/report/not-a-date/').status_code == 404
+
+    def test_report_cache(self):
+        call_command('rebuild_cart_daily_totals', stdout=io.StringIO())
+        today = timezone.localdate().strftime('%Y-%m-%d')
+
+        response = self.client.get('/cart/report/', {'start_date': today})
+        assert response['X-Cache'] == 'MISS'
+        with self.assertNumQueries(0):
+            response = self.client.get('/cart/report/', {'start_date': f'{today}T00:00:00'})
+        assert response['X-Cache'] == 'HIT'
+        assert report_cache.stats() == {'hit': 1, 'miss': 1, 'stale': 0}
+
+        # a cart of a covered day changed, one worker refreshes while the others get the stale value
+        CartItem.create_cart_items_and_subtract_from_stock(
+            user=self.carts[1].user, items=[{'products_id': self.kalbas.id, 'quantity': 5}]
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh_cart_daily_totals()
+        key = report_cache.make_key(report_cache.normalize_date(today), None)
+        cache.add(f'{key}:refreshing', 1)
+        response = self.client.get('/cart/report/', {'start_date': today})
+        assert response['X-Cache'] == 'STALE'
+        assert response.json() != Cart.get_all_carts_sum(start_date=report_cache.normalize_date(today))
+
+        cache.delete(f'{key}:refreshing')
+        response = self.client.get('/cart/report/', {'start_date': today})
+        assert response['X-Cache'] == 'MISS'
+        assert response.json() == Cart.get_all_carts_sum(start_date=report_cache.normalize_date(today))
+
+        assert self.client.get('/cart/report/', {'start_date': 'yesterday'}).status_code == 400
+
+
+class ReportCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.start_date = report_cache.normalize_date('2026-01-01')
+
+    def run_in_threads(self, target, workers_count=6):
+        results = []
+        barrier = threading.Barrier(workers_count)
+
+        def runner():
+            barrier.wait()
+            results.append(target())
+
+        threads = [threading.Thread(target=runner) for _ in range(workers_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+        return results
+
+    def test_cold_miss_is_computed_once(self):
+        calls = []
+
+        def compute(start_date, end_date):
+            calls.append(start_date)
+            threading.Event().wait(0.2)
+            return {'2026-01-01': []}
+
+        results = self.run_in_threads(lambda: report_cache.get_or_compute(self.start_date, None, compute))
+
+        assert len(calls) == 1
+        assert sorted(cache_status for _, cache_status in results) == ['hit'] * 5 + ['miss']
+        assert all(result == {'2026-01-01': []} for result, _ in results)
+
+    @override_settings(CART_REPORT_CACHE_MISS_WAIT=0)
+    def test_lock_of_another_worker_is_kept(self):
+        lock_key = f'{report_cache.make_key(self.start_date, None)}:refreshing'
+        cache.add(lock_key, 1)
+
+        assert report_cache.get_or_compute(self.start_date, None, lambda *dates: {})[1] == 'miss'
+        assert cache.get(lock_key) == 1
+
+    def test_concurrent_stores_keep_every_range(self):
+        dates = [report_cache.normalize_date(f'2026-01-{day:02}') for day in range(1, 7)]
+        pending = iter(dates)
+
+        def store():
+            date = next(pending)
+            report_cache.store(report_cache.make_key(date, None), date, None, {})
+
+        self.run_in_threads(store)
+
+        assert set(cache.get(report_cache.RANGES_KEY)) == {report_cache.make_key(date, None) for date in dates}
+        report_cache.invalidate_dates([timezone.localdate(dates[-1])])
+        assert all(cache.get(report_cache.make_key(date, None))['fresh_until'] == 0 for date in dates)
+
+
+class CartQueryBudgetTest(TestCase):
+    """
+    query count budgets of every cart code path, each one is checked with a small and a big cart,
+    so a path that starts running queries per item fails here
+    """
+    budgets = {
+        'create_cart': 13,
+        'update_cart': 11,
+        'revive_cart': 8,
+        'kill_cart': 9,
+        'kill_many_carts': 9,
+        'patch_cart_lines': 11,
+        'kill_old_carts': 20,
+        'refresh_cart_daily_totals': 9,
+        'list_cart_cold': 2,
+        'list_cart_warm': 0,
+        'cart_report_cold': 1,
+        'cart_report_warm': 0,
+    }
+
+    def setUp(self):
+        cache.clear()
+        server_settings.snapshot.invalidate()
+        server_settings.get_int('cart_life_span')
+        hot_stock.snapshot.invalidate()
+        hot_stock.snapshot.get_product_ids()
+        self.products = [Product.objects.create(name=f'budget_{i}', stock_quantity=1000, price=10)
+                         for i in range(30)]
+        self.users = [UserModel.objects.create_user(username=f'budget_user_{i}', password='pass') for i in range(4)]
+
+    def items(self, count, quantity=1):
+        return [{'products_id': product.id, 'quantity': quantity} for product in self.products[:count]]
+
+    def fill_carts(self):
+        return [CartItem.create_cart_items_and_subtract_from_stock(user=user, items=self.items(count))
+                for user, count in zip(self.users, (1, 30, 1, 30))]
+
+    def assertBudget(self, name, func, *args_per_size):
+        for args in args_per_size:
+            with self.assertNumQueries(self.budgets[name], msg=name):
+                func(*args)
+
+    def test_write_paths(self):
+        self.assertBudget('create_cart', lambda user, count: CartItem.create_cart_items_and_subtract_from_stock(
+            user=user, items=self.items(count)
+        ), (self.users[0], 1), (self.users[1], 30))
+        self.assertBudget('update_cart', lambda user, count: CartItem.create_cart_items_and_subtract_from_stock(
+            user=user, items=self.items(count, quantity=2)
+        ), (self.users[0], 1), (self.users[1], 30))
+        self.assertBudget('patch_cart_lines', lambda user: CartItem.apply_line_operations(user, [
+            {'op': 'increment', 'products_id': self.products[0].id, 'quantity': 1},
+        ]), (self.users[0],), (self.users[1],))
+
+        small_cart, big_cart = Cart.objects.get(user=self.users[0]), Cart.objects.get(user=self.users[1])
+        self.assertBudget('kill_cart', lambda cart: cart.kill(), (small_cart,), (big_cart,))
+        self.assertBudget('revive_cart', lambda cart: cart.revive(), (small_cart,), (big_cart,))
+        self.assertBudget('kill_many_carts', lambda cart: Cart.kill_many([cart.id]), (small_cart,), (big_cart,))
+
+    @override_settings(CART_LEASE_BACKEND='database')
+    def test_sweep_paths(self):
+        small_cart, big_cart, *_ = self.fill_carts()
+        for cart in (small_cart, big_cart):
+            Cart.objects.filter(pk=cart.pk).update(updated=timezone.now() - timezone.timedelta(days=1))
+            self.assertBudget('kill_old_carts', kill_old_carts, ())
+        # the first run ever recomputes everything and creates its watermark
+        refresh_cart_daily_totals()
+        self.assertBudget('refresh_cart_daily_totals', refresh_cart_daily_totals, (), ())
+
+    def test_read_paths(self):
+        self.fill_carts()
+        refresh_cart_daily_totals()
+        client = APIClient()
+        for user in self.users[:2]:
+            client.force_authenticate(user)
+            self.assertBudget('list_cart_cold', lambda: client.get('/cart/cart/'), ())
+            self.assertBudget('list_cart_warm', lambda: client.get('/cart/cart/'), ())
+        self.assertBudget('cart_report_cold', lambda: client.get('/cart/report/'), ())
+        self.assertBudget('cart_report_warm', lambda: client.get('/cart/report/'), ())
+
+
+@override_settings(CART_EXPIRY_BACKEND='database')
+class CartExpiryIndexTest(TestCase):
+    def setUp(self):
+        server_settings.snapshot.invalidate()
+        self.product = Product.objects.create(name='expiring', stock_quantity=10, price=10)
+        self.users = [UserModel.objects.create_user(username=f'expiring_{i}', password='pass') for i in range(3)]
+        self.carts = []
+        for user in self.users:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.carts.append(CartItem.create_cart_items_and_subtract_from_stock(
+                    user=user, items=[{'products_id': self.product.id, 'quantity': 1}]
+                ))
+
+    def expire(self, cart, minutes_ago=31):
+        updated = timezone.now() - timezone.timedelta(minutes=minutes_ago)
+        Cart.objects.filter(pk=cart.pk).update(updated=updated)
+        expiry.schedule_carts({cart.pk: updated})
+
+    def test_touched_carts_are_scheduled(self):
+        assert CartExpiry.objects.count() == len(self.carts)
+        expires_at = CartExpiry.objects.get(cart=self.carts[0]).expires_at
+        assert expires_at == self.carts[0].updated + timezone.timedelta(minutes=30)
+
+    def test_only_due_carts_are_killed(self):
+        with self.assertNumQueries(3):
+            assert kill_due_carts() == 0
+
+        self.expire(self.carts[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            assert kill_due_carts() == 1
+
+        assert list(Cart.objects.filter(is_dead=True).values_list('pk', flat=True)) == [self.carts[0].pk]
+        assert not CartExpiry.objects.filter(cart=self.carts[0]).exists()
+        self.product.refresh_from_db()
+        assert self.product.stock_quantity == 10 - 2
+
+    def test_cart_touched_after_it_was_read_is_not_killed(self):
+        self.expire(self.carts[2])
+        touched_at = timezone.now()
+
+        def touch(last_updates):
+            # a cart write commits between the read of last updates and the kill
+            Cart.objects.filter(pk=self.carts[2].pk).update(updated=touched_at)
+
+        with mock.patch('carts.tasks.expiry.schedule_carts', side_effect=touch):
+            assert kill_due_carts() == 0
+        assert not Cart.objects.get(pk=self.carts[2].pk).is_dead
+        self.product.refresh_from_db()
+        assert self.product.stock_quantity == 10 - 3
+
+    def test_longer_life_span_reschedules(self):
+        self.expire(self.carts[1])
+        with self.captureOnCommitCallbacks(execute=True):
+            ServerSetting.objects.create(name='cart_life_span', int_value=60)
+
+        assert kill_due_carts() == 0
+        assert CartExpiry.objects.get(cart=self.carts[1]).expires_at > timezone.now()
+
+
+class QueryPlansTest(TestCase):
+    def test_hot_queries_use_indexes(self):
+        seed(carts_count=300)
+        for name, (plan, full_scans) in check_query_plans().items():
+            assert full_scans == [], f'{name} fully scans {full_scans}:\n{plan}'
+
+    def test_find_full_scans(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('sample plans are sqlite ones')
+        assert find_full_scans('2 0 0 SCAN carts_cart') == ['carts_cart']
+        assert find_full_scans('2 0 0 SEARCH carts_cart USING INDEX some_idx (updated<?)') == []
+        assert find_full_scans('4 0 0 SCAN carts_cart USING INDEX some_idx') == ['carts_cart']
+        assert find_full_scans('4 0 0 SCAN carts_cart USING INDEX some_idx', limited=True) == []
+
+
+class AsyncReadViewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        sosis = Product.objects.create(name='sosis', stock_quantity=100, price=50)
+        self.user = UserModel.objects.create_user(username='async_reader', password='pass')
+        CartItem.create_cart_items_and_subtract_from_stock(
+            user=self.user, items=[{'products_id': sosis.id, 'quantity': 3}]
+        )
+        call_command('rebuild_cart_daily_totals', stdout=io.StringIO())
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def async_get(self, path, **kwargs):
+        return async_to_sync(self.async_client.get)(path, **kwargs)
+
+    def test_cart_matches_sync_view(self):
+        sync_response = self.client.get('/cart/cart/', headers=self.headers)
+        response = self.async_get('/cart/async/cart/', headers=self.headers)
+        assert response.status_code == 200
+        assert response.json() == sync_response.json()
+        assert response['ETag'] == sync_response['ETag']
+
+        response = self.async_get('/cart/async/cart/', headers={**self.headers, 'If-None-Match': response['ETag']})
+        assert response.status_code == 304
+
+    def test_report_matches_sync_view(self):
+        sync_response = self.client.get('/cart/report/')
+        response = self.async_get('/cart/async/report/')
+        assert response.status_code == 200
+        assert response.json() == sync_response.json()
+        assert response['X-Cache'] == 'HIT'
+
+        response = self.async_get('/cart/async/report/', query_params={'start_date': 'garbage'})
+        assert response.status_code == 400
+
+    def test_authentication(self):
+        response = self.async_get('/cart/async/cart/')
+        assert response.status_code == 401
+        assert 'WWW-Authenticate' in response
+
+        response = self.async_get('/cart/async/cart/', headers={'Authorization': 'Bearer garbage'})
+        assert response.status_code == 401
+        assert response.json()['code'] == 'token_not_valid'
+
+        self.user.is_active = False
+        self.user.save()
+        assert self.async_get('/cart/async/cart/', headers=self.headers).status_code == 401
@@ -1,7 +1,8 @@
 from django.urls import include, path
 from rest_framework import routers
 
-from carts.views import CartViewSet, AllUsersCartSumView
+from carts.async_views import AsyncAllUsersCartSumView, AsyncCartView
+from carts.views import CartViewSet, AllUsersCartSumView, DailyCartSumView, ReportCacheStatsView
 
 router = routers.DefaultRouter()
 router.register('cart', CartViewSet)
@@ -10,4 +11,9 @@ router.register('cart', CartViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('report/', AllUsersCartSumView.as_view(), name="all_users_cart_sum_view"),
+    path('report/cache-stats/', ReportCacheStatsView.as_view(), name="report_cache_stats_view"),
+    path('report/<str:date>/', DailyCartSumView.as_view(), name="daily_cart_sum_view"),
+    # async twins of the read endpoints above, for ASGI deployments
+    path('async/cart/', AsyncCartView.as_view(), name="async_cart_view"),
+    path('async/report/', AsyncAllUsersCartSumView.as_view(), name="async_all_users_cart_sum_view"),
 ]
\ No newline at end of file
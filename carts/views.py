@@ -1,10 +1,22 @@
-from rest_framework import permissions, viewsets, mixins
+import datetime
+import json
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import permissions, viewsets, mixins, generics
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ParseError
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 
-from carts.models import Cart
-from carts.serializers import CartSerializer
+from carts import cart_cache, idempotency, report_cache
+from carts.fast_serializers import serialize_carts
+from carts.models import Cart, CartDailyTotal
+from carts.pagination import ReportCursorPagination
+from carts.serializers import CartDailyTotalSerializer, CartLinesSerializer, CartSerializer
 
 
 class CartViewSet(
@@ -19,21 +31,126 @@ class CartViewSet(
 
     def get_queryset(self):
         """ Filter the queryset by the current user """
-        return self.queryset.filter(user=self.request.user).prefetch_related('items_cart')
+        return self.queryset.filter(user_id=self.request.user.id).prefetch_related('items_cart')
+
+    def list(self, request, *args, **kwargs):
+        """
+        serve user's cart from its cached snapshot when possible, with ETag and Last-Modified headers
+        so an unchanged cart gets a 304 Not Modified
+        """
+        version, snapshot = cart_cache.get_snapshot(request.user.id)
+        if snapshot is None:
+            # same data as self.get_serializer(carts, many=True), built from values_list rows
+            carts, data = serialize_carts(self.filter_queryset(self.get_queryset()))
+            snapshot = cart_cache.store_snapshot(request.user.id, version, carts, data)
+
+        response = get_conditional_response(request, etag=snapshot['etag'], last_modified=snapshot['last_modified'])
+        if response is None:
+            response = Response(snapshot['data'])
+        response['ETag'] = snapshot['etag']
+        if snapshot['last_modified'] is not None:
+            response['Last-Modified'] = http_date(snapshot['last_modified'])
+        return response
+
+    def create(self, request, *args, **kwargs):
+        """
+        with an Idempotency-Key header, a retry of an already created cart gets the first response replayed
+        instead of running (and reserving stock) again
+        """
+        key = request.headers.get(idempotency.HEADER)
+        if not key:
+            return super().create(request, *args, **kwargs)
+        return idempotency.run_once(request.user.id, key, request.data,
+                                    lambda: super(CartViewSet, self).create(request, *args, **kwargs))
 
     def perform_create(self, serializer):
         """ Associate the new object with the current user """
         serializer.save(user=self.request.user)
 
+    @action(detail=False, methods=['patch'], serializer_class=CartLinesSerializer)
+    def lines(self, request):
+        """
+        will apply a few line operations to user's cart, e.g.
+        {"operations": [{"op": "increment", "products": 1, "quantity": 2}, {"op": "remove", "products": 3}]},
+        touching only the named lines and products instead of the whole cart
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(user=request.user)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+def stream_report_json(rows):
+    """ will render report rows as the same json object get_all_carts_sum returns, piece by piece """
+    yield '{'
+    current_date = None
+    for date, username, total_amount in rows:
+        entry = json.dumps({'username': username, 'total_amount': total_amount})
+        if date == current_date:
+            yield ',' + entry
+            continue
+        yield f'{"]," if current_date is not None else ""}{json.dumps(date)}:[{entry}'
+        current_date = date
+    yield ']}' if current_date is not None else '}'
+
+
+def stream_report_ndjson(rows):
+    """ will render report rows as newline delimited json, one row per line """
+    for date, username, total_amount in rows:
+        yield json.dumps({'date': date, 'username': username, 'total_amount': total_amount}) + '\n'
+
+
+REPORT_STREAMS = {
+    'json': (stream_report_json, 'application/json'),
+    'ndjson': (stream_report_ndjson, 'application/x-ndjson'),
+}
+
 
 class AllUsersCartSumView(APIView):
-    """ will return each days carts sum for each user """
+    """
+    will return each days carts sum for each user, served from report cache (see X-Cache header).
+    pass stream=json or stream=ndjson to get it streamed, for reports too big to build in memory
+    """
+    def get(self, request):
+        """ get method """
+        try:
+            start_date = report_cache.normalize_date(request.query_params.get('start_date', None))
+            end_date = report_cache.normalize_date(request.query_params.get('end_date', None))
+        except ValueError as ve:
+            raise ParseError(str(ve))
+
+        stream = request.query_params.get('stream', None)
+        if stream in REPORT_STREAMS:
+            render_rows, content_type = REPORT_STREAMS[stream]
+            rows = Cart.iter_all_carts_sum(start_date=start_date, end_date=end_date,
+                                           chunk_size=settings.CART_REPORT_STREAM_CHUNK_SIZE)
+            return StreamingHttpResponse(render_rows(rows), content_type=content_type)
+
+        result, cache_status = report_cache.get_or_compute(start_date, end_date, Cart.get_all_carts_sum)
+
+        return Response(result, status=status.HTTP_200_OK, headers={'X-Cache': cache_status.upper()})
+
+
+class ReportCacheStatsView(APIView):
+    """ will return hit, miss and stale counters of the report cache """
+    permission_classes = [permissions.IsAdminUser]
+
     def get(self, request):
         """ get method """
-        start_date = request.query_params.get('start_date', None)
-        end_date = request.query_params.get('end_date', None)
+        return Response(report_cache.stats(), status=status.HTTP_200_OK)
 
-        result = Cart.get_all_carts_sum(start_date=start_date, end_date=end_date)
 
-        return Response(result, status=status.HTTP_200_OK)
+class DailyCartSumView(generics.ListAPIView):
+    """ will return one day carts sum for each user, cursor paginated, biggest carts first """
+    serializer_class = CartDailyTotalSerializer
+    pagination_class = ReportCursorPagination
 
+    def get_queryset(self):
+        """ Filter the rollup by the requested day """
+        try:
+            date = datetime.date.fromisoformat(self.kwargs['date'])
+        except ValueError:
+            raise NotFound(f"{self.kwargs['date']} is not a valid date")
+        return CartDailyTotal.objects.filter(date=date).select_related('user').only(
+            'total_amount', 'user_id', 'user__username'
+        )
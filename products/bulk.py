@@ -0,0 +1,121 @@
+"""
+streaming bulk import and export of products, keyed by external_id.
+feeds carry on hand stock, while stock_quantity holds what is left after live carts reservations, so imported
+stock is reduced by reserved quantities (and never below zero) under a lock on the touched rows.
+hot products keep their row stock, the difference to their imported stock is journaled and reaches their
+counters once committed, see carts.hot_stock.restock.
+"""
+import csv
+import json
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Q, Sum
+
+from carts import hot_stock
+from products import catalog
+from products.models import Product
+
+FIELDS = ['external_id', 'name', 'price', 'stock_quantity']
+
+
+class InvalidRow(ValueError):
+    """ indicate that a feed row can not be turned into a product """
+    ...
+
+
+def read_rows(file, file_format: str):
+    """
+    will lazily yield (line number, row) of a csv or ndjson feed, csv rows as dicts and ndjson rows as their
+    raw line, parsed by clean_row, so a malformed line is one bad row instead of the end of the feed
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(file)
+        for row in reader:
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(file, start=1):
+            if line.strip():
+                yield line_number, line
+
+
+def clean_row(row, line_number: int = None) -> dict:
+    """ will validate a feed row (a dict or a json line) and convert its values, raises InvalidRow """
+    where = f'line {line_number}: ' if line_number is not None else ''
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except ValueError as e:
+            raise InvalidRow(f'{where}malformed json {row.strip()[:100]!r}: {e}')
+    if not isinstance(row, dict):
+        raise InvalidRow(f'{where}bad row {row!r}: not an object')
+    try:
+        cleaned = {
+            'external_id': str(row['external_id']).strip(),
+            'name': str(row['name']).strip(),
+            'price': int(row['price']),
+            'stock_quantity': int(row['stock_quantity']),
+        }
+    except (KeyError, TypeError, ValueError) as e:
+        raise InvalidRow(f'{where}bad row {row!r}: {e!r}')
+    if not cleaned['external_id'] or len(cleaned['external_id']) > 64 or len(cleaned['name']) > 64:
+        raise InvalidRow(f'{where}bad row {row!r}: external_id or name is empty or too long')
+    if cleaned['price'] < 0 or cleaned['stock_quantity'] < 0:
+        raise InvalidRow(f'{where}bad row {row!r}: negative price or stock')
+    return cleaned
+
+
+def chunked(iterable, chunk_size: int):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, chunk_size)):
+        yield chunk
+
+
+def upsert_chunk(rows: list) -> int:
+    """
+    will create or update products of given cleaned rows by external_id, taking quantities reserved by
+    live carts out of the on hand stock. returns number of upserted products
+    """
+    rows = {row['external_id']: row for row in rows}
+    with hot_stock.journal(), transaction.atomic():
+        # same primary key lock order as stock reservations, so no reservation slips in between
+        locked = list(
+            Product.objects.select_for_update().filter(external_id__in=rows).order_by('pk').values_list(
+                'pk', 'external_id', 'is_hot', 'stock_quantity'
+            )
+        )
+        locked_ids = [product_id for product_id, _, _, _ in locked]
+        hot = {key: (product_id, stock) for product_id, key, is_hot, stock in locked if is_hot}
+        reserved = dict(
+            Product.objects.filter(pk__in=locked_ids).annotate(
+                reserved=Sum('cart_item_product__quantity', filter=Q(cart_item_product__cart__is_dead=False))
+            ).values_list('external_id', 'reserved')
+        )
+        stocks = {key: max(0, row['stock_quantity'] - (reserved.get(key) or 0)) for key, row in rows.items()}
+        Product.objects.bulk_create(
+            [
+                Product(external_id=key, name=row['name'], price=row['price'],
+                        stock_quantity=hot[key][1] if key in hot else stocks[key])
+                for key, row in rows.items()
+            ],
+            update_conflicts=True, unique_fields=['external_id'], update_fields=['name', 'price', 'stock_quantity'],
+        )
+        if hot:
+            hot_stock.restock({product_id: stocks[key] for key, (product_id, _) in hot.items()})
+        transaction.on_commit(lambda: catalog.invalidate_catalog(locked_ids))
+    return len(rows)
+
+
+def write_products(file, file_format: str, chunk_size: int) -> int:
+    """ will stream all products into file as csv or ndjson, returns number of written products """
+    products = Product.objects.order_by('pk').values_list(*FIELDS).iterator(chunk_size=chunk_size)
+    written_count = 0
+    if file_format == 'csv':
+        writer = csv.writer(file)
+        writer.writerow(FIELDS)
+        for written_count, product in enumerate(products, start=1):
+            writer.writerow(product)
+    else:
+        for written_count, product in enumerate(products, start=1):
+            file.write(json.dumps(dict(zip(FIELDS, product))) + '\n')
+    return written_count
@@ -0,0 +1,86 @@
+"""
+cached product catalog pages.
+a page holds the slow changing product fields and lives for PRODUCT_CATALOG_PAGE_TTL seconds under a catalog
+version bumped on every product save or delete. stock quantities change all the time, so they are cached per
+product for PRODUCT_STOCK_CACHE_TTL seconds only and dropped whenever a reservation changes them.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from products.models import Product
+
+VERSION_KEY = 'catalog:version'
+
+
+def get_cache():
+    return caches[settings.PRODUCT_CATALOG_CACHE_ALIAS]
+
+
+def stock_key(product_id) -> str:
+    return f'catalog:stock:{product_id}'
+
+
+def get_stocks(product_ids) -> dict:
+    """ will return stock quantity of given products, reading database only for the ones not cached """
+    cache = get_cache()
+    cached = cache.get_many([stock_key(product_id) for product_id in product_ids])
+    stocks = {product_id: cached[stock_key(product_id)] for product_id in product_ids if stock_key(product_id) in cached}
+    missing = [product_id for product_id in product_ids if product_id not in stocks]
+    if missing:
+        fetched = dict(Product.objects.filter(pk__in=missing).values_list('pk', 'stock_quantity'))
+        cache.set_many({stock_key(product_id): stock for product_id, stock in fetched.items()},
+                       timeout=settings.PRODUCT_STOCK_CACHE_TTL)
+        stocks.update(fetched)
+    return stocks
+
+
+def invalidate_stocks(product_ids):
+    get_cache().delete_many([stock_key(product_id) for product_id in product_ids])
+
+
+def get_page(after: int, page_size: int, in_stock: bool = False) -> dict:
+    """
+    will return {'results': [...], 'next_after': id or None} of products with id greater than after,
+    ordered by id (keyset pagination). results have ProductSerializer fields
+    """
+    cache = get_cache()
+    version = cache.get(VERSION_KEY, 0)
+    key = f'catalog:page:{version}:{int(in_stock)}:{page_size}:{after}'
+    page = cache.get(key)
+    if page is None:
+        products = Product.objects.filter(pk__gt=after).order_by('pk')
+        if in_stock:
+            products = products.filter(stock_quantity__gt=0)
+        rows = list(products.values('id', 'name', 'price')[:page_size + 1])
+        page = {'results': rows[:page_size], 'next_after': rows[page_size - 1]['id'] if len(rows) > page_size else None}
+        # stock decides which products an in stock page holds, so it can not outlive stock quantities by much
+        cache.set(key, page, timeout=settings.PRODUCT_STOCK_CACHE_TTL if in_stock else settings.PRODUCT_CATALOG_PAGE_TTL)
+
+    stocks = get_stocks([row['id'] for row in page['results']])
+    return {
+        'results': [{**row, 'stock_quantity': stocks.get(row['id'], 0)} for row in page['results']],
+        'next_after': page['next_after'],
+    }
+
+
+def invalidate_catalog(product_ids=()):
+    """ will drop every cached catalog page and cached stock of given products """
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, 1, timeout=None)
+    invalidate_stocks(product_ids)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product(instance, **kwargs):
+    """
+    will drop cached catalog pages once committed. a bump before commit would let another request cache the old
+    rows under the new version
+    """
+    product_id = instance.pk
+    transaction.on_commit(lambda: invalidate_catalog([product_id]))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.bulk import write_products
+
+
+class Command(BaseCommand):
+    help = 'streams all products out as csv or ndjson (external_id, name, price, stock_quantity)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='output file, - (default) for stdout')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], default='ndjson')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file = self.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        started = time.perf_counter()
+        try:
+            written_count = write_products(file, options['format'], options['chunk_size'])
+        finally:
+            if path != '-':
+                file.close()
+
+        elapsed = time.perf_counter() - started
+        self.stderr.write(f'exported {written_count} rows in {elapsed:.1f}s '
+                          f'({written_count / elapsed if elapsed else 0:.0f} rows/sec)')
@@ -0,0 +1,55 @@
+import csv
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.bulk import InvalidRow, chunked, clean_row, read_rows, upsert_chunk
+
+
+class Command(BaseCommand):
+    help = ('streams products from a csv or ndjson feed (external_id, name, price, stock_quantity) and upserts '
+            'them by external_id, chunk by chunk. stock_quantity of the feed is on hand stock, quantities '
+            'reserved in live carts are taken out of it. rows that can not be read or validated are skipped '
+            'and reported with their line number')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='feed file, - for stdin')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], default=None,
+                            help='feed format, guessed from file extension by default')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+
+        imported_count = 0
+        skipped_count = 0
+        started = time.perf_counter()
+
+        def clean_rows():
+            nonlocal skipped_count
+            for line_number, row in read_rows(file, file_format):
+                try:
+                    yield clean_row(row, line_number)
+                except InvalidRow as ir:
+                    skipped_count += 1
+                    self.stderr.write(str(ir))
+
+        try:
+            for chunk in chunked(clean_rows(), options['chunk_size']):
+                imported_count += upsert_chunk(chunk)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f'{imported_count} rows imported, {imported_count / elapsed:.0f} rows/sec')
+        except (ValueError, csv.Error) as e:
+            raise CommandError(f'could not read feed after importing {imported_count} rows: {e}')
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'imported {imported_count} rows, skipped {skipped_count}, in {elapsed:.1f}s '
+            f'({imported_count / elapsed if elapsed else 0:.0f} rows/sec)'
+        ))
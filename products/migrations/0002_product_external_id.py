@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 06:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='external_id',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True, verbose_name="product's id in supplier feed"),
+        ),
+    ]
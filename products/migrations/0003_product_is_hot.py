@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 07:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_product_external_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='is_hot',
+            field=models.BooleanField(default=False, verbose_name='is stock kept in hot counters'),
+        ),
+    ]
@@ -5,9 +5,13 @@ from django.utils.translation import gettext_lazy as _
 class Product(models.Model):
     """ contain products information """
 
+    external_id = models.CharField(_("product's id in supplier feed"), max_length=64, unique=True, null=True,
+                                   blank=True)
     name = models.CharField(_("product's name"), max_length=64)
     price = models.PositiveBigIntegerField(_("product's price"))
     stock_quantity = models.PositiveIntegerField(_("quantity in stock"))
+    # stock of a hot product lives in carts.hot_stock counters, stock_quantity lags behind by its journal rows
+    is_hot = models.BooleanField(_("is stock kept in hot counters"), default=False)
 
     def __str__(self):
         return str(self.name)
@@ -1,3 +1,152 @@
+import io
+import json
+import os
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
 
-# Create your tests here.
+from carts.models import Cart, CartItem
+from carts.reservations import reserve_stock
+from products import catalog
+from products.models import Product
+
+
+class ProductCatalogTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.catalog_url = '/products/catalog/'
+        self.products = [Product.objects.create(name=f'product_{i}', price=10 + i, stock_quantity=i % 3)
+                         for i in range(7)]
+
+    def test_catalog_pages(self):
+        results = []
+        url = f'{self.catalog_url}?page_size=3'
+        while url:
+            page = self.client.get(url).json()
+            results.extend(page['results'])
+            url = page['next']
+        self.assertEqual(results, [
+            {'id': product.id, 'name': product.name, 'price': product.price, 'stock_quantity': product.stock_quantity}
+            for product in self.products
+        ])
+
+        in_stock = self.client.get(self.catalog_url, {'in_stock': 'true'}).json()['results']
+        assert [product['id'] for product in in_stock] == [product.id for product in self.products
+                                                           if product.stock_quantity > 0]
+
+        assert self.client.get(self.catalog_url, {'after': 'abc'}).status_code == 400
+
+    def test_warm_page_needs_no_query(self):
+        self.client.get(self.catalog_url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.catalog_url)
+        assert len(response.json()['results']) == len(self.products)
+
+    def test_stock_and_product_changes_are_served(self):
+        product = self.products[2]
+        self.client.get(self.catalog_url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_stock(product.id, 1)
+        results = self.client.get(self.catalog_url).json()['results']
+        assert results[2]['stock_quantity'] == product.stock_quantity - 1
+
+        product.refresh_from_db()
+        product.name = 'renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        results = self.client.get(self.catalog_url).json()['results']
+        assert results[2]['name'] == 'renamed'
+
+    def test_product_change_is_dropped_from_cache_once_committed(self):
+        product = self.products[2]
+        self.client.get(self.catalog_url)
+        version = catalog.get_cache().get(catalog.VERSION_KEY)
+
+        product.name = 'renamed'
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            product.save()
+            assert catalog.get_cache().get(catalog.VERSION_KEY) == version
+            assert self.client.get(self.catalog_url).json()['results'][2]['name'] == 'product_2'
+        assert len(callbacks) == 1
+        assert catalog.get_cache().get(catalog.VERSION_KEY) != version
+        assert self.client.get(self.catalog_url).json()['results'][2]['name'] == 'renamed'
+
+
+class ProductBulkTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_feed(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as feed:
+            feed.write(content)
+        return path
+
+    def test_import_upserts_by_external_id(self):
+        Product.objects.create(external_id='sku-1', name='old name', price=1, stock_quantity=1)
+        feed = self.write_feed('feed.csv', 'external_id,name,price,stock_quantity\n'
+                                           'sku-1,sosis,50,10\n'
+                                           'sku-2,kalbas,100,7\n'
+                                           'sku-3,broken,-1,7\n')
+
+        call_command('import_products', feed, '--chunk-size', '1', stdout=io.StringIO(), stderr=io.StringIO())
+
+        assert Product.objects.count() == 2
+        assert list(Product.objects.order_by('external_id').values_list('external_id', 'name', 'price',
+                                                                         'stock_quantity')) == [
+            ('sku-1', 'sosis', 50, 10), ('sku-2', 'kalbas', 100, 7)
+        ]
+
+    def test_import_keeps_live_reservations(self):
+        product = Product.objects.create(external_id='sku-1', name='sosis', price=50, stock_quantity=0)
+        for i, is_dead in enumerate((False, True)):
+            cart = Cart.objects.create(user=get_user_model().objects.create_user(username=f'buyer_{i}'),
+                                       is_dead=is_dead)
+            CartItem.objects.create(cart=cart, products=product, quantity=5)
+
+        call_command('import_products', self.write_feed('more.ndjson', json.dumps(
+            {'external_id': 'sku-1', 'name': 'sosis', 'price': 50, 'stock_quantity': 8}
+        ) + '\n'), stdout=io.StringIO())
+        product.refresh_from_db()
+        assert product.stock_quantity == 8 - 5
+
+        call_command('import_products', self.write_feed('less.ndjson', json.dumps(
+            {'external_id': 'sku-1', 'name': 'sosis', 'price': 50, 'stock_quantity': 3}
+        ) + '\n'), stdout=io.StringIO())
+        product.refresh_from_db()
+        assert product.stock_quantity == 0
+
+    def test_malformed_ndjson_lines_are_skipped(self):
+        feed = self.write_feed('feed.ndjson', '\n'.join([
+            json.dumps({'external_id': 'sku-1', 'name': 'sosis', 'price': 50, 'stock_quantity': 10}),
+            '{"external_id": "sku-2", "name": ',
+            '[1, 2]',
+            json.dumps({'external_id': 'sku-3', 'name': 'kalbas', 'price': 100, 'stock_quantity': 7}),
+        ]) + '\n')
+        stdout, stderr = io.StringIO(), io.StringIO()
+
+        call_command('import_products', feed, '--chunk-size', '1', stdout=stdout, stderr=stderr)
+
+        assert list(Product.objects.order_by('external_id').values_list('external_id', flat=True)) == [
+            'sku-1', 'sku-3'
+        ]
+        assert 'skipped 2' in stdout.getvalue()
+        errors = stderr.getvalue().splitlines()
+        assert errors[0].startswith('line 2: malformed json') and errors[1].startswith('line 3: bad row')
+
+    def test_export_round_trip(self):
+        Product.objects.create(external_id='sku-1', name='sosis', price=50, stock_quantity=10)
+        Product.objects.create(external_id='sku-2', name='kalbas', price=100, stock_quantity=7)
+        exported = io.StringIO()
+        call_command('export_products', '--format', 'ndjson', stdout=exported, stderr=io.StringIO())
+
+        Product.objects.all().delete()
+        call_command('import_products', self.write_feed('export.ndjson', exported.getvalue()), stdout=io.StringIO())
+        assert list(Product.objects.order_by('external_id').values_list('external_id', 'stock_quantity')) == [
+            ('sku-1', 10), ('sku-2', 7)
+        ]
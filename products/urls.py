@@ -0,0 +1,7 @@
+from django.urls import path
+
+from products.views import ProductCatalogView
+
+urlpatterns = [
+    path('catalog/', ProductCatalogView.as_view(), name="product_catalog_view"),
+]
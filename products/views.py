@@ -1,3 +1,31 @@
-from django.shortcuts import render
+from django.conf import settings
+from rest_framework import status
+from rest_framework.exceptions import ParseError
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
 
-# Create your views here.
+from products import catalog
+
+
+class ProductCatalogView(APIView):
+    """
+    will return products ordered by id, keyset paginated: pass the id of the last product you got as after.
+    pass in_stock=true to get only products with some stock left
+    """
+    def get(self, request):
+        """ get method """
+        try:
+            after = int(request.query_params.get('after', 0))
+            page_size = int(request.query_params.get('page_size', settings.PRODUCT_CATALOG_PAGE_SIZE))
+        except ValueError:
+            raise ParseError('after and page_size must be integers')
+        page_size = max(1, min(page_size, settings.PRODUCT_CATALOG_MAX_PAGE_SIZE))
+        in_stock = request.query_params.get('in_stock', '').lower() in ('1', 'true', 'yes')
+
+        page = catalog.get_page(after, page_size, in_stock)
+
+        next_url = None
+        if page['next_after'] is not None:
+            next_url = replace_query_param(request.build_absolute_uri(), 'after', page['next_after'])
+        return Response({'next': next_url, 'results': page['results']}, status=status.HTTP_200_OK)